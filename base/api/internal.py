@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+import hmac
+import json
+
+from tornado.escape import utf8
+
+from . import ApiHandler
+from core import db
+
+
+class InternalHandler(ApiHandler):
+    """进程内部状态, 请求头 ``X-Internal-Token`` 要和配置的 ``INTERNAL_TOKEN``
+    一致, 没有配置时不能访问.  过载时也可以访问"""
+
+    admission_control = False
+
+    def prepare(self):
+        # nginx 代理过来的请求都来自 127.0.0.1, 不能按来源地址判断
+        token = self.application.config.get('INTERNAL_TOKEN')
+        given = self.request.headers.get('X-Internal-Token', '')
+        if not token or not hmac.compare_digest(utf8(token), utf8(given)):
+            self.send_error(403)
+
+    def write_json(self, data):
+        self.set_header('Content-Type', 'application/json; charset=UTF-8')
+        self.write(json.dumps(data))
+
+
+class QueryStatsHandler(InternalHandler):
+    def get(self):
+        self.write_json(db.get_query_stats().snapshot())
+
+    def delete(self):
+        db.get_query_stats().reset()
+        self.set_status(204)
+
+
+class TeardownStatsHandler(InternalHandler):
+    def get(self):
+        self.write_json(self.application.teardown_pipeline.snapshot())
+
+    def delete(self):
+        self.application.teardown_pipeline.reset()
+        self.set_status(204)
+
+
+class AdmissionStatsHandler(InternalHandler):
+    def prepare(self):
+        super(AdmissionStatsHandler, self).prepare()
+        if self.application.admission is None and not self._finished:
+            self.send_error(404)
+
+    def get(self):
+        self.write_json(self.application.admission.snapshot())
+
+    def delete(self):
+        self.application.admission.reset()
+        self.set_status(204)
+
+
+class RouteStatsHandler(InternalHandler):
+    def get(self):
+        self.write_json(self.application.router.snapshot())
+
+    def delete(self):
+        self.application.router.reset()
+        self.set_status(204)
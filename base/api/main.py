@@ -1,10 +1,17 @@
 # -*- coding: utf-8 -*-
+from tornado import gen
+
 from . import ApiHandler
 from model import User
 from core import db
+from core.response_cache import cached
 
 
 class MainRequestHandler(ApiHandler):
+    on_initialize_decorators = ApiHandler.on_initialize_decorators + [
+        cached(ttl=30, tables=['user'])]
+
+    @gen.coroutine
     def get(self):
-        user = User.query.get(1)
-        self.write('hello world %s' % user.name)
\ No newline at end of file
+        user = yield User.query.async_get(1)
+        self.write('hello world %s' % user.name)
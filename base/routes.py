@@ -2,7 +2,17 @@
 from __future__ import absolute_import
 
 from .api.main import MainRequestHandler
+from .api.internal import (QueryStatsHandler, RouteStatsHandler,
+                           TeardownStatsHandler, AdmissionStatsHandler)
 
 routes = [
     dict(resource=MainRequestHandler, urls=['/'], endpoint='main'),
-]
\ No newline at end of file
+    dict(resource=QueryStatsHandler, urls=['/_internal/query_stats'],
+         endpoint='query_stats'),
+    dict(resource=RouteStatsHandler, urls=['/_internal/route_stats'],
+         endpoint='route_stats'),
+    dict(resource=TeardownStatsHandler, urls=['/_internal/teardown_stats'],
+         endpoint='teardown_stats'),
+    dict(resource=AdmissionStatsHandler, urls=['/_internal/admission_stats'],
+         endpoint='admission_stats'),
+]
@@ -15,9 +15,4 @@ settings = {
 
 def load_settings(config, **kwargs):
     config.update(**settings)
-    try:
-        from .routes import routes
-
-        config.update_uri(routes)
-    except:
-        pass
\ No newline at end of file
+    config.update_uri('base.routes')
\ No newline at end of file
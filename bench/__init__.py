@@ -0,0 +1,5 @@
+# -*- coding: utf-8 -*-
+"""Micro benchmarks.  Run one from the project root, e.g.::
+
+    python -m bench.db_executor
+"""
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import os
+import tempfile
+
+from core.teardown import TeardownPipeline
+
+
+class BenchApp(object):
+    """Just enough of :class:`main.CommandApp` for ``db.init_app`` so the
+    benchmarks run against sqlite without loading the project settings."""
+
+    import_name = 'bench'
+
+    def __init__(self, **config):
+        self.root_path = tempfile.mkdtemp(prefix='spring-bench-')
+        self.config = {
+            'DEBUG': False,
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///%s' % os.path.join(
+                self.root_path, 'bench.db'),
+            'SQLALCHEMY_TRACK_MODIFICATIONS': True,
+        }
+        self.config.update(config)
+        self.teardown_pipeline = TeardownPipeline()
+
+    def teardown_request(self, f):
+        return self.teardown_pipeline.add(f)
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, int(round(pct / 100.0 * (len(values) - 1))))
+    return values[index]
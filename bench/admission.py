@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""An overloaded worker with and without admission control.  Each request
+waits 10 ms (a query) and then blocks the IOLoop for ``BLOCK`` seconds, so
+one worker serves at most ``1 / BLOCK`` requests a second; ``CLIENTS``
+clients keep sending for ``DURATION`` seconds, give up after ``TIMEOUT``
+and wait ``BACKOFF`` after a 503.  Without admission control the queue
+grows until most requests time out, with it the excess is answered with a
+fast 503 and the admitted requests finish in time.  The lag check alone
+reacts only after the loop has blocked, a burst read in one poll is
+admitted before that, so it is combined with the in-flight cap.  The
+server runs in a forked child process, the clients in this one; blocking
+instead of burning CPU keeps the two from competing for one core."""
+from __future__ import absolute_import, print_function
+
+import logging
+import os
+import signal
+import time
+
+from tornado import gen, web
+from tornado.httpclient import AsyncHTTPClient
+from tornado.httpserver import HTTPServer
+from tornado.ioloop import IOLoop
+from tornado.netutil import bind_sockets
+
+from ._app import percentile
+from core.admission import AdmissionController
+from core.handler import RequestHandler
+from core.teardown import TeardownPipeline
+
+BLOCK = 0.02
+CLIENTS = 64
+DURATION = 3
+TIMEOUT = 1.0
+BACKOFF = 0.2
+
+
+class Application(web.Application):
+    def __init__(self, *args, **kwargs):
+        super(Application, self).__init__(*args, **kwargs)
+        self.teardown_pipeline = TeardownPipeline()
+        self.admission = None
+
+
+class Handler(RequestHandler):
+    @gen.coroutine
+    def get(self):
+        yield gen.sleep(0.01)
+        time.sleep(BLOCK)
+        self.write('ok')
+
+
+def serve(admission):
+    sockets = bind_sockets(0, '127.0.0.1')
+    pid = os.fork()
+    if pid:
+        return pid, sockets[0].getsockname()[1]
+    logging.getLogger('tornado.access').disabled = True
+    IOLoop.clear_instance()
+    io_loop = IOLoop()
+    io_loop.make_current()
+    app = Application([('/', Handler)])
+    app.admission = admission
+    HTTPServer(app).add_sockets(sockets)
+    io_loop.start()
+
+
+@gen.coroutine
+def load(url):
+    client = AsyncHTTPClient(max_clients=CLIENTS)
+    codes = {}
+    latencies = []
+    stop = time.time() + DURATION
+
+    @gen.coroutine
+    def worker():
+        while time.time() < stop:
+            start = time.time()
+            response = yield client.fetch(url, request_timeout=TIMEOUT,
+                                          raise_error=False)
+            codes[response.code] = codes.get(response.code, 0) + 1
+            if response.code == 200:
+                latencies.append(time.time() - start)
+            elif response.code == 503:
+                yield gen.sleep(BACKOFF)
+
+    yield [worker() for _ in range(CLIENTS)]
+    raise gen.Return((codes, latencies))
+
+
+def main():
+    print('%-24s %8s %8s %8s %8s %8s' % ('', 'ok/s', 'p50 ms', 'p99 ms',
+                                         '503', 'timeout'))
+    for label, admission in [
+            ('no admission control', None),
+            ('in-flight 16', AdmissionController(max_in_flight=16)),
+            ('in-flight 16, lag 100ms', AdmissionController(
+                lag_threshold=0.1, max_in_flight=16))]:
+        pid, port = serve(admission)
+        try:
+            AsyncHTTPClient.configure(None)
+            codes, latencies = IOLoop.current().run_sync(
+                lambda: load('http://127.0.0.1:%d/' % port))
+        finally:
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+        print('%-24s %8.0f %8.1f %8.1f %8d %8d' % (
+            label, codes.get(200, 0) / float(DURATION),
+            percentile(latencies, 50) * 1000,
+            percentile(latencies, 99) * 1000,
+            codes.get(503, 0), codes.get(599, 0)))
+
+
+if __name__ == '__main__':
+    main()
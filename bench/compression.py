@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""Serving a 200 KB javascript file to clients that accept gzip: tornado's
+``StaticFileHandler`` as is, with ``compress_response=True`` (gzip on every
+request) and ``core.compression.StaticFileHandler`` with the file
+precompressed by ``precompress`` and kept in the memory cache.  Also the
+cost of compressing a streamed JSON response chunk by chunk.  Client and
+server share one IOLoop, ``CONCURRENCY`` requests are kept in flight."""
+from __future__ import absolute_import, print_function
+
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import tornado.web
+from tornado import gen
+from tornado.httpclient import AsyncHTTPClient
+from tornado.httpserver import HTTPServer
+from tornado.ioloop import IOLoop
+from tornado.netutil import bind_sockets
+
+from core import compression
+
+REQUESTS = 1000
+CONCURRENCY = 16
+HEADERS = {'Accept-Encoding': 'gzip'}
+
+
+def make_static():
+    root = tempfile.mkdtemp(prefix='spring-bench-')
+    lines = ['function f%d(a, b) { return a + b * %d; }\n' % (i, i)
+             for i in range(5000)]
+    with open(os.path.join(root, 'app.js'), 'w') as f:
+        f.write(''.join(lines))
+    return root
+
+
+@gen.coroutine
+def load(url):
+    client = AsyncHTTPClient(max_clients=CONCURRENCY)
+    sizes = []
+    queue = iter(range(REQUESTS))
+
+    @gen.coroutine
+    def worker():
+        for _ in queue:
+            response = yield client.fetch(url, headers=HEADERS,
+                                          decompress_response=False)
+            sizes.append(len(response.body))
+
+    start = time.time()
+    yield [worker() for _ in range(CONCURRENCY)]
+    raise gen.Return((time.time() - start, sizes))
+
+
+def serve(app, path):
+    sockets = bind_sockets(0, '127.0.0.1')
+    server = HTTPServer(app)
+    server.add_sockets(sockets)
+    url = 'http://127.0.0.1:%d%s' % (sockets[0].getsockname()[1], path)
+    elapsed, sizes = IOLoop.current().run_sync(lambda: load(url))
+    server.stop()
+    return REQUESTS / elapsed, sizes[0]
+
+
+def streaming(policy, encoding):
+    rows = [{'id': i, 'content': 'answer %d ' % i * 8} for i in range(500)]
+    chunks = [json.dumps(rows[i:i + 50]) for i in range(0, 500, 50)]
+    level = dict(policy.types['application/json'])[encoding]
+    start = time.time()
+    size = 0
+    for _ in range(200):
+        encoder = compression.ENCODERS[encoding](level)
+        for index, chunk in enumerate(chunks):
+            size += len(encoder.compress(chunk, index == len(chunks) - 1))
+    elapsed = (time.time() - start) / 200
+    return elapsed, size / 200, sum(len(c) for c in chunks)
+
+
+def main():
+    root = make_static()
+    policy = compression.CompressionPolicy()
+    compression.StaticFileHandler.configure(policy, 32 * 1024 * 1024,
+                                            1024 * 1024)
+    compression.precompress(root, policy)
+    size = os.path.getsize(os.path.join(root, 'app.js'))
+    print('app.js %d bytes' % size)
+    print('%-28s %9s %12s' % ('static handler', 'req/s', 'bytes sent'))
+    for label, settings in [
+            ('tornado', {}),
+            ('tornado, compress_response', {'compress_response': True}),
+            ('precompressed, cached', {
+                'static_handler_class': compression.StaticFileHandler})]:
+        app = tornado.web.Application(static_path=root, **settings)
+        rate, sent = serve(app, '/static/app.js')
+        print('%-28s %9.0f %12d' % (label, rate, sent))
+    shutil.rmtree(root)
+
+    print()
+    for encoding in sorted(policy.types['application/json']):
+        elapsed, compressed, raw = streaming(policy, encoding[0])
+        print('stream %-5s %7.2f ms per response, %d -> %d bytes' % (
+            encoding[0], elapsed * 1000, raw, compressed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""Config reads: the old ``Config`` (``EnvConfigType`` metaclass, ``[]``
+going through ``getattr``) versus the ``ConfigSnapshot`` returned by
+``load_tornado_settings`` now."""
+from __future__ import absolute_import, print_function
+
+import signal
+import timeit
+
+from core.settings import ConfigSnapshot, environ
+
+READS = 1000000
+
+
+class EnvConfigType(type):
+    def __getattribute__(cls, key):
+        value = object.__getattribute__(cls, key)
+        env = environ.get(key)
+
+        if env is not None:
+            value = type(value)(env)
+        return value
+
+
+class OldConfig(object):
+    __metaclass__ = EnvConfigType
+
+    def __getitem__(self, item):
+        return getattr(self, item)
+
+    SQLALCHEMY_TRACK_MODIFICATIONS = True
+
+
+def best(statement, namespace, number=READS):
+    # compile the loop into a function so timeit's global lookups are not
+    # measured
+    code = compile('def run(n):\n'
+                   '    for _ in range(n):\n'
+                   '        %s\n' % statement, '<bench>', 'exec')
+    exec(code, namespace)
+    results = []
+    for _ in range(3):
+        start = timeit.default_timer()
+        namespace['run'](number)
+        results.append(timeit.default_timer() - start)
+    return min(results) / number
+
+
+def main():
+    old = OldConfig()
+    old.DEBUG = False
+    snapshot = ConfigSnapshot(())
+    snapshot.setdefault('DEBUG', False)
+    snapshot.setdefault('SQLALCHEMY_TRACK_MODIFICATIONS', True)
+    cases = [
+        ('old Config.KEY (class)', 'Config.SQLALCHEMY_TRACK_MODIFICATIONS',
+         {'Config': OldConfig}),
+        ('old config.KEY', 'config.DEBUG', {'config': old}),
+        ("old config['KEY']", "config['SQLALCHEMY_TRACK_MODIFICATIONS']",
+         {'config': old}),
+        ('snapshot config.KEY', 'config.DEBUG', {'config': snapshot}),
+        ("snapshot config['KEY']", "config['SQLALCHEMY_TRACK_MODIFICATIONS']",
+         {'config': snapshot}),
+    ]
+    for label, statement, namespace in cases:
+        print('%-26s %6.1f ns/read' % (
+            label, best(statement, namespace) * 1e9))
+    print('%-26s %6.1f us' % (
+        'reload()', best('config.reload()', {'config': snapshot}, 1000) * 1e6))
+
+
+if __name__ == '__main__':
+    # Python ignores SIGPIPE, so piping into ``head`` ended in an IOError
+    # (EPIPE) traceback; exit quietly like other command line tools instead
+    signal.signal(signal.SIGPIPE, signal.SIG_DFL)
+    main()
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""IOLoop tail latency with slow and fast queries run inline on the loop
+versus through ``db.run``.
+
+A probe callback is scheduled every millisecond; its lateness is the time
+every other request and websocket on the loop would have waited."""
+from __future__ import absolute_import, print_function
+
+import time
+
+from sqlalchemy import event
+from tornado import gen
+from tornado.ioloop import IOLoop
+
+from core.database import SQLAlchemy
+from ._app import BenchApp, percentile
+
+SLOW_QUERIES = 20
+FAST_QUERIES = 200
+SLOW_SECONDS = 0.05
+
+
+def make_db():
+    db = SQLAlchemy()
+    app = BenchApp(SQLALCHEMY_EXECUTOR_WORKERS=4)
+    db.init_app(app)
+    db.app = app
+
+    @event.listens_for(db.get_engine(app), 'connect')
+    def register_sleep(dbapi_connection, connection_record):
+        dbapi_connection.create_function('sleep', 1, time.sleep)
+
+    return db
+
+
+@gen.coroutine
+def probe(lags, done):
+    while not done:
+        scheduled = time.time()
+        yield gen.sleep(0.001)
+        lags.append(time.time() - scheduled - 0.001)
+
+
+@gen.coroutine
+def workload(db, use_executor):
+    def slow():
+        return db.session.execute('SELECT sleep(%f)' % SLOW_SECONDS).scalar()
+
+    def fast():
+        return db.session.execute('SELECT 1').scalar()
+
+    calls = [slow] * SLOW_QUERIES + [fast] * FAST_QUERIES
+    calls = calls[::2] + calls[1::2]
+    if use_executor:
+        yield [db.run(fn) for fn in calls]
+    else:
+        for fn in calls:
+            fn()
+            yield gen.moment
+        db.session.remove()
+
+
+@gen.coroutine
+def measure(db, use_executor):
+    lags, done = [], []
+    probing = probe(lags, done)
+    start = time.time()
+    yield workload(db, use_executor)
+    elapsed = time.time() - start
+    done.append(True)
+    yield probing
+    raise gen.Return((elapsed, lags))
+
+
+def main():
+    db = make_db()
+    for label, use_executor in (('inline', False), ('db.run', True)):
+        elapsed, lags = IOLoop.current().run_sync(
+            lambda: measure(db, use_executor))
+        print('%-8s total %.3fs  loop lag p50 %.2fms p99 %.2fms max %.2fms'
+              % (label, elapsed, percentile(lags, 50) * 1000,
+                 percentile(lags, 99) * 1000, max(lags or [0]) * 1000))
+
+
+if __name__ == '__main__':
+    main()
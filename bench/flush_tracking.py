@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""Flush cost of modification tracking.
+
+``off``: SQLALCHEMY_TRACK_MODIFICATIONS = False.  ``idle``: tracking on but
+nothing listens, so recording is skipped.  ``listening``: a receiver is
+connected to ``models_committed`` and the touched rows are recorded.
+"""
+from __future__ import absolute_import, print_function
+
+import time
+
+from core.database import SQLAlchemy, models_committed
+from ._app import BenchApp
+
+LOADED = 2000
+TOUCHED = 10
+ROUNDS = 300
+
+
+def setup(track):
+    db = SQLAlchemy()
+
+    class Row(db.Model):
+        id = db.Column(db.Integer, primary_key=True)
+        value = db.Column(db.Integer)
+
+    app = BenchApp(SQLALCHEMY_DATABASE_URI='sqlite://',
+                   SQLALCHEMY_TRACK_MODIFICATIONS=track)
+    db.init_app(app)
+    db.app = app
+    db.create_all()
+    db.session.add_all(Row(id=i + 1, value=0) for i in range(LOADED))
+    db.session.commit()
+    return db, app, Row
+
+
+def run(db, Row):
+    rows = Row.query.all()
+    start = time.time()
+    for n in range(ROUNDS):
+        for row in rows[n % 100:n % 100 + TOUCHED]:
+            row.value += 1
+        db.session.flush()
+    elapsed = time.time() - start
+    db.session.rollback()
+    db.session.remove()
+    return elapsed / ROUNDS
+
+
+def on_commit(sender, changes):
+    pass
+
+
+def main():
+    for label, track, listen in (('off', False, False),
+                                 ('idle', True, False),
+                                 ('listening', True, True)):
+        db, app, Row = setup(track)
+        if listen:
+            models_committed.connect(on_commit, app)
+        print('%-10s %.3f ms per flush' % (label, run(db, Row) * 1000))
+        models_committed.disconnect(on_commit)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""Collision stress test for ``generator_string_id``: worker processes are
+forked the way ``http_server.start(n)`` does it (``fork_processes``) and
+generate ids as fast as they can, one at a time and in reserved blocks.
+Afterwards the ids of all processes must be unique, the ids of each process
+increasing, and all of them ``length`` long.
+
+The old generator (3 random digits per centisecond) is run the same way
+for comparison."""
+from __future__ import absolute_import, print_function
+
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from tornado.process import fork_processes, task_id
+
+PROCESSES = 8
+IDS = 50000
+BLOCK = 100
+LENGTH = 16
+
+
+def old_generator_string_id(length=16, start_num=1):
+    diff = str(
+        int((datetime.now() - datetime(2006, 1, 2)).total_seconds() * 100))
+    randstr = random.randint(100, 999)
+    fill = '0' * (length - 4 - len(diff))
+    return '{start_num}{fill}{diff}{randstr}'.format(
+        start_num=start_num, fill=fill, diff=diff, randstr=randstr)
+
+
+def child(mode, directory):
+    fork_processes(PROCESSES, max_restarts=0)
+    from core import generator_string_id, ids
+
+    start = time.time()
+    if mode == 'block':
+        result = []
+        while len(result) < IDS:
+            result.extend(ids.generator.reserve(BLOCK, LENGTH))
+    elif mode == 'single':
+        result = [generator_string_id(LENGTH) for _ in range(IDS)]
+    else:
+        result = [old_generator_string_id(LENGTH) for _ in range(IDS)]
+    elapsed = time.time() - start
+    with open(os.path.join(directory, '%d' % task_id()), 'w') as f:
+        f.write('%f\n' % elapsed)
+        f.write('\n'.join(result))
+
+
+def check(mode):
+    directory = tempfile.mkdtemp(prefix='spring-ids-')
+    try:
+        subprocess.check_call([sys.executable, '-m', 'bench.id_collisions',
+                               mode, directory])
+        seen = set()
+        total = duplicates = unordered = wrong_length = 0
+        rates = []
+        for name in os.listdir(directory):
+            with open(os.path.join(directory, name)) as f:
+                lines = f.read().splitlines()
+            rates.append(IDS / float(lines[0]))
+            generated = lines[1:]
+            total += len(generated)
+            unordered += sum(1 for a, b in zip(generated, generated[1:])
+                             if not a < b)
+            wrong_length += sum(1 for i in generated if len(i) != LENGTH)
+            for i in generated:
+                if i in seen:
+                    duplicates += 1
+                seen.add(i)
+        print('%-6s %7d ids  %6d duplicates  %6d unordered  %d wrong length'
+              '  %8.0f ids/s per process' % (
+                  mode, total, duplicates, unordered, wrong_length,
+                  sum(rates) / len(rates)))
+        return duplicates == unordered == wrong_length == 0
+    finally:
+        shutil.rmtree(directory)
+
+
+def main():
+    ok = all([check('single'), check('block')])
+    check('old')
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 3:
+        child(*sys.argv[1:])
+    else:
+        main()
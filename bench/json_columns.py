@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""Loading wide rows with many JSON columns: eager decoding versus lazy
+decoding when the handler reads none, one or all of the columns, for every
+installed codec, plus the storage size of compressed ``JsonText``."""
+from __future__ import absolute_import, print_function
+
+import time
+
+from core import JsonText, codec
+from core.database import SQLAlchemy
+from ._app import BenchApp
+
+ROWS = 2000
+COLUMNS = 20
+REPEAT = 3
+
+
+def make_models(db):
+    def columns(**kwargs):
+        return dict(('c%d' % i, db.Column(JsonText(**kwargs)))
+                    for i in range(COLUMNS))
+
+    Eager = type('Eager', (db.Model,), dict(
+        id=db.Column(db.Integer, primary_key=True), **columns(lazy=False)))
+    Lazy = type('Lazy', (db.Model,), dict(
+        id=db.Column(db.Integer, primary_key=True), **columns()))
+    Compressed = type('Compressed', (db.Model,), dict(
+        id=db.Column(db.Integer, primary_key=True),
+        **columns(compress=True, compress_threshold=256)))
+    return Eager, Lazy, Compressed
+
+
+def value(row, column):
+    return {'id': row, 'column': column,
+            'tags': ['tag%d' % i for i in range(10)],
+            'scores': [i * 0.5 for i in range(40)],
+            'nested': {'name': 'item %d' % row, 'enabled': True}}
+
+
+def load(db, model, touch):
+    best = None
+    for _ in range(REPEAT):
+        start = time.time()
+        for instance in model.query.all():
+            for i in range(touch):
+                getattr(instance, 'c%d' % i)
+        elapsed = time.time() - start
+        db.session.remove()
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    db = SQLAlchemy()
+    app = BenchApp()
+    db.init_app(app)
+    db.app = app
+    models = make_models(db)
+    db.create_all()
+    for model in models:
+        db.session.add_all([
+            model(id=row + 1, **dict(('c%d' % i, value(row, i))
+                                     for i in range(COLUMNS)))
+            for row in range(ROWS)])
+        db.session.commit()
+        db.session.remove()
+
+    for name in ('json', 'ujson', 'orjson'):
+        try:
+            codec.set_default(name)
+        except ImportError:
+            continue
+        Eager, Lazy, Compressed = models
+        for label, model, touch in (
+                ('eager', Eager, COLUMNS),
+                ('lazy, read 0', Lazy, 0),
+                ('lazy, read 1', Lazy, 1),
+                ('lazy, read all', Lazy, COLUMNS),
+                ('compressed, read all', Compressed, COLUMNS)):
+            print('%-7s %-22s %6.0f rows/s' % (
+                name, label, ROWS / load(db, model, touch)))
+
+    for model in models[1:]:
+        size = db.session.execute(
+            'select sum(length(c0)) from %s' % model.__table__.name).scalar()
+        print('%-10s c0 stored %7.1f KB' % (model.__name__, size / 1024.0))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""``Model.query.get`` throughput with and without the primary key cache.
+
+Every lookup runs in a fresh session, like the first ``get`` of a request.
+Before timing it checks that a cached snapshot given to ``session.merge()``
+can be edited and committed.
+"""
+from __future__ import absolute_import, print_function
+
+import sys
+import time
+
+from core.database import SQLAlchemy
+from ._app import BenchApp
+
+ROWS = 100
+LOOKUPS = 20000
+
+
+def make_models(db):
+    class Plain(db.Model):
+        id = db.Column(db.Integer, primary_key=True)
+        name = db.Column(db.String(20))
+        email = db.Column(db.String(64))
+
+    class Cached(db.Model):
+        __pk_cache__ = True
+        id = db.Column(db.Integer, primary_key=True)
+        name = db.Column(db.String(20))
+        email = db.Column(db.String(64))
+
+    return Plain, Cached
+
+
+def run(db, model):
+    start = time.time()
+    for i in range(LOOKUPS):
+        model.query.get(i % ROWS + 1).name
+        db.session.remove()
+    return LOOKUPS / (time.time() - start)
+
+
+def check_merge(db, model):
+    snapshot = model.query.get(1)
+    db.session.remove()
+    merged = db.session.merge(snapshot)
+    merged.name = 'merged'
+    in_session = merged in db.session
+    db.session.commit()
+    db.session.remove()
+    saved = model.query.get(1).name == 'merged'
+    db.session.remove()
+    print('merge of a snapshot: in session %s, saved %s' % (in_session,
+                                                            saved))
+    return in_session and saved
+
+
+def main():
+    db = SQLAlchemy()
+    app = BenchApp()
+    db.init_app(app)
+    db.app = app
+    models = make_models(db)
+    db.create_all()
+    for model in models:
+        for i in range(ROWS):
+            db.session.add(model(id=i + 1, name='user%d' % i,
+                                 email='user%d@example.com' % i))
+    db.session.commit()
+    db.session.remove()
+
+    if not check_merge(db, models[1]):
+        sys.exit(1)
+    for model in models:
+        print('%-7s %8.0f get/s' % (model.__name__, run(db, model)))
+    print('pk cache', db.get_pk_cache().stats())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""Throughput of a read endpoint that serializes 500 rows to JSON: computed
+on every request, served from ``core.response_cache`` and answered with 304
+because the client sent the ETag it already has.  Client and server share
+one IOLoop, ``CONCURRENCY`` requests are kept in flight."""
+from __future__ import absolute_import, print_function
+
+import json
+import time
+
+from tornado import gen, web
+from tornado.httpclient import AsyncHTTPClient
+from tornado.httpserver import HTTPServer
+from tornado.ioloop import IOLoop
+from tornado.netutil import bind_sockets
+
+from ._app import percentile
+from core.handler import RequestHandler
+from core.response_cache import ResponseCache
+from core.teardown import TeardownPipeline
+
+ROWS = [{'id': i, 'user_id': 1, 'content': 'answer %d ' % i * 8}
+        for i in range(500)]
+REQUESTS = 2000
+CONCURRENCY = 16
+
+
+class Application(web.Application):
+    def __init__(self, *args, **kwargs):
+        super(Application, self).__init__(*args, **kwargs)
+        self.teardown_pipeline = TeardownPipeline()
+
+
+class PlainHandler(RequestHandler):
+    def get(self):
+        self.set_header('Content-Type', 'application/json; charset=UTF-8')
+        self.write(json.dumps(ROWS))
+
+
+class CachedHandler(PlainHandler):
+    on_initialize_decorators = [ResponseCache().cached(ttl=60)]
+
+
+@gen.coroutine
+def load(url, headers):
+    client = AsyncHTTPClient(max_clients=CONCURRENCY)
+    latencies = []
+    queue = iter(range(REQUESTS))
+
+    @gen.coroutine
+    def worker():
+        for _ in queue:
+            start = time.time()
+            yield client.fetch(url, headers=headers, raise_error=False)
+            latencies.append(time.time() - start)
+
+    start = time.time()
+    yield [worker() for _ in range(CONCURRENCY)]
+    raise gen.Return((time.time() - start, latencies))
+
+
+def main():
+    sockets = bind_sockets(0, '127.0.0.1')
+    server = HTTPServer(Application([('/plain', PlainHandler),
+                                     ('/cached', CachedHandler)]))
+    server.add_sockets(sockets)
+    base = 'http://127.0.0.1:%d' % sockets[0].getsockname()[1]
+    io_loop = IOLoop.current()
+    etag = io_loop.run_sync(
+        lambda: AsyncHTTPClient().fetch(base + '/cached')).headers['Etag']
+
+    print('%-12s %10s %10s %10s' % ('response', 'req/s', 'p50 ms', 'p99 ms'))
+    for label, path, headers in [
+            ('computed', '/plain', {}),
+            ('cached', '/cached', {}),
+            ('304', '/cached', {'If-None-Match': etag})]:
+        elapsed, latencies = io_loop.run_sync(
+            lambda: load(base + path, headers))
+        print('%-12s %10.0f %10.2f %10.2f' % (
+            label, REQUESTS / elapsed, percentile(latencies, 50) * 1000,
+            percentile(latencies, 99) * 1000))
+    server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""Route lookup with a few hundred routes: tornado's default router, which
+tries every regex in order, versus ``core.routing.CompiledRouter``.  The
+routes are registered through ``Config.update_uri`` under four url
+prefixes, half of them literal paths and half with path arguments.  Both
+routers must pick the same handler and arguments for every path."""
+from __future__ import absolute_import, print_function
+
+import os
+import random
+import tempfile
+import time
+
+import tornado.web
+from tornado.httputil import HTTPServerRequest
+
+from core import routing
+from core.handler import RequestHandler
+from core.settings import Config
+
+PREFIXES = ['', 'api', 'admin', 'ws']
+RESOURCES = 40
+LOOKUPS = 50000
+
+
+def make_routes():
+    config = Config()
+    for prefix in PREFIXES:
+        routes = []
+        for i in range(RESOURCES):
+            for suffix, url in [('list', '/things%d' % i),
+                                ('item', r'/things%d/(\d+)' % i),
+                                ('child', r'/things%d/([^/]+)/items' % i)]:
+                name = '%s_%s%d' % (suffix, prefix or 'base', i)
+                handler = type(str(name), (RequestHandler,), {})
+                routes.append(dict(resource=handler, urls=[url],
+                                   endpoint=name))
+        config.update_uri(routes, prefix)
+    return config.URIS
+
+
+def make_paths(count):
+    rng = random.Random(7)
+    paths = []
+    for _ in range(count):
+        prefix = rng.choice(PREFIXES)
+        prefix = '/' + prefix if prefix else ''
+        i = rng.randrange(RESOURCES)
+        kind = rng.random()
+        if kind < 0.5:
+            paths.append('%s/things%d' % (prefix, i))
+        elif kind < 0.8:
+            paths.append('%s/things%d/%d' % (prefix, i, rng.randrange(1000)))
+        elif kind < 0.95:
+            paths.append('%s/things%d/x%d/items' % (prefix, i, i))
+        else:
+            paths.append('%s/missing/%d' % (prefix, i))
+    return paths
+
+
+def describe(delegate):
+    return (delegate.handler_class, delegate.path_args, delegate.path_kwargs)
+
+
+def lookups_per_second(router, requests):
+    start = time.time()
+    for request in requests:
+        router.find_handler(request)
+    return len(requests) / (time.time() - start)
+
+
+def main():
+    uris = make_routes()
+    static_path = tempfile.mkdtemp(prefix='spring-bench-')
+    plain = tornado.web.Application(uris, static_path=static_path)
+    compiled = tornado.web.Application(uris, static_path=static_path)
+    router = routing.install(compiled)
+    print('%d routes, %d literal' % (
+        len(router.rules), len(router.compile().static)))
+
+    requests = [HTTPServerRequest(method='GET', uri=path)
+                for path in make_paths(LOOKUPS)]
+    for request in requests[:5000]:
+        expected = describe(plain.find_handler(request))
+        assert describe(compiled.find_handler(request)) == expected, \
+            request.path
+    router.reset()
+
+    for label, app in [('tornado, regex in order', plain),
+                       ('compiled', compiled)]:
+        rate = max(lookups_per_second(app.default_router, requests)
+                   for _ in range(3))
+        print('%-24s %9.0f lookups/s' % (label, rate))
+    print('top endpoints: %s, misses %d' % (
+        ', '.join('%s=%d' % (item['endpoint'], item['hits'])
+                  for item in router.snapshot()['endpoints'][:3]),
+        router.misses))
+    os.rmdir(static_path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""Model to dict conversion: a hand-rolled ``getattr`` loop with the old
+``str_time`` (building the timezone and format on every call) versus the
+compiled serializer, one row at a time and for the whole list."""
+from __future__ import absolute_import, print_function
+
+import time
+from datetime import datetime, timedelta
+
+import pytz
+
+import core
+from ._app import BenchApp
+
+ROWS = 5000
+REPEAT = 5
+
+
+class Answer(core.Model):
+    id = core.db.Column(core.db.Integer, primary_key=True)
+    user_id = core.db.Column(core.db.Integer)
+    question_id = core.db.Column(core.db.Integer)
+    content = core.db.Column(core.db.String(200))
+    votes = core.db.Column(core.db.Integer)
+    status = core.db.Column(core.db.String(20))
+    anonymous = core.db.Column(core.db.Boolean)
+    created = core.db.Column(core.DateTime)
+    updated = core.db.Column(core.DateTime)
+
+
+def old_str_time(date_time, with_timezone=True):
+    if not date_time:
+        return date_time
+    if not date_time.tzinfo:
+        date_time = pytz.utc.localize(date_time)
+    Beijing = pytz.timezone('Asia/Shanghai')
+    local_time = date_time.astimezone(Beijing)
+
+    fmt = "%Y-%m-%d %H:%M:%S"
+    if with_timezone:
+        fmt = "%Y-%m-%d %H:%M:%S %Z%z"
+    return local_time.strftime(fmt)
+
+
+def naive(rows):
+    columns = Answer.__table__.columns
+    result = []
+    for row in rows:
+        item = {}
+        for column in columns:
+            value = getattr(row, column.key)
+            if isinstance(value, datetime):
+                value = old_str_time(value)
+            item[column.key] = value
+        result.append(item)
+    return result
+
+
+def best(fn, rows):
+    elapsed = []
+    for _ in range(REPEAT):
+        start = time.time()
+        fn(rows)
+        elapsed.append(time.time() - start)
+    return ROWS / min(elapsed)
+
+
+def main():
+    app = BenchApp()
+    core.db.init_app(app)
+    core.db.app = app
+    core.db.create_all()
+    start = datetime(2017, 1, 1)
+    core.db.session.add_all([
+        Answer(id=i + 1, user_id=i % 100, question_id=i % 700,
+               content='answer %d' % i, votes=i % 13, status='published',
+               anonymous=False, created=start + timedelta(minutes=i),
+               updated=start + timedelta(hours=i))
+        for i in range(ROWS)])
+    core.db.session.commit()
+    rows = Answer.query.all()
+
+    serializer = Answer.serializer()
+    assert naive(rows[:1]) == serializer.many(rows[:1])
+    print('%-28s %8.0f rows/s' % ('getattr loop, old str_time',
+                                  best(naive, rows)))
+    print('%-28s %8.0f rows/s' % (
+        'compiled, one()', best(lambda r: [serializer.one(x) for x in r], rows)))
+    print('%-28s %8.0f rows/s' % ('compiled, many()',
+                                  best(serializer.many, rows)))
+
+
+if __name__ == '__main__':
+    main()
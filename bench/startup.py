@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+"""Cold start time of the ``manage.py`` commands, each run in a fresh
+interpreter: the command line entry points and the time until the app a
+command needs is built (all routes for ``run``, config and database only
+for ``db``).  ``python manage.py startup-profile`` shows where the time
+goes.  CPU time of the child process is reported, it varies less than
+wall time on a busy machine."""
+from __future__ import absolute_import, print_function
+
+import os
+import resource
+import subprocess
+import sys
+
+RUNS = 7
+
+CASES = [
+    ('manage.py --help', ['manage.py', '--help']),
+    ('manage.py db history', ['manage.py', 'db', 'history']),
+    ('run: app built', ['-c', "import manage; manage.build_app('run')"]),
+    ('db: app built', ['-c', "import manage; manage.build_app('db')"]),
+]
+
+
+def _children_cpu():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def median_time(args):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    elapsed = []
+    with open(os.devnull, 'w') as devnull:
+        for _ in range(RUNS):
+            start = _children_cpu()
+            subprocess.check_call([sys.executable] + args, cwd=root,
+                                  stdout=devnull)
+            elapsed.append(_children_cpu() - start)
+    return sorted(elapsed)[len(elapsed) // 2]
+
+
+def main():
+    for label, args in CASES:
+        print('%-22s %7.0f ms' % (label, median_time(args) * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""Peak memory of a JSON list endpoint that materializes the whole result
+(``query.all()`` + ``json.dumps``) versus one that streams it with
+``query.stream()`` and ``RequestHandler.write_json_stream``.
+
+Each mode runs in its own process since ``ru_maxrss`` only ever grows; the
+client discards the body as it arrives."""
+from __future__ import absolute_import, print_function
+
+import json
+import resource
+import subprocess
+import sys
+import time
+
+from tornado import gen, web
+from tornado.httpclient import AsyncHTTPClient
+from tornado.httpserver import HTTPServer
+from tornado.ioloop import IOLoop
+from tornado.netutil import bind_sockets
+
+from core.database import SQLAlchemy
+from core.handler import RequestHandler
+from ._app import BenchApp
+
+SIZES = (20000, 100000)
+CHUNK_SIZE = 500
+
+
+def make_db(root_path=None):
+    db = SQLAlchemy()
+    app = BenchApp()
+    if root_path is not None:
+        app.root_path = root_path
+        app.config['SQLALCHEMY_DATABASE_URI'] = (
+            'sqlite:///%s/bench.db' % root_path)
+    db.init_app(app)
+    db.app = app
+
+    class Answer(db.Model):
+        id = db.Column(db.Integer, primary_key=True)
+        user_id = db.Column(db.Integer, index=True)
+        content = db.Column(db.String(200))
+
+    return db, app, Answer
+
+
+def serialize(answer):
+    return {'id': answer.id, 'user_id': answer.user_id,
+            'content': answer.content}
+
+
+def populate(rows):
+    db, app, Answer = make_db()
+    db.create_all()
+    db.session.bulk_insert_mappings(Answer, [
+        dict(id=i + 1, user_id=1, content='answer %d ' % i * 8)
+        for i in range(rows)])
+    db.session.commit()
+    db.session.remove()
+    return app.root_path
+
+
+def child(mode, root_path):
+    db, app, Answer = make_db(root_path)
+
+    class Application(web.Application):
+        teardown_pipeline = app.teardown_pipeline
+
+    class AllHandler(RequestHandler):
+        def get(self):
+            answers = Answer.query.filter_by(user_id=1).all()
+            self.set_header('Content-Type', 'application/json; charset=UTF-8')
+            self.write(json.dumps([serialize(a) for a in answers]))
+
+    class StreamHandler(RequestHandler):
+        @gen.coroutine
+        def get(self):
+            query = Answer.query.filter_by(user_id=1)
+            yield self.write_json_stream(query.stream(CHUNK_SIZE), serialize)
+
+    sockets = bind_sockets(0, '127.0.0.1')
+    port = sockets[0].getsockname()[1]
+    server = HTTPServer(Application([('/all', AllHandler),
+                                     ('/stream', StreamHandler)]))
+    server.add_sockets(sockets)
+    received = [0]
+
+    def on_chunk(data):
+        received[0] += len(data)
+
+    @gen.coroutine
+    def fetch():
+        yield AsyncHTTPClient().fetch(
+            'http://127.0.0.1:%d/%s' % (port, mode),
+            streaming_callback=on_chunk, request_timeout=600)
+
+    # set up the connection and the mappers first, so only the request
+    # itself is measured
+    Answer.query.limit(1).all()
+    db.session.remove()
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    IOLoop.current().run_sync(fetch)
+    elapsed = time.time() - start
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps([after - before, received[0], elapsed]))
+
+
+def main():
+    for rows in SIZES:
+        root_path = populate(rows)
+        for mode in ('all', 'stream'):
+            output = subprocess.check_output(
+                [sys.executable, '-m', 'bench.stream_json', mode, root_path])
+            peak_kb, size, elapsed = json.loads(output.splitlines()[-1])
+            print('%7d rows %-6s +%7.1f MB peak  %6.1f MB body  %5.2fs' % (
+                rows, mode, peak_kb / 1024.0, size / 1048576.0, elapsed))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 3:
+        child(*sys.argv[1:])
+    else:
+        main()
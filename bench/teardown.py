@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""Request latency when every request ends with a slow teardown hook.  The
+hook stands in for closing a session that holds a MySQL connection: the
+rollback that returns the connection to the pool blocks for a round trip
+(``ROUND_TRIP`` seconds here).  ``inline`` runs it in ``on_finish`` the way
+``teardown_request_funcs`` used to, ``deferred`` registers it with
+``defer=True`` and hands the blocking part to a thread pool like
+``SQLAlchemy._shutdown_session`` does.  Client and server share one IOLoop,
+``CONCURRENCY`` requests are kept in flight."""
+from __future__ import absolute_import, print_function
+
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from tornado import gen, web
+from tornado.httpclient import AsyncHTTPClient
+from tornado.httpserver import HTTPServer
+from tornado.ioloop import IOLoop
+from tornado.netutil import bind_sockets
+
+from ._app import percentile
+from core.handler import RequestHandler
+from core.teardown import TeardownPipeline
+
+ROUND_TRIP = 0.002
+REQUESTS = 1000
+CONCURRENCY = 16
+
+
+class Application(web.Application):
+    def __init__(self, *args, **kwargs):
+        super(Application, self).__init__(*args, **kwargs)
+        self.teardown_pipeline = TeardownPipeline()
+
+
+class Handler(RequestHandler):
+    def get(self):
+        self.write('ok')
+
+
+def make_app(mode, executor):
+    app = Application([('/', Handler)])
+
+    def close_session(response_or_exc):
+        time.sleep(ROUND_TRIP)
+
+    if mode == 'inline':
+        app.teardown_pipeline.add(close_session)
+    else:
+        app.teardown_pipeline.add(
+            lambda response_or_exc: executor.submit(close_session, None),
+            defer=True, timeout=1)
+    return app
+
+
+@gen.coroutine
+def load(url):
+    client = AsyncHTTPClient(max_clients=CONCURRENCY)
+    latencies = []
+    queue = iter(range(REQUESTS))
+
+    @gen.coroutine
+    def worker():
+        for _ in queue:
+            start = time.time()
+            yield client.fetch(url)
+            latencies.append(time.time() - start)
+
+    start = time.time()
+    yield [worker() for _ in range(CONCURRENCY)]
+    raise gen.Return((time.time() - start, latencies))
+
+
+def run(mode):
+    executor = ThreadPoolExecutor(CONCURRENCY)
+    sockets = bind_sockets(0, '127.0.0.1')
+    server = HTTPServer(make_app(mode, executor))
+    server.add_sockets(sockets)
+    url = 'http://127.0.0.1:%d/' % sockets[0].getsockname()[1]
+    elapsed, latencies = IOLoop.current().run_sync(lambda: load(url))
+    server.stop()
+    executor.shutdown()
+    return elapsed, latencies
+
+
+def main():
+    print('%-10s %10s %10s %10s' % ('teardown', 'req/s', 'p50 ms', 'p99 ms'))
+    for mode in ['inline', 'deferred']:
+        elapsed, latencies = run(mode)
+        print('%-10s %10.0f %10.2f %10.2f' % (
+            mode, REQUESTS / elapsed, percentile(latencies, 50) * 1000,
+            percentile(latencies, 99) * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,18 +1,25 @@
 # -*- coding: utf-8 -*-
 
 import re
-from datetime import datetime
-import json
+import sys
+import zlib
+import base64
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from itertools import islice
 
 import pytz
 from database import SQLAlchemy
 from migrate import Migrate
 
-from sqlalchemy.orm import relationship
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import relationship, Mapper
 from sqlalchemy.types import String, TypeDecorator, Text
 from sqlalchemy.ext.declarative import declared_attr
 from sqlalchemy import DateTime as SdateTime
-from .handler import RequestHandler
+from . import codec, ids
+from .database import lazy_values
+from .serializer import compile_serializer, register_converter
 from .settings import load_tornado_settings
 
 db = SQLAlchemy()
@@ -20,22 +27,39 @@ migrate = Migrate()
 
 
 def generator_string_id(length=16, start_num=1):
-    # 填充数 + 2006-01-02 到当前时间的秒数 + 秒后两位 + 3位随机数
+    # 填充数 + 2006-01-02 到当前时间的厘秒数 + 2位 worker 号 + 序号, 见 core.ids
     # length 最小15
-    import random
+    return ids.generator.next_id(length, start_num)
 
-    diff = str(
-        int((datetime.now() - datetime(2006, 01, 02)).total_seconds() * 100))
-    randstr = random.randint(100, 999)
-    fill = '0' * (length - 4 - len(diff))
-    id = '{start_num}{fill}{diff}{randstr}'.format(
-        start_num=start_num, fill=fill, diff=diff, randstr=randstr)
-    return id
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _as_mapping(mapper, row):
+    if isinstance(row, dict):
+        return row
+    # 模型实例, 只取已经赋值的列
+    lazy_values.load_all(row)
+    return dict((prop.key, getattr(row, prop.key))
+                for prop in mapper.column_attrs if prop.key in row.__dict__)
 
 
 class CRUDMixin(object):
     """Mixin that adds convenience methods for CRUD (create, read, update, delete)
     operations.
+
+    The ``bulk_*`` methods bypass the unit of work, so their rows are not
+    sent through :data:`~core.database.models_committed`: each committed
+    chunk sends :data:`~core.database.models_bulk_committed` with
+    ``(model class, operation)`` instead.  A receiver that has to see every
+    write (audit, search indexing, caches) connects to both signals, as
+    :mod:`core.response_cache` does.
     """
 
     @classmethod
@@ -44,19 +68,141 @@ class CRUDMixin(object):
         instance = cls(**kwargs)
         return instance.save()
 
+    @classmethod
+    def bulk_create(cls, rows, chunk_size=1000, return_pks=False):
+        """Insert ``rows`` (dicts or instances, any iterable) with one
+        executemany and one commit per chunk of ``chunk_size`` rows.
+
+        With ``return_pks`` the generated primary keys are returned in row
+        order; this needs one INSERT per row to read them back.
+
+        The bulk methods write through a session of their own: changes
+        pending in ``db.session`` are neither flushed nor committed.  They
+        send ``models_bulk_committed``, not ``models_committed``.
+        """
+        mapper = inspect(cls)
+        pk_keys = [mapper.get_property_by_column(column).key
+                   for column in mapper.primary_key]
+        pks = []
+        with cls._bulk_session() as session:
+            for chunk in _chunks(rows, chunk_size):
+                mappings = [dict(_as_mapping(mapper, row)) for row in chunk]
+                session.bulk_insert_mappings(cls, mappings,
+                                             return_defaults=return_pks)
+                cls._commit_bulk(session, 'insert')
+                if return_pks:
+                    for mapping in mappings:
+                        pk = tuple(mapping.get(key) for key in pk_keys)
+                        pks.append(pk if len(pk) > 1 else pk[0])
+        return pks if return_pks else None
+
+    @classmethod
+    def bulk_update(cls, rows, chunk_size=1000):
+        """Update ``rows`` (dicts or instances that include the primary key)
+        with one executemany and one commit per chunk.  Sends
+        ``models_bulk_committed``, not ``models_committed``."""
+        mapper = inspect(cls)
+        with cls._bulk_session() as session:
+            for chunk in _chunks(rows, chunk_size):
+                session.bulk_update_mappings(
+                    cls, [_as_mapping(mapper, row) for row in chunk])
+                cls._commit_bulk(session, 'update')
+
+    @classmethod
+    def bulk_upsert(cls, rows, chunk_size=1000, update_columns=None):
+        """Insert ``rows``, updating the existing row on a duplicate key.
+
+        On MySQL every chunk is a single multi-row
+        ``INSERT ... ON DUPLICATE KEY UPDATE``, so all rows must give the
+        same columns (``ValueError`` otherwise).  ``update_columns`` limits
+        the columns overwritten on a duplicate (default: every non primary
+        key column given).  Other databases fall back to ``session.merge``
+        per row, still with one commit per chunk.  Each chunk sends
+        ``models_bulk_committed``; only the ``session.merge`` fallback also
+        sends ``models_committed`` for its instances.
+        """
+        mapper = inspect(cls)
+        with cls._bulk_session() as session:
+            dialect = None
+            for chunk in _chunks(rows, chunk_size):
+                if dialect is None:
+                    dialect = session.get_bind(mapper).dialect.name
+                if dialect == 'mysql':
+                    # 属性名转换为列名
+                    values = [
+                        dict((mapper.get_property(key).columns[0].key, value)
+                             for key, value in
+                             _as_mapping(mapper, row).iteritems())
+                        for row in chunk]
+                    session.execute(
+                        cls._upsert_statement(mapper, values, update_columns))
+                else:
+                    for row in chunk:
+                        session.merge(
+                            row if isinstance(row, cls) else cls(**row))
+                cls._commit_bulk(session, 'update')
+
+    @classmethod
+    def _upsert_statement(cls, mapper, values, update_columns):
+        from sqlalchemy.dialects.mysql import insert
+
+        columns = set(values[0])
+        for row in values:
+            if set(row) != columns:
+                raise ValueError(
+                    'bulk_upsert rows must all give the same columns, got '
+                    '%s and %s' % (sorted(columns), sorted(row)))
+        stmt = insert(mapper.local_table).values(values)
+        if update_columns is None:
+            pk_names = set(column.key for column in mapper.primary_key)
+            update_columns = [name for name in values[0]
+                              if name not in pk_names]
+        return stmt.on_duplicate_key_update(
+            **dict((name, stmt.inserted[name]) for name in update_columns))
+
+    @staticmethod
+    @contextmanager
+    def _bulk_session():
+        session = db.create_session({})
+        try:
+            yield session
+        finally:
+            session.close()
+
+    @classmethod
+    def _commit_bulk(cls, session, operation):
+        # 每批只发送一次 models_bulk_committed 信号
+        session.record_bulk_change(cls, operation)
+        session.commit()
+
     def update(self, commit=True, **kwargs):
         """Update specific fields of a record."""
         for attr, value in kwargs.iteritems():
             setattr(self, attr, value)
         return commit and self.save() or self
 
-    def save(self, commit=True):
-        """Save the record."""
+    def save(self, commit=True, group=False):
+        """Save the record.
+
+        With ``group=True`` the write joins the next group commit and a
+        future resolving with the record once it is durable is returned,
+        see :meth:`core.database.SQLAlchemy.group_commit`.
+        """
+        if group:
+            return db.group_commit(self)
         db.session.add(self)
         if commit:
             db.session.commit()
         return self
 
+    @classmethod
+    def serializer(cls, fields=None, exclude=None, converters=None):
+        """返回转换成 dict 的函数, 见 :mod:`core.serializer`"""
+        return compile_serializer(cls, fields, exclude, converters)
+
+    def to_dict(self, fields=None, exclude=None):
+        return compile_serializer(type(self), fields, exclude).one(self)
+
     def delete(self, commit=True):
         """Remove the record from the database."""
         db.session.delete(self)
@@ -74,23 +220,96 @@ class Model(CRUDMixin, db.Model):
 
 
 class JsonString(TypeDecorator):
+    """JSON 列.  ``codec`` 见 :mod:`core.codec`, 默认用已安装的最快实现.
+
+    通过模型加载时不立即解码, 第一次访问属性才解码, 没有用到的列不花时间;
+    ``lazy=False`` 关闭.  查询列 (``session.query(Model.data)``) 得到的也是解码
+    后的值, 只有 ``session.execute()`` 返回没有解码的 :class:`_Encoded`, 见
+    :mod:`core.database.lazy_values`.
+    """
     impl = String
 
+    #: 压缩存储的前缀, JSON 文本不会以它开头
+    COMPRESSED = 'Z'
+
+    def __init__(self, *args, **kwargs):
+        self.codec = kwargs.pop('codec', None)
+        self.lazy = kwargs.pop('lazy', True)
+        super(JsonString, self).__init__(*args, **kwargs)
+
+    def encode(self, value):
+        return codec.get(self.codec).dumps(value)
+
+    def decode(self, raw):
+        if raw[:1] == self.COMPRESSED:
+            raw = zlib.decompress(base64.b64decode(raw[1:])).decode('utf-8')
+        return codec.get(self.codec).loads(raw)
+
     def process_bind_param(self, value, dialect):
-        return json.dumps(value)
+        if isinstance(value, _Encoded):
+            # 没有解码过, 原样写回
+            return value.raw
+        return self.encode(value)
 
     def process_result_value(self, value, dialect):
-        return json.loads(value)
+        if value is None:
+            return None
+        if self.lazy:
+            return _Encoded(value, self)
+        return self.decode(value)
 
     def copy(self):
-        return JsonString(self.impl.length)
+        return self.__class__(self.impl.length, codec=self.codec,
+                              lazy=self.lazy)
 
 
 class JsonText(JsonString):
+    """``compress=True`` 时, 编码后不短于 ``compress_threshold`` 的值用 zlib
+    压缩存储 (``COMPRESSED`` 前缀 + base64), 没有前缀的旧数据照常读取."""
     impl = Text
 
+    def __init__(self, *args, **kwargs):
+        self.compress = kwargs.pop('compress', False)
+        self.compress_threshold = kwargs.pop('compress_threshold', 1024)
+        super(JsonText, self).__init__(*args, **kwargs)
+
+    def encode(self, value):
+        data = super(JsonText, self).encode(value)
+        if not self.compress or len(data) < self.compress_threshold:
+            return data
+        if not isinstance(data, bytes):
+            data = data.encode('utf-8')
+        return self.COMPRESSED + base64.b64encode(
+            zlib.compress(data)).decode('ascii')
+
     def copy(self):
-        return JsonText(self.impl.length)
+        return self.__class__(self.impl.length, codec=self.codec,
+                              lazy=self.lazy, compress=self.compress,
+                              compress_threshold=self.compress_threshold)
+
+
+class _Encoded(lazy_values.LazyValue):
+    """还没有解码的 JSON 列值"""
+    __slots__ = ('raw', 'type')
+
+    def __init__(self, raw, type_):
+        self.raw = raw
+        self.type = type_
+
+    def load(self):
+        return self.type.decode(self.raw)
+
+    def __repr__(self):
+        return '<encoded %r>' % (self.raw[:40],)
+
+
+@event.listens_for(Mapper, 'mapper_configured')
+def _lazy_json_columns(mapper, class_):
+    keys = [prop.key for prop in mapper.column_attrs
+            if len(prop.columns) == 1 and isinstance(prop.columns[0].type, JsonString) and
+            prop.columns[0].type.lazy]
+    if keys:
+        lazy_values.hold_back(mapper, keys)
 
 
 class DateTime(TypeDecorator):
@@ -106,6 +325,32 @@ class DateTime(TypeDecorator):
         return pytz.utc.localize(value)
 
 
+BEIJING = pytz.timezone('Asia/Shanghai')
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+TIME_FORMAT_WITH_TIMEZONE = "%Y-%m-%d %H:%M:%S %Z%z"
+
+# UTC 整点 -> (整点, 下一个整点, 北京时间的偏移, 时区后缀).  1901 年以后北京时间
+# 的切换都在 UTC 整点, 同一小时内偏移不变; _beijing_hour 是上一次用到的那个小时
+_beijing_offsets = {}
+_MAX_BEIJING_OFFSETS = 4096
+_beijing_hour = (datetime.max, datetime.min, None, None)
+
+
+def _beijing_offset(utc_time):
+    global _beijing_hour
+    start = utc_time.replace(minute=0, second=0, microsecond=0)
+    hour = _beijing_offsets.get(start)
+    if hour is None:
+        local_time = pytz.utc.localize(start).astimezone(BEIJING)
+        hour = (start, start + timedelta(hours=1), local_time.utcoffset(),
+                local_time.strftime(' %Z%z'))
+        if len(_beijing_offsets) >= _MAX_BEIJING_OFFSETS:
+            _beijing_offsets.clear()
+        _beijing_offsets[start] = hour
+    _beijing_hour = hour
+    return hour
+
+
 def str_time(date_time, with_timezone=True):
     """将数据库取出来的时间转化为北京时间字符串"""
     if not date_time:
@@ -114,25 +359,29 @@ def str_time(date_time, with_timezone=True):
     if not date_time.tzinfo:
         # 没有时间戳信息，加上utc时间信息
         date_time = pytz.utc.localize(date_time)
-    Beijing = pytz.timezone('Asia/Shanghai')
-    local_time = date_time.astimezone(Beijing)
-
-    fmt = "%Y-%m-%d %H:%M:%S"
+    utc_time = date_time.replace(tzinfo=None) - date_time.utcoffset()
+    hour = _beijing_hour
+    if not hour[0] <= utc_time < hour[1]:
+        hour = _beijing_offset(utc_time)
+    t = utc_time + hour[2]
+    value = '%04d-%02d-%02d %02d:%02d:%02d' % (
+        t.year, t.month, t.day, t.hour, t.minute, t.second)
     if with_timezone:
-        fmt = "%Y-%m-%d %H:%M:%S %Z%z"
-    str_time = local_time.strftime(fmt)
-    return str_time
+        return value + hour[3]
+    return value
+
+
+register_converter(SdateTime, str_time)
 
 
 def str_to_time(str_time):
     """将时间字符串转化为带有时间戳的datetime类型"""
     try:
-        dt = datetime.strptime(str_time, "%Y-%m-%d %H:%M:%S")
+        dt = datetime.strptime(str_time, TIME_FORMAT)
     except ValueError:
         dt = datetime.strptime(str_time, "%Y-%m-%d")
     # 默认认为时间字符串所表示的是北京时间
-    Beijing = pytz.timezone('Asia/Shanghai')
-    local_time = Beijing.localize(dt)
+    local_time = BEIJING.localize(dt)
     utc_time = local_time.astimezone(pytz.utc)
     return utc_time
 
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""请求准入控制, ``make_app`` 里 :func:`init_app` 启用.  过载时在运行
+``prepare`` 和 handler 之前直接返回, 按顺序检查:
+
+- IOLoop 延迟: 定时器实际运行时间比预定的晚 ``ADMISSION_LAG_THRESHOLD`` 秒以上
+  时返回 503, 已经在排队的请求不会再加重负载
+- 正在处理的请求数达到 ``ADMISSION_MAX_IN_FLIGHT`` 时返回 503
+- 每个 endpoint 的令牌桶 (``ADMISSION_ENDPOINT_LIMITS``, ``{endpoint: (每秒
+  请求数, 突发数)}``), 用完时返回 503
+- 每个客户端的令牌桶 (``ADMISSION_CLIENT_RATE``, ``ADMISSION_CLIENT_BURST``),
+  用完时返回 429.  客户端默认按 ``request.remote_ip`` 区分, 在 nginx 后面要打开
+  ``XHEADERS``, 否则都是 127.0.0.1; ``ADMISSION_CLIENT_KEY`` 可以换成别的函数
+  (收到 handler, 返回 key), 比如按登录用户区分
+
+拒绝的响应都带 ``Retry-After``.  拒绝的原因和 endpoint 记在
+:attr:`AdmissionController.shed`, 见 ``/_internal/admission_stats``.
+handler 类设置 ``admission_control = False`` 时不检查.
+"""
+from __future__ import absolute_import
+
+import math
+import time
+from collections import Counter, OrderedDict
+
+from tornado.ioloop import IOLoop
+
+from .routing import endpoint_name
+
+
+class TokenBucket(object):
+    __slots__ = ('rate', 'burst', 'tokens', 'stamp')
+
+    def __init__(self, rate, burst, now):
+        self.rate = float(rate)
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = now
+
+    def take(self, now):
+        """取一个令牌; 不够时返回还要等的秒数, 否则返回 0"""
+        tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        if tokens >= 1:
+            self.tokens = tokens - 1
+            return 0
+        self.tokens = tokens
+        return (1 - tokens) / self.rate
+
+
+class LagMonitor(object):
+    """每 ``interval`` 秒运行一次的定时器, 记录它比预定时间晚了多少秒"""
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.lag = 0.0
+        self.max_lag = 0.0
+        self._io_loop = None
+        self._expected = None
+
+    def ensure_started(self):
+        # worker fork 之后才有自己的 IOLoop, 第一个请求时启动
+        io_loop = IOLoop.current()
+        if self._io_loop is not io_loop:
+            self._io_loop = io_loop
+            self._schedule(io_loop)
+
+    def current(self):
+        """现在的延迟: 下一次定时器已经过期多久.  IOLoop 阻塞后同一次 poll
+        读到的请求在定时器之前处理, 这时 :attr:`lag` 还是阻塞前测到的值"""
+        return max(0.0, self._io_loop.time() - self._expected)
+
+    def _schedule(self, io_loop):
+        expected = self._expected = io_loop.time() + self.interval
+        io_loop.call_at(expected, self._probe, io_loop, expected)
+
+    def _probe(self, io_loop, expected):
+        if io_loop is not self._io_loop:
+            return
+        self.lag = max(0.0, io_loop.time() - expected)
+        if self.lag > self.max_lag:
+            self.max_lag = self.lag
+        self._schedule(io_loop)
+
+
+def _remote_ip(handler):
+    return handler.request.remote_ip
+
+
+class AdmissionController(object):
+    def __init__(self, lag_threshold=None, max_in_flight=None,
+                 endpoint_limits=None, client_rate=None, client_burst=None,
+                 max_clients=10000, retry_after=1, lag_interval=0.05,
+                 client_key=None):
+        self.lag_threshold = lag_threshold
+        self.max_in_flight = max_in_flight
+        self.endpoint_limits = dict(endpoint_limits or {})
+        self.client_rate = client_rate
+        self.client_burst = client_burst or client_rate
+        self.max_clients = max_clients
+        self.retry_after = retry_after
+        self.client_key = client_key or _remote_ip
+        self.monitor = LagMonitor(lag_interval)
+        self.admitted = 0
+        #: 拒绝的原因 -> 次数
+        self.shed = Counter()
+        #: 拒绝的 endpoint -> 次数
+        self.shed_endpoints = Counter()
+        self._endpoints = {}
+        self._clients = OrderedDict()
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config['ADMISSION_LAG_THRESHOLD'],
+                   config['ADMISSION_MAX_IN_FLIGHT'],
+                   config['ADMISSION_ENDPOINT_LIMITS'],
+                   config['ADMISSION_CLIENT_RATE'],
+                   config['ADMISSION_CLIENT_BURST'],
+                   config['ADMISSION_MAX_CLIENTS'],
+                   config['ADMISSION_RETRY_AFTER'],
+                   client_key=config['ADMISSION_CLIENT_KEY'])
+
+    def admit(self, handler, in_flight):
+        """允许时返回 None, 否则返回 ``(status, reason, retry_after)``"""
+        if self.lag_threshold is not None:
+            self.monitor.ensure_started()
+            if self.monitor.current() > self.lag_threshold:
+                return self._reject(handler, 503, 'lag', self.retry_after)
+        if self.max_in_flight is not None and in_flight >= self.max_in_flight:
+            return self._reject(handler, 503, 'in_flight', self.retry_after)
+        now = time.time()
+        if self.endpoint_limits:
+            name = endpoint_name(type(handler))
+            bucket = self._endpoints.get(name)
+            if bucket is None and name in self.endpoint_limits:
+                rate, burst = self.endpoint_limits[name]
+                bucket = self._endpoints[name] = TokenBucket(rate, burst, now)
+            wait = bucket.take(now) if bucket is not None else 0
+            if wait:
+                return self._reject(handler, 503, 'endpoint_rate', wait)
+        if self.client_rate:
+            wait = self._client_bucket(self.client_key(handler),
+                                       now).take(now)
+            if wait:
+                return self._reject(handler, 429, 'client_rate', wait)
+        self.admitted += 1
+        return None
+
+    def _client_bucket(self, client, now):
+        bucket = self._clients.get(client)
+        if bucket is None:
+            if len(self._clients) >= self.max_clients:
+                # 去掉最早加入的客户端, 它下次来时令牌桶是满的
+                self._clients.popitem(last=False)
+            bucket = self._clients[client] = TokenBucket(
+                self.client_rate, self.client_burst, now)
+        return bucket
+
+    def _reject(self, handler, status, reason, retry_after):
+        self.shed[reason] += 1
+        self.shed_endpoints[endpoint_name(type(handler))] += 1
+        return status, reason, int(math.ceil(retry_after))
+
+    def snapshot(self):
+        return {
+            'admitted': self.admitted,
+            'shed': dict(self.shed),
+            'shed_endpoints': sorted(
+                ({'endpoint': name, 'shed': count}
+                 for name, count in self.shed_endpoints.items()),
+                key=lambda item: -item['shed']),
+            'lag_ms': round(self.monitor.lag * 1000, 3),
+            'max_lag_ms': round(self.monitor.max_lag * 1000, 3),
+            'clients': len(self._clients),
+        }
+
+    def reset(self):
+        self.admitted = 0
+        self.shed.clear()
+        self.shed_endpoints.clear()
+        self.monitor.max_lag = 0.0
+
+
+def init_app(app):
+    config = app.config
+    config.setdefault('ADMISSION_ENABLED', True)
+    config.setdefault('ADMISSION_LAG_THRESHOLD', 0.5)
+    config.setdefault('ADMISSION_MAX_IN_FLIGHT', None)
+    config.setdefault('ADMISSION_ENDPOINT_LIMITS', {})
+    config.setdefault('ADMISSION_CLIENT_RATE', None)
+    config.setdefault('ADMISSION_CLIENT_BURST', None)
+    config.setdefault('ADMISSION_MAX_CLIENTS', 10000)
+    config.setdefault('ADMISSION_RETRY_AFTER', 1)
+    config.setdefault('ADMISSION_CLIENT_KEY', None)
+    app.admission = None
+    if config['ADMISSION_ENABLED']:
+        app.admission = AdmissionController.from_config(config)
+    return app.admission
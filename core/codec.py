@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""JSON 编解码器, :class:`core.JsonString` 等列类型使用.
+
+默认使用已安装的最快实现 (orjson > ujson > json), 也可以指定::
+
+    from core import codec
+    codec.set_default('json')
+
+    data = db.Column(JsonText(codec='ujson'))
+"""
+from __future__ import absolute_import
+
+import json
+from collections import namedtuple
+
+Codec = namedtuple('Codec', 'name dumps loads')
+
+
+def _orjson():
+    import orjson
+
+    def dumps(value):
+        return orjson.dumps(value).decode('utf-8')
+
+    return Codec('orjson', dumps, orjson.loads)
+
+
+def _ujson():
+    import ujson
+    return Codec('ujson', ujson.dumps, ujson.loads)
+
+
+def _json():
+    return Codec('json', json.dumps, json.loads)
+
+
+_factories = {'orjson': _orjson, 'ujson': _ujson, 'json': _json}
+_codecs = {}
+_default = []
+
+
+def register(name, dumps, loads):
+    """注册一个编解码器, ``dumps`` 需要返回字符串"""
+    _codecs[name] = Codec(name, dumps, loads)
+    return _codecs[name]
+
+
+def get(name=None):
+    """按名字返回编解码器, ``None`` 返回默认的.  未安装时抛出 ImportError"""
+    if name is None:
+        if not _default:
+            _default.append(_fastest())
+        return _default[0]
+    if isinstance(name, Codec):
+        return name
+    codec = _codecs.get(name)
+    if codec is None:
+        if name not in _factories:
+            raise KeyError('Unknown JSON codec %r' % name)
+        codec = _codecs[name] = _factories[name]()
+    return codec
+
+
+def set_default(name):
+    _default[:] = [get(name)]
+
+
+def _fastest():
+    for name in ('orjson', 'ujson'):
+        try:
+            return get(name)
+        except ImportError:
+            pass
+    return get('json')
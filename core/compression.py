@@ -0,0 +1,334 @@
+# -*- coding: utf-8 -*-
+"""响应压缩, ``make_app`` 里 :func:`init_app` 启用:
+
+- :class:`CompressionTransform` 按 Content-Type 压缩动态响应, 每种类型可以
+  配置使用的编码和压缩级别 (``COMPRESSION_TYPES``).  分多次 ``flush`` 的响应
+  (比如 ``write_json_stream``) 逐块压缩, 一次写完的响应小于
+  ``COMPRESSION_MIN_LENGTH`` 时不压缩
+- 安装了 ``brotli`` 时优先用 br (``COMPRESSION_ENCODINGS`` 的顺序), 否则 gzip
+- ``python manage.py compress-static`` 把 ``static/`` 下的文件压缩好放在旁边
+  (``app.js.br``, ``app.js.gz``), :class:`StaticFileHandler` 直接返回压缩好的
+  文件, 并在内存里缓存常用的小文件
+"""
+from __future__ import absolute_import
+
+import functools
+import mimetypes
+import os
+import zlib
+
+import tornado.web
+
+from .database.cache import LRUCache
+
+#: 默认压缩的类型和每种编码的压缩级别
+COMPRESSION_TYPES = dict.fromkeys([
+    'text/html', 'text/plain', 'text/css', 'text/javascript', 'text/xml',
+    'application/javascript', 'application/x-javascript', 'application/json',
+    'application/xml', 'application/atom+xml', 'application/xhtml+xml',
+    'image/svg+xml'], {'br': 4, 'gzip': 6})
+
+#: 预压缩静态文件用的压缩级别, 只压缩一次所以用最高的
+STATIC_LEVELS = {'br': 11, 'gzip': 9}
+
+EXTENSIONS = {'br': '.br', 'gzip': '.gz'}
+
+
+class GzipEncoder(object):
+    def __init__(self, level):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED,
+                                            16 + zlib.MAX_WBITS)
+
+    def compress(self, data, finishing):
+        data = self._compressor.compress(data)
+        if finishing:
+            return data + self._compressor.flush()
+        return data + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+
+class BrotliEncoder(object):
+    def __init__(self, level):
+        import brotli
+        self._compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data, finishing):
+        data = self._compressor.process(data)
+        if finishing:
+            return data + self._compressor.finish()
+        return data + self._compressor.flush()
+
+
+ENCODERS = {'br': BrotliEncoder, 'gzip': GzipEncoder}
+
+
+def available(encoding):
+    try:
+        ENCODERS[encoding](1)
+    except ImportError:
+        return False
+    return True
+
+
+def parse_accept_encoding(header):
+    """``Accept-Encoding`` 里每种编码的 q 值"""
+    accepted = {}
+    for item in header.split(','):
+        params = item.split(';')
+        name = params[0].strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        for param in params[1:]:
+            key, _, value = param.partition('=')
+            if key.strip() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[name] = q
+    return accepted
+
+
+def guess_type(path):
+    # 和 tornado.web.StaticFileHandler.get_content_type 一样
+    mime_type, encoding = mimetypes.guess_type(path)
+    if encoding == 'gzip':
+        return 'application/gzip'
+    elif encoding is not None or mime_type is None:
+        return 'application/octet-stream'
+    return mime_type
+
+
+class CompressionPolicy(object):
+    def __init__(self, types=None, encodings=('br', 'gzip'), min_length=1024):
+        encodings = [name for name in encodings if available(name)]
+        #: content type -> [(encoding, level)], 按优先顺序
+        self.types = {}
+        for ctype, levels in (types or COMPRESSION_TYPES).items():
+            options = [(name, levels[name]) for name in encodings
+                       if name in levels]
+            if options:
+                self.types[ctype] = options
+        self.min_length = min_length
+        self._accepted = {}
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config['COMPRESSION_TYPES'],
+                   config['COMPRESSION_ENCODINGS'],
+                   config['COMPRESSION_MIN_LENGTH'])
+
+    def choose(self, accept_encoding, ctype, encodings=None):
+        """客户端接受的编码里 q 值最高的 ``(encoding, level)``, 相同时按配置的
+        顺序; 没有可用的编码时返回 None"""
+        accepted = self._accepted.get(accept_encoding)
+        if accepted is None:
+            if len(self._accepted) > 256:
+                self._accepted.clear()
+            accepted = self._accepted[accept_encoding] = \
+                parse_accept_encoding(accept_encoding)
+        best = None
+        best_q = 0
+        for name, level in self.types.get(ctype, ()):
+            if encodings is not None and name not in encodings:
+                continue
+            q = accepted.get(name, accepted.get('*', 0))
+            if q > best_q:
+                best, best_q = (name, level), q
+        return best
+
+
+def _add_vary(headers):
+    vary = headers.get('Vary')
+    if not vary:
+        headers['Vary'] = 'Accept-Encoding'
+    elif 'accept-encoding' not in vary.lower():
+        headers['Vary'] = vary + ', Accept-Encoding'
+
+
+class CompressionTransform(tornado.web.OutputTransform):
+    """代替 tornado 的 ``GZipContentEncoding``, 由 :func:`init_app` 注册"""
+
+    def __init__(self, policy, request):
+        self._policy = policy
+        self._accept_encoding = request.headers.get('Accept-Encoding', '')
+        self._if_none_match = request.headers.get('If-None-Match', '')
+        self._encoder = None
+
+    def transform_first_chunk(self, status_code, headers, chunk, finishing):
+        etag = headers.get('Etag')
+        if (status_code == 304 and etag and not etag.startswith('W/') and
+                'W/' + etag in self._if_none_match):
+            # 304 没有 Content-Type, 不知道是否会压缩; 客户端缓存的是压缩后
+            # 的弱 ETag 时原样返回
+            headers['Etag'] = 'W/' + etag
+        ctype = headers.get('Content-Type', '').split(';')[0].strip()
+        if ctype not in self._policy.types:
+            return status_code, headers, chunk
+        _add_vary(headers)
+        # 静态文件等设置了 Content-Length 的响应分块写时也知道大小
+        length = len(chunk) if finishing else int(
+            headers.get('Content-Length', self._policy.min_length))
+        if (status_code in (204, 206, 304) or 'Content-Encoding' in headers or
+                length < self._policy.min_length):
+            return status_code, headers, chunk
+        choice = self._policy.choose(self._accept_encoding, ctype)
+        if choice is None:
+            return status_code, headers, chunk
+        name, level = choice
+        self._encoder = ENCODERS[name](level)
+        headers['Content-Encoding'] = name
+        etag = headers.get('Etag')
+        if etag and not etag.startswith('W/'):
+            # 强 ETag 标识的是未压缩的字节, 压缩后和 nginx 一样改成弱 ETag;
+            # If-None-Match 用弱比较, 仍然能返回 304
+            headers['Etag'] = 'W/' + etag
+        chunk = self._encoder.compress(chunk, finishing)
+        if 'Content-Length' in headers:
+            if finishing:
+                headers['Content-Length'] = str(len(chunk))
+            else:
+                del headers['Content-Length']
+        return status_code, headers, chunk
+
+    def transform_chunk(self, chunk, finishing):
+        if self._encoder is not None:
+            chunk = self._encoder.compress(chunk, finishing)
+        return chunk
+
+
+class StaticFileHandler(tornado.web.StaticFileHandler):
+    """有预压缩的文件并且客户端接受时返回压缩好的文件.  小于
+    ``STATIC_CACHE_MAX_FILE_SIZE`` 的文件内容缓存在内存里, 文件修改后重新读取"""
+
+    policy = None
+    cache = None
+    max_cached_size = 0
+    #: 原文件 -> {encoding: 压缩好的文件}
+    _variants = {}
+
+    @classmethod
+    def configure(cls, policy, cache_bytes, max_file_size):
+        cls.policy = policy
+        cls.cache = LRUCache(maxsize=4096, maxbytes=cache_bytes) \
+            if cache_bytes else None
+        cls.max_cached_size = max_file_size
+        cls._variants = {}
+
+    def validate_absolute_path(self, root, absolute_path):
+        absolute_path = super(StaticFileHandler, self).validate_absolute_path(
+            root, absolute_path)
+        self.original_path = absolute_path
+        self.content_encoding = None
+        self.compressible = False
+        if absolute_path is None or self.policy is None:
+            return absolute_path
+        ctype = guess_type(absolute_path)
+        self.compressible = ctype in self.policy.types
+        if not self.compressible:
+            return absolute_path
+        variants = self._find_variants(absolute_path)
+        if variants:
+            choice = self.policy.choose(
+                self.request.headers.get('Accept-Encoding', ''), ctype,
+                variants)
+            if choice is not None:
+                self.content_encoding = choice[0]
+                return variants[choice[0]]
+        return absolute_path
+
+    def _find_variants(self, absolute_path):
+        variants = self._variants.get(absolute_path)
+        if variants is None:
+            mtime = os.path.getmtime(absolute_path)
+            variants = {}
+            for name, _ in self.policy.types.get(guess_type(absolute_path)):
+                path = absolute_path + EXTENSIONS[name]
+                # 原文件修改后没有重新压缩的不用
+                if os.path.isfile(path) and os.path.getmtime(path) >= mtime:
+                    variants[name] = path
+            if self.settings.get('static_hash_cache', True):
+                self._variants[absolute_path] = variants
+        return variants
+
+    def get_content_type(self):
+        return guess_type(self.original_path)
+
+    def set_extra_headers(self, path):
+        if self.compressible:
+            self.set_header('Vary', 'Accept-Encoding')
+        if self.content_encoding is not None:
+            self.set_header('Content-Encoding', self.content_encoding)
+
+    @classmethod
+    def get_content(cls, abspath, start=None, end=None):
+        cache = cls.cache
+        if cache is not None:
+            stat = os.stat(abspath)
+            if stat.st_size <= cls.max_cached_size:
+                version = (stat.st_mtime, stat.st_size)
+                entry = cache.get(abspath)
+                if entry is None or entry[0] != version:
+                    with open(abspath, 'rb') as f:
+                        entry = (version, f.read())
+                    cache.set(abspath, entry, size=len(entry[1]))
+                return entry[1][start:end]
+        return super(StaticFileHandler, cls).get_content(abspath, start, end)
+
+
+def precompress(root, policy, levels=STATIC_LEVELS):
+    """把 ``root`` 下可以压缩的文件压缩好写在旁边, 已经是最新的跳过, 压缩后
+    没有变小的不写.  返回 ``[(path, encoding, size, compressed_size)]``"""
+    written = []
+    suffixes = tuple(EXTENSIONS.values())
+    for dirpath, _, filenames in os.walk(root):
+        for filename in sorted(filenames):
+            if filename.endswith(suffixes):
+                continue
+            path = os.path.join(dirpath, filename)
+            options = policy.types.get(guess_type(path))
+            size = os.path.getsize(path)
+            if not options or size < policy.min_length:
+                continue
+            mtime = os.path.getmtime(path)
+            data = None
+            for name, _ in options:
+                target = path + EXTENSIONS[name]
+                if (os.path.exists(target) and
+                        os.path.getmtime(target) >= mtime):
+                    continue
+                if data is None:
+                    with open(path, 'rb') as f:
+                        data = f.read()
+                compressed = ENCODERS[name](levels[name]).compress(data, True)
+                if len(compressed) >= size:
+                    if os.path.exists(target):
+                        os.remove(target)
+                    continue
+                # 先写临时文件, 运行中的 worker 不会读到写了一半的文件
+                with open(target + '.tmp', 'wb') as f:
+                    f.write(compressed)
+                os.rename(target + '.tmp', target)
+                written.append((path, name, size, len(compressed)))
+    return written
+
+
+def load_config(config):
+    """设置压缩相关配置的默认值, 返回 ``CompressionPolicy``"""
+    config.setdefault('COMPRESSION_ENABLED', True)
+    config.setdefault('COMPRESSION_TYPES', COMPRESSION_TYPES)
+    config.setdefault('COMPRESSION_ENCODINGS', ('br', 'gzip'))
+    config.setdefault('COMPRESSION_MIN_LENGTH', 1024)
+    config.setdefault('STATIC_CACHE_MAX_BYTES', 32 * 1024 * 1024)
+    config.setdefault('STATIC_CACHE_MAX_FILE_SIZE', 1024 * 1024)
+    return CompressionPolicy.from_config(config)
+
+
+def init_app(app):
+    config = app.config
+    policy = load_config(config)
+    StaticFileHandler.configure(policy, config['STATIC_CACHE_MAX_BYTES'],
+                                config['STATIC_CACHE_MAX_FILE_SIZE'])
+    if config['COMPRESSION_ENABLED']:
+        app.add_transform(functools.partial(CompressionTransform, policy))
+    return policy
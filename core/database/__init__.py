@@ -4,20 +4,38 @@ import os
 import re
 import sys
 import time
+import random
+import bisect
+import copy
 import functools
+import logging
 import warnings
+import weakref
 import sqlalchemy
 from functools import partial
 from operator import itemgetter
+from itertools import islice
 from threading import Lock
 from blinker import Namespace
+from concurrent.futures import ThreadPoolExecutor
 from sqlalchemy import orm, event, inspect
+from sqlalchemy.exc import InvalidRequestError
+from sqlalchemy.orm.attributes import set_committed_value
 from sqlalchemy.orm.exc import UnmappedClassError
 from sqlalchemy.orm.session import Session as SessionBase
+from sqlalchemy.sql.expression import Select
+from sqlalchemy.sql.util import find_tables
+from sqlalchemy.util import ScopedRegistry
 from sqlalchemy.engine.url import make_url
 from sqlalchemy.ext.declarative import declarative_base, DeclarativeMeta
 from werkzeug.local import LocalStack
-from ._compat import string_types, itervalues
+from ._compat import string_types, itervalues, iteritems
+from .cache import LRUCache
+from .group_commit import GroupCommitter
+from .stats import QueryStats
+from ..teardown import teardown_options
+from . import loading  # registers lazy='batch'
+from . import lazy_values
 
 # the best timer function for the platform
 if sys.platform == 'win32':
@@ -27,11 +45,71 @@ else:
 
 connection_stack = LocalStack()
 
+logger = logging.getLogger(__name__)
+
 _camelcase_re = re.compile(r'([A-Z]+)(?=[a-z0-9])')
 _signals = Namespace()
 
+#: Sent after a commit with ``changes`` as a list of ``(instance,
+#: operation)``.  Bulk writes (``CRUDMixin.bulk_*``) are not included:
+#: receivers that must see every write also connect to
+#: :data:`models_bulk_committed`.
 models_committed = _signals.signal('models-committed')
 before_models_committed = _signals.signal('before-models-committed')
+#: Sent after a commit that included bulk writes (``CRUDMixin.bulk_*``),
+#: with ``changes`` as a list of ``(model class, operation)``: the rows
+#: themselves are unknown.
+models_bulk_committed = _signals.signal('models-bulk-committed')
+#: Sent on the IOLoop thread when a request ends and
+#: ``SQLALCHEMY_COMMIT_ON_TEARDOWN`` is about to commit its session, with
+#: ``changes`` as a list of ``(instance or model class, operation)``.  The
+#: commit itself runs later, off the IOLoop thread: caches drop their
+#: entries here so that no request after the response is served one that
+#: predates the commit, and again on :data:`models_committed`.
+models_committing = _signals.signal('models-committing')
+
+
+class RequestContext(object):
+    """Marks the request being handled.  While a request runs it sits on
+    top of :data:`connection_stack`, which is what scopes
+    :attr:`SQLAlchemy.session`: every request gets its own session instead
+    of sharing the one of the IOLoop thread.
+
+    :class:`core.handler.RequestHandler` enters it through a
+    :class:`tornado.stack_context.StackContext`, so it is pushed again
+    whenever one of the request's callbacks runs, including after a
+    coroutine resumes from a ``yield``.
+    """
+
+    def __init__(self, app, handler=None):
+        self.app = app
+        self.handler = handler
+        #: fingerprint -> [executions, call site], see the N+1 detector
+        self.select_counts = None
+
+    def __enter__(self):
+        connection_stack.push(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        connection_stack.pop()
+
+
+def _session_scope():
+    """Scope function for the scoped session: the current request context,
+    or the thread (or greenlet) outside of a request."""
+    ctx = connection_stack.top
+    if ctx is not None:
+        return ctx
+    return connection_stack.__ident_func__()
+
+
+def _endpoint_name(handler):
+    endpoint = getattr(handler, 'endpoint', type(handler).__name__)
+    blueprint = getattr(handler, 'blueprint', None)
+    if blueprint:
+        return '%s.%s' % (blueprint, endpoint)
+    return endpoint
 
 
 def _calling_context(app_path):
@@ -170,12 +248,89 @@ class _EngineDebuggingSignalEvents(object):
                 _calling_context(self.app_package))))
 
 
+class _EngineStatsSignalEvents(object):
+    """Feeds every query into the application's :class:`QueryStats`.
+    Unlike :class:`_EngineDebuggingSignalEvents` it keeps nothing per
+    query, and looks up call sites only for sampled executions.
+    """
+
+    def __init__(self, engine, stats, import_name):
+        self.engine = engine
+        self.stats = stats
+        self.call_site = partial(_calling_context, import_name)
+
+    def register(self):
+        event.listen(self.engine, 'before_cursor_execute',
+                     self.before_cursor_execute)
+        event.listen(self.engine, 'after_cursor_execute',
+                     self.after_cursor_execute)
+
+    def before_cursor_execute(self, conn, cursor, statement,
+                              parameters, context, executemany):
+        context._stats_start_time = _timer()
+
+    def after_cursor_execute(self, conn, cursor, statement,
+                             parameters, context, executemany):
+        ms = (_timer() - context._stats_start_time) * 1000
+        ctx = connection_stack.top
+        handler = getattr(ctx, 'handler', None)
+        if handler is not None:
+            endpoint = _endpoint_name(handler)
+        else:
+            endpoint = '<no request>'
+        self.stats.record(statement, ms, max(cursor.rowcount, 0), endpoint,
+                          self.call_site)
+
+
+class _EngineNPlusOneSignalEvents(object):
+    """Counts the executions of each SELECT fingerprint per request, see
+    :func:`_report_n_plus_one`.  The call site is looked up once, when a
+    fingerprint reaches the threshold.
+    """
+
+    def __init__(self, engine, stats, import_name, threshold):
+        self.engine = engine
+        self.stats = stats
+        self.import_name = import_name
+        self.threshold = threshold
+
+    def register(self):
+        event.listen(self.engine, 'after_cursor_execute',
+                     self.after_cursor_execute)
+
+    def after_cursor_execute(self, conn, cursor, statement,
+                             parameters, context, executemany):
+        ctx = connection_stack.top
+        if ctx is None or not statement.lstrip()[:6].upper() == 'SELECT':
+            return
+        counts = getattr(ctx, 'select_counts', None)
+        if counts is None:
+            counts = ctx.select_counts = {}
+        fp = self.stats.fingerprint(statement)
+        entry = counts.get(fp)
+        if entry is None:
+            counts[fp] = [1, None]
+            return
+        entry[0] += 1
+        if entry[0] == self.threshold:
+            entry[1] = _calling_context(self.import_name)
+
+
+def _report_n_plus_one(ctx, threshold):
+    """Logs the SELECTs a request repeated at least ``threshold`` times,
+    the usual sign of lazy loads in a loop (use ``lazy='batch'`` or an
+    eager load on the relationship)."""
+    for fp, (count, call_site) in (ctx.select_counts or {}).items():
+        if count >= threshold:
+            logger.warning('N+1 query in %s: %d executions from %s of %s',
+                           _endpoint_name(ctx.handler), count, call_site, fp)
+
+
 class _EngineConnector(object):
     def __init__(self, sa, app, bind=None):
         self._sa = sa
         self._app = app
         self._engine = None
-        self._connected_for = None
         self._bind = bind
         self._lock = Lock()
 
@@ -189,11 +344,16 @@ class _EngineConnector(object):
         return binds[self._bind]
 
     def get_engine(self):
+        # Engines are created once and read without locking afterwards;
+        # configuration changes only apply after SQLAlchemy.dispose_engines
+        rv = self._engine
+        if rv is not None:
+            return rv
         with self._lock:
+            if self._engine is not None:
+                return self._engine
             uri = self.get_uri()
             echo = self._app.config['SQLALCHEMY_ECHO']
-            if (uri, echo) == self._connected_for:
-                return self._engine
             info = make_url(uri)
             options = {'convert_unicode': True}
             self._sa.apply_pool_defaults(self._app, options)
@@ -204,9 +364,228 @@ class _EngineConnector(object):
             if _record_queries(self._app):
                 _EngineDebuggingSignalEvents(self._engine,
                                              self._app.import_name).register()
-            self._connected_for = (uri, echo)
+            if self._app.config['SQLALCHEMY_QUERY_STATS']:
+                _EngineStatsSignalEvents(self._engine,
+                                         get_state(self._app).query_stats,
+                                         self._app.import_name).register()
+            threshold = self._app.config['SQLALCHEMY_NPLUSONE_THRESHOLD']
+            if threshold:
+                _EngineNPlusOneSignalEvents(self._engine,
+                                            get_state(self._app).query_stats,
+                                            self._app.import_name,
+                                            threshold).register()
             return rv
 
+    def dispose(self):
+        with self._lock:
+            if self._engine is not None:
+                self._engine.dispose()
+            self._engine = None
+
+
+class BaseQuery(orm.Query):
+    """The default query class.  On top of the regular terminals it offers
+    ``async_*`` variants that run the query on the database executor (see
+    :meth:`SQLAlchemy.run`) and return a future, so a coroutine handler can
+    ``yield`` it without blocking the IOLoop::
+
+        user = yield User.query.async_get(1)
+
+    The query is re-bound to the executor thread's own session, which is
+    removed afterwards, so returned instances are detached: attributes that
+    were loaded are readable, unloaded ones (lazy relationships) are not.
+
+    :meth:`cache` opts a query into the application's query cache, and
+    :meth:`get` serves models that set ``__pk_cache__ = True`` from the
+    primary key cache.  :meth:`stream` reads large results chunk by chunk.
+    """
+
+    _cache_options = None
+
+    def cache(self, ttl=None, key=None):
+        """Serves the results of this query from the query cache for up to
+        ``ttl`` seconds (``SQLALCHEMY_QUERY_CACHE_TTL`` by default)::
+
+            users = User.query.filter_by(active=True).cache(ttl=30).all()
+
+        ``key`` replaces the key derived from the SQL and its parameters.
+        Entries are dropped when a commit of this process touches one of
+        the tables the query reads.  Sessions that have pending or flushed
+        changes bypass the cache so they always read their own writes.
+        """
+        q = self._clone()
+        q._cache_options = (ttl, key)
+        return q
+
+    def stream(self, chunk_size=1000):
+        """Iterates over the results in lists of up to ``chunk_size`` rows,
+        fetched with ``yield_per`` through a server-side cursor where the
+        driver has one (``SSCursor`` on MySQL), so only one chunk is held
+        in memory at a time::
+
+            for chunk in Answer.query.filter_by(user_id=1).stream(500):
+                ...
+
+        The query cache is not used.  As with ``yield_per``, eager loading
+        of collections is not supported; ``lazy='batch'`` relationships
+        load once per chunk.  Closing the iterator early closes the cursor.
+        """
+        query = self.yield_per(chunk_size).execution_options(
+            stream_results=True)
+        context = query._compile_context()
+        context.statement.use_labels = True
+        if query._autoflush and not query._populate_existing:
+            query.session._autoflush()
+        conn = query._get_bind_args(context, query._connection_from_session,
+                                    close_with_result=True)
+        result = conn.execute(context.statement, query._params)
+        rows = orm.loading.instances(query, result, context)
+        if lazy_values.active:
+            rows = lazy_values.load_rows(rows)
+        try:
+            while True:
+                chunk = list(islice(rows, chunk_size))
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            result.close()
+
+    def __iter__(self):
+        rows = self._iter_rows()
+        if lazy_values.active:
+            return lazy_values.load_rows(rows)
+        return rows
+
+    def _iter_rows(self):
+        if self._cache_options is None or self._has_writes():
+            return orm.Query.__iter__(self)
+        ttl, key = self._cache_options
+        _SessionSignalEvents.start_recording()
+        state = get_state(self.session.app)
+        statement = self.with_labels().statement
+        if key is None:
+            key = self._cache_key(statement)
+        result = state.query_cache.get(key, _missing)
+        if result is _missing:
+            result = self._load_detached(state.db)
+            tags = set(table.name for table in find_tables(statement))
+            state.query_cache.set(key, result, ttl, tags)
+        return iter(self.merge_result(result, load=False))
+
+    def get(self, ident):
+        """Like :meth:`~sqlalchemy.orm.query.Query.get`, but for models that
+        set ``__pk_cache__ = True`` the row comes from a process-wide cache
+        keyed by ``(model, primary key)``::
+
+            class User(db.Model):
+                __pk_cache__ = True
+
+        What it returns then is a detached, read-only snapshot (unless the
+        instance is already in the session): attaching it to a session
+        raises, ``db.session.merge(user)`` gives a writable copy.
+        Entries expire after ``SQLALCHEMY_PK_CACHE_TTL`` seconds and are
+        dropped when a commit of this process updates or deletes the row.
+        ``populate_existing()``, ``with_for_update()``, loader options,
+        sessions with pending writes and the lookup of ``session.merge()``
+        bypass the cache.
+        """
+        mapper = self._mapper_zero()
+        if (mapper is None or not getattr(mapper.class_, '__pk_cache__', False)
+                or self._populate_existing or self._with_options or
+                self._for_update_arg is not None or self._has_writes() or
+                getattr(self.session, '_merging', False)):
+            return orm.Query.get(self, ident)
+
+        if not isinstance(ident, (list, tuple)):
+            ident = (ident,)
+        identity_key = mapper.identity_key_from_primary_key(ident)
+        instance = self.session.identity_map.get(identity_key)
+        if instance is not None:
+            return instance
+
+        _SessionSignalEvents.start_recording()
+        state = get_state(self.session.app)
+        key = identity_key[:2]
+        snapshot = state.pk_cache.get(key)
+        if snapshot is None:
+            snapshot = self._load_snapshot(state.db, ident)
+            if snapshot is None:
+                return None
+            state.pk_cache.set(key, snapshot,
+                               tags=[t.name for t in snapshot[0].tables],
+                               size=_sizeof_values(snapshot[1]))
+        return _make_snapshot(*snapshot)
+
+    def _load_snapshot(self, sa, ident):
+        session = sa.create_session({})
+        try:
+            instance = orm.Query.get(self.with_session(session), ident)
+            if instance is None:
+                return None
+            lazy_values.load_all(instance)
+            state = inspect(instance)
+            values = dict((prop.key, state.dict[prop.key])
+                          for prop in state.mapper.column_attrs
+                          if prop.key in state.dict)
+            return state.mapper, values
+        finally:
+            session.close()
+
+    def _has_writes(self):
+        session = self.session
+        return (getattr(session, '_wrote', False) or session.new or
+                session.deleted or session.dirty)
+
+    def _cache_key(self, statement):
+        compiled = statement.compile()
+        params = compiled.params
+        return '%s|%r|%r' % (
+            compiled,
+            [(k, params[k]) for k in sorted(params)],
+            [(d['name'], d['type']) for d in self.column_descriptions])
+
+    def _load_detached(self, sa):
+        # Loaded through a private session: cached instances are owned by
+        # no request, each hit merges copies into the caller's session.
+        session = sa.create_session({})
+        try:
+            rows = orm.Query.__iter__(self.with_session(session))
+            if lazy_values.active:
+                rows = list(lazy_values.load_rows(rows))
+                for instance in session.identity_map.values():
+                    lazy_values.load_all(instance)
+            return list(rows)
+        finally:
+            session.close()
+
+    def _run_async(self, terminal, *args):
+        sa = get_state(self.session.app).db
+
+        def execute():
+            query = self.with_session(sa.session())
+            return getattr(query, terminal)(*args)
+
+        return sa.run(execute)
+
+    def async_all(self):
+        return self._run_async('all')
+
+    def async_first(self):
+        return self._run_async('first')
+
+    def async_one(self):
+        return self._run_async('one')
+
+    def async_scalar(self):
+        return self._run_async('scalar')
+
+    def async_count(self):
+        return self._run_async('count')
+
+    def async_get(self, ident):
+        return self._run_async('get', ident)
+
 
 class _QueryProperty(object):
     def __init__(self, sa):
@@ -233,9 +612,28 @@ def _make_table(db):
     return _make_table
 
 
+_missing = object()
+
+
+def _sizeof_values(values):
+    return sys.getsizeof(values) + sum(
+        sys.getsizeof(value) for value in itervalues(values))
+
+
+def _make_snapshot(mapper, values):
+    instance = mapper.class_manager.new_instance()
+    for key, value in iteritems(values):
+        if type(value) in (dict, list):
+            value = copy.deepcopy(value)
+        set_committed_value(instance, key, value)
+    orm.make_transient_to_detached(instance)
+    instance._pk_snapshot = True
+    return instance
+
+
 def _set_default_query_class(d):
     if 'query_class' not in d:
-        d['query_class'] = orm.Query
+        d['query_class'] = BaseQuery
 
 
 def _wrap_with_default_query_class(fn):
@@ -265,6 +663,66 @@ def _include_sqlalchemy(obj):
     obj.event = event
 
 
+class _ReplicaSet(object):
+    """The read replicas of one bind.  Picks a replica by weight and ejects
+    replicas whose connections fail for ``eject_seconds``; when every
+    replica is ejected reads fall back to the primary.
+    """
+
+    def __init__(self, weights, eject_seconds):
+        self.keys = []
+        self.cumulative = []
+        total = 0
+        for key, weight in sorted(weights.items()):
+            if weight <= 0:
+                continue
+            total += weight
+            self.keys.append(key)
+            self.cumulative.append(total)
+        self.total = total
+        self.eject_seconds = eject_seconds
+        self._ejected = {}
+
+    def choose(self):
+        if not self.total:
+            return None
+        if self._ejected:
+            return self._choose_healthy()
+        index = bisect.bisect(self.cumulative, random.random() * self.total)
+        return self.keys[index]
+
+    def _choose_healthy(self):
+        now = _timer()
+        for key, until in list(self._ejected.items()):
+            if until <= now:
+                self._ejected.pop(key, None)
+        choices = []
+        total = 0
+        previous = 0
+        for key, bound in zip(self.keys, self.cumulative):
+            if key not in self._ejected:
+                total += bound - previous
+                choices.append((total, key))
+            previous = bound
+        if not choices:
+            return None
+        point = random.random() * total
+        for bound, key in choices:
+            if point < bound:
+                return key
+        return choices[-1][1]
+
+    def eject(self, key):
+        self._ejected[key] = _timer() + self.eject_seconds
+
+    def watch(self, key, engine):
+        def handle_error(context):
+            if context.is_disconnect or context.connection is None:
+                self.eject(key)
+
+        event.listen(engine, 'handle_error', handle_error)
+
+
 class SignallingSession(SessionBase):
     """The signalling session is the default session that Flask-SQLAlchemy
     uses.  It extends the default session system with bind selection and
@@ -273,6 +731,12 @@ class SignallingSession(SessionBase):
     If you want to use a different session you can override the
     :meth:`SQLAlchemy.create_session` function.
 
+    Plain SELECTs go to a read replica when ``SQLALCHEMY_REPLICAS`` lists
+    replicas for the bind.  Writes, ``FOR UPDATE`` reads and every read
+    after the session flushed stay on the primary until the transaction
+    ends, or until the session goes away if ``SQLALCHEMY_STICKY_PRIMARY``
+    is set or :meth:`stick_to_primary` was called.
+
     .. versionadded:: 2.0
 
     .. versionadded:: 2.1
@@ -287,6 +751,10 @@ class SignallingSession(SessionBase):
         track_modifications = app.config['SQLALCHEMY_TRACK_MODIFICATIONS']
         bind = options.pop('bind', None) or db.engine
         binds = options.pop('binds', None) or db.get_binds(app)
+        self._replicas = db.get_replicas(app)
+        self._sticky = app.config['SQLALCHEMY_STICKY_PRIMARY']
+        self._wrote = False
+        self._merging = False
 
         if track_modifications is None or track_modifications:
             _SessionSignalEvents.register(self)
@@ -296,17 +764,71 @@ class SignallingSession(SessionBase):
             bind=bind, binds=binds, **options
         )
 
+    def merge(self, instance, load=True):
+        # Session._merge looks the row up with query.get(); that must load
+        # it into this session, not return a primary key cache snapshot
+        merging, self._merging = self._merging, True
+        try:
+            return SessionBase.merge(self, instance, load=load)
+        finally:
+            self._merging = merging
+
+    def record_bulk_change(self, model, operation):
+        """Reports a bulk ``operation`` (``'insert'``, ``'update'``) that
+        bypassed the unit of work.  The next commit sends it through
+        :data:`models_bulk_committed`, not :data:`models_committed`, whose
+        receivers expect instances.
+        """
+        try:
+            bulk = self._bulk_changes
+        except AttributeError:
+            return
+        bulk.add((model, operation))
+
+    def stick_to_primary(self):
+        """Sends every following query of this session to the primary."""
+        self._wrote = self._sticky = True
+
     def get_bind(self, mapper=None, clause=None):
+        bind_key = None
         # mapper is None if someone tries to just get a connection
         if mapper is not None:
             info = getattr(mapper.mapped_table, 'info', {})
             bind_key = info.get('bind_key')
-            if bind_key is not None:
-                state = get_state(self.app)
-                return state.db.get_engine(self.app, bind=bind_key)
+        if (self._replicas and not self._wrote and not self._flushing and
+                isinstance(clause, Select) and clause._for_update_arg is None):
+            replicas = self._replicas.get(bind_key)
+            if replicas is not None:
+                replica = replicas.choose()
+                if replica is not None:
+                    state = get_state(self.app)
+                    return state.db.get_engine(self.app, bind=replica)
+        if bind_key is not None:
+            state = get_state(self.app)
+            return state.db.get_engine(self.app, bind=bind_key)
         return SessionBase.get_bind(self, mapper, clause)
 
 
+@event.listens_for(SignallingSession, 'before_attach')
+def _refuse_snapshots(session, instance):
+    if instance.__dict__.get('_pk_snapshot'):
+        raise InvalidRequestError(
+            '%r is a read-only snapshot from the primary key cache, use '
+            'session.merge() to get a writable copy' % instance)
+
+
+@event.listens_for(SignallingSession, 'after_flush')
+def _pin_to_primary(session, flush_context):
+    session._wrote = True
+
+
+@event.listens_for(SignallingSession, 'after_commit')
+@event.listens_for(SignallingSession, 'after_rollback')
+def _unpin_from_primary(session):
+    if not session._sticky:
+        session._wrote = False
+
+
 def get_state(app):
     """Gets the state for the application"""
     assert 'sqlalchemy' in app.extensions, \
@@ -315,12 +837,27 @@ def get_state(app):
     return app.extensions['sqlalchemy']
 
 
+#: every :class:`_SQLAlchemyState`, for :func:`after_fork`
+_states = weakref.WeakSet()
+
+
+def after_fork():
+    """Drops the engines, threads and sessions a forked child inherited
+    from its parent.  The supervisor and ``http_server.start(n)`` in
+    ``main.py`` call it in every worker before the worker uses the database;
+    Python 2 has no ``os.register_at_fork``, so code that forks some other
+    way has to call it itself.
+    """
+    for state in list(_states):
+        state.after_fork()
+
+
 class Model(object):
     """Baseclass for custom user models."""
 
     #: the query class used.  The :attr:`query` attribute is an instance
     #: of this class.  By default a :class:`BaseQuery` is used.
-    query_class = orm.Query
+    query_class = BaseQuery
 
     #: an instance of :attr:`query_class`.  Can be used to query the
     #: database for instances of this model.
@@ -328,42 +865,83 @@ class Model(object):
 
 
 class _SessionSignalEvents(object):
+    """Modification tracking for :data:`before_models_committed` and
+    :data:`models_committed`.
+
+    Rows are recorded from the mapper's ``after_insert``, ``after_update``
+    and ``after_delete`` events, i.e. only the objects a flush actually
+    wrote.  Until something consumes the changes (:attr:`recording`) they
+    are not recorded at all; a session that flushed before that clears the
+    query and primary key caches when it commits, since which rows it wrote
+    is unknown.  The listeners are installed once on
+    :class:`SignallingSession` and on the declarative base; :meth:`register`
+    only switches a session on.
+    """
+
+    #: Set for good once a receiver connects to one of the signals or a
+    #: query uses the query or primary key cache.
+    recording = False
+
+    @classmethod
+    def start_recording(cls, *args, **kwargs):
+        cls.recording = True
+
     @classmethod
     def register(cls, session):
         if not hasattr(session, '_model_changes'):
             session._model_changes = {}
-
-        event.listen(session, 'before_flush', cls.record_ops)
-        event.listen(session, 'before_commit', cls.record_ops)
-        event.listen(session, 'before_commit', cls.before_commit)
-        event.listen(session, 'after_commit', cls.after_commit)
-        event.listen(session, 'after_rollback', cls.after_rollback)
+            session._bulk_changes = set()
+            session._unrecorded = False
 
     @classmethod
     def unregister(cls, session):
         if hasattr(session, '_model_changes'):
             del session._model_changes
+            del session._bulk_changes
+
+    @classmethod
+    def listen_to_mappers(cls, base):
+        for operation in ('insert', 'update', 'delete'):
+            event.listen(base, 'after_' + operation,
+                         partial(cls.record_row, operation), propagate=True)
+
+    @staticmethod
+    def record_row(operation, mapper, connection, target):
+        if not _SessionSignalEvents.recording:
+            return
+        session = orm.object_session(target)
+        d = getattr(session, '_model_changes', None)
+        if d is None:
+            return
+        key = inspect(target).key if operation != 'insert' else id(target)
+        d[key] = (target, operation)
 
-        event.remove(session, 'before_flush', cls.record_ops)
-        event.remove(session, 'before_commit', cls.record_ops)
-        event.remove(session, 'before_commit', cls.before_commit)
-        event.remove(session, 'after_commit', cls.after_commit)
-        event.remove(session, 'after_rollback', cls.after_rollback)
+    @staticmethod
+    def before_flush(session, flush_context, instances):
+        if not _SessionSignalEvents.recording and hasattr(
+                session, '_model_changes'):
+            session._unrecorded = True
 
     @staticmethod
     def record_ops(session, flush_context=None, instances=None):
+        """Records the changes that are still pending, i.e. not flushed."""
         try:
             d = session._model_changes
         except AttributeError:
             return
 
+        d.update(_SessionSignalEvents.pending_ops(session))
+
+    @staticmethod
+    def pending_ops(session):
+        """``(key, (target, operation))`` for the changes not flushed yet."""
         for targets, operation in (
                 (session.new, 'insert'), (session.dirty, 'update'),
                 (session.deleted, 'delete')):
             for target in targets:
                 state = inspect(target)
                 key = state.identity_key if state.has_identity else id(target)
-                d[key] = (target, operation)
+                yield key, (target, operation)
 
     @staticmethod
     def before_commit(session):
@@ -372,8 +950,12 @@ class _SessionSignalEvents(object):
         except AttributeError:
             return
 
-        if d:
-            before_models_committed.send(session.app, changes=list(d.values()))
+        if before_models_committed.receivers:
+            # the commit has not flushed yet, the last changes are pending
+            _SessionSignalEvents.record_ops(session)
+            if d:
+                before_models_committed.send(session.app,
+                                             changes=list(d.values()))
 
     @staticmethod
     def after_commit(session):
@@ -382,9 +964,23 @@ class _SessionSignalEvents(object):
         except AttributeError:
             return
 
+        if session._unrecorded:
+            session._unrecorded = False
+            if _SessionSignalEvents.recording:
+                state = get_state(session.app)
+                state.query_cache.clear()
+                state.pk_cache.clear()
         if d:
-            models_committed.send(session.app, changes=list(d.values()))
+            changes = list(d.values())
+            _invalidate_caches(session.app, changes)
+            models_committed.send(session.app, changes=changes)
             d.clear()
+        bulk = session._bulk_changes
+        if bulk:
+            changes = list(bulk)
+            _invalidate_bulk_caches(session.app, changes)
+            models_bulk_committed.send(session.app, changes=changes)
+            bulk.clear()
 
     @staticmethod
     def after_rollback(session):
@@ -394,6 +990,89 @@ class _SessionSignalEvents(object):
             return
 
         d.clear()
+        session._bulk_changes.clear()
+        session._unrecorded = False
+
+
+event.listen(SignallingSession, 'before_flush',
+             _SessionSignalEvents.before_flush)
+event.listen(SignallingSession, 'before_commit',
+             _SessionSignalEvents.before_commit)
+event.listen(SignallingSession, 'after_commit',
+             _SessionSignalEvents.after_commit)
+event.listen(SignallingSession, 'after_rollback',
+             _SessionSignalEvents.after_rollback)
+for _signal in (models_committed, before_models_committed,
+                models_bulk_committed, models_committing):
+    _signal.receiver_connected.connect(_SessionSignalEvents.start_recording,
+                                       weak=False)
+
+
+def _changed_tables(changes):
+    """Names of the tables written by the ``changes`` of a
+    :data:`models_committed` or :data:`models_bulk_committed` signal."""
+    tables = set()
+    for target, operation in changes:
+        for table in inspect(target).mapper.tables:
+            tables.add(table.name)
+    return tables
+
+
+def _invalidate_caches(app, changes):
+    """Drops the query and primary key cache entries that committed
+    ``changes`` made stale."""
+    state = get_state(app)
+    if len(state.query_cache):
+        for table in _changed_tables(changes):
+            state.query_cache.invalidate_tag(table)
+
+    pk_cache = state.pk_cache
+    if not len(pk_cache):
+        return
+    for target, operation in changes:
+        if operation != 'insert':
+            key = inspect(target).key
+            if key is not None:
+                pk_cache.invalidate(key[:2])
+
+
+def _invalidate_bulk_caches(app, changes):
+    """Like :func:`_invalidate_caches` for bulk changes: the rows are
+    unknown, so every primary key cache entry of the tables goes."""
+    state = get_state(app)
+    for table in _changed_tables(changes):
+        state.query_cache.invalidate_tag(table)
+        state.pk_cache.invalidate_tag(table)
+
+
+def _invalidate_pending(session):
+    """Invalidates ahead of the commit of ``session``: drops the query and
+    primary key cache entries it is about to make stale and sends
+    :data:`models_committing`.  Entries filled from the old rows before the
+    commit lands are dropped again by :meth:`_SessionSignalEvents.after_commit`.
+    """
+    try:
+        d = session._model_changes
+    except AttributeError:
+        return
+    if not _SessionSignalEvents.recording:
+        return
+
+    app = session.app
+    if session._unrecorded:
+        state = get_state(app)
+        state.query_cache.clear()
+        state.pk_cache.clear()
+    pending = dict(d)
+    pending.update(_SessionSignalEvents.pending_ops(session))
+    changes = list(pending.values())
+    if changes:
+        _invalidate_caches(app, changes)
+    bulk = list(session._bulk_changes)
+    if bulk:
+        _invalidate_bulk_caches(app, bulk)
+    if changes or bulk:
+        models_committing.send(app, changes=changes + bulk)
 
 
 class _SQLAlchemyState(object):
@@ -403,6 +1082,45 @@ class _SQLAlchemyState(object):
         self.db = db
         self.app = app
         self.connectors = {}
+        self.inherited_engines = []
+        self.binds = None
+        self.executor = None
+        self.closer = None
+        self.replicas = None
+        self.group_committer = None
+        self.query_stats = QueryStats(
+            app.config['SQLALCHEMY_QUERY_STATS_MAX_FINGERPRINTS'],
+            sample_every=app.config['SQLALCHEMY_QUERY_STATS_SAMPLE_EVERY'])
+        self.query_cache = LRUCache(
+            app.config['SQLALCHEMY_QUERY_CACHE_SIZE'],
+            app.config['SQLALCHEMY_QUERY_CACHE_TTL'])
+        self.pk_cache = LRUCache(
+            app.config['SQLALCHEMY_PK_CACHE_SIZE'],
+            app.config['SQLALCHEMY_PK_CACHE_TTL'],
+            app.config['SQLALCHEMY_PK_CACHE_MAX_BYTES'])
+        _states.add(self)
+
+    def after_fork(self):
+        """Called by :func:`after_fork` in a forked child.  Engines,
+        threads and sessions of the parent are dropped so the child opens
+        its own connections.  The parent's engines are kept referenced but
+        not disposed: closing the inherited connections would also close
+        them for the parent.
+        """
+        for connector in list(self.connectors.values()):
+            if connector._engine is not None:
+                self.inherited_engines.append(connector._engine)
+        self.connectors = {}
+        self.binds = None
+        self.executor = None
+        self.closer = None
+        self.replicas = None
+        self.group_committer = None
+        self.query_stats.reset()
+        # registry.clear() only removes the current scope's session
+        registry = self.db.session.registry
+        self.db.session.registry = ScopedRegistry(registry.createfunc,
+                                                  registry.scopefunc)
 
 
 class SQLAlchemy(object):
@@ -412,12 +1130,14 @@ class SQLAlchemy(object):
         if session_options is None:
             session_options = {}
 
-        session_options.setdefault('scopefunc', connection_stack.__ident_func__)
+        session_options.setdefault('scopefunc', _session_scope)
         self.use_native_unicode = use_native_unicode
+        self.Query = BaseQuery
         self.session = self.create_scoped_session(session_options)
         self.Model = self.make_declarative_base(metadata)
-        self.Query = orm.Query
         self._engine_lock = Lock()
+        self._executor_lock = Lock()
+        self._replica_lock = Lock()
         self.app = app
         _include_sqlalchemy(self)
 
@@ -436,6 +1156,9 @@ class SQLAlchemy(object):
         if options is None:
             options = {}
         scopefunc = options.pop('scopefunc', None)
+        # db.session.query(...) also gets the async_*, cache and stream
+        # terminals, and converts lazy column values
+        options.setdefault('query_cls', self.Query)
         return orm.scoped_session(partial(self.create_session, options),
                                   scopefunc=scopefunc)
 
@@ -453,6 +1176,7 @@ class SQLAlchemy(object):
                                 metadata=metadata,
                                 metaclass=_BoundDeclarativeMeta)
         base.query = _QueryProperty(self)
+        _SessionSignalEvents.listen_to_mappers(base)
         return base
 
     def init_app(self, app):
@@ -470,7 +1194,27 @@ class SQLAlchemy(object):
         app.config.setdefault('SQLALCHEMY_POOL_TIMEOUT', None)
         app.config.setdefault('SQLALCHEMY_POOL_RECYCLE', None)
         app.config.setdefault('SQLALCHEMY_MAX_OVERFLOW', None)
+        app.config.setdefault('SQLALCHEMY_CONNECTION_BUDGET', None)
+        app.config.setdefault('SQLALCHEMY_POOL_WORKERS', 1)
+        app.config.setdefault('SQLALCHEMY_POOL_PREWARM', False)
         app.config.setdefault('SQLALCHEMY_COMMIT_ON_TEARDOWN', False)
+        app.config.setdefault('SQLALCHEMY_TEARDOWN_TIMEOUT', 5)
+        app.config.setdefault('SQLALCHEMY_EXECUTOR_WORKERS', None)
+        app.config.setdefault('SQLALCHEMY_CLOSE_WORKERS', 2)
+        app.config.setdefault('SQLALCHEMY_REPLICAS', None)
+        app.config.setdefault('SQLALCHEMY_REPLICA_EJECT_SECONDS', 30)
+        app.config.setdefault('SQLALCHEMY_STICKY_PRIMARY', False)
+        app.config.setdefault('SQLALCHEMY_QUERY_CACHE_SIZE', 1024)
+        app.config.setdefault('SQLALCHEMY_QUERY_CACHE_TTL', 60)
+        app.config.setdefault('SQLALCHEMY_PK_CACHE_SIZE', 10000)
+        app.config.setdefault('SQLALCHEMY_PK_CACHE_TTL', 300)
+        app.config.setdefault('SQLALCHEMY_PK_CACHE_MAX_BYTES', 32 * 1024 * 1024)
+        app.config.setdefault('SQLALCHEMY_GROUP_COMMIT_INTERVAL', 5)
+        app.config.setdefault('SQLALCHEMY_GROUP_COMMIT_MAX_ROWS', 100)
+        app.config.setdefault('SQLALCHEMY_QUERY_STATS', False)
+        app.config.setdefault('SQLALCHEMY_QUERY_STATS_SAMPLE_EVERY', 100)
+        app.config.setdefault('SQLALCHEMY_QUERY_STATS_MAX_FINGERPRINTS', 500)
+        app.config.setdefault('SQLALCHEMY_NPLUSONE_THRESHOLD', None)
         track_modifications = app.config.setdefault(
             'SQLALCHEMY_TRACK_MODIFICATIONS', None)
 
@@ -494,14 +1238,80 @@ class SQLAlchemy(object):
                 raise RuntimeError("Commit on teardown requires Flask >= 0.7")
             teardown = app.after_request
 
+        # nothing here is urgent once the response is out: let the IOLoop
+        # serve other requests first
         @teardown
-        def shutdown_session(response_or_exc):
-            if app.config['SQLALCHEMY_COMMIT_ON_TEARDOWN']:
-                if response_or_exc is None:
-                    self.session.commit()
-            self.session.remove()
+        @teardown_options(defer=True)
+        def report_n_plus_one(response_or_exc):
+            threshold = app.config['SQLALCHEMY_NPLUSONE_THRESHOLD']
+            ctx = connection_stack.top
+            if threshold and ctx is not None and ctx.handler is not None:
+                _report_n_plus_one(ctx, threshold)
+            return response_or_exc
+
+        # the commit below is deferred and may go to the closer thread:
+        # invalidate before the IOLoop reads the next request, ahead of
+        # any hook that could return a Future and put it off
+        @teardown
+        @teardown_options(order=-100)
+        def invalidate_pending(response_or_exc):
+            if (app.config['SQLALCHEMY_COMMIT_ON_TEARDOWN'] and
+                    response_or_exc is None and self.session.registry.has()):
+                _invalidate_pending(self.session())
             return response_or_exc
 
+        @teardown
+        @teardown_options(order=100, defer=True,
+                          timeout=app.config['SQLALCHEMY_TEARDOWN_TIMEOUT'])
+        def shutdown_session(response_or_exc):
+            commit = (app.config['SQLALCHEMY_COMMIT_ON_TEARDOWN'] and
+                      response_or_exc is None)
+            return self._shutdown_session(app, commit)
+
+    def _shutdown_session(self, app, commit=False):
+        """Removes the current scope's session like ``session.remove()``.
+        A session that holds a connection is closed on a thread of its own
+        (``SQLALCHEMY_CLOSE_WORKERS``), because the rollback that returns the
+        connection to the pool is a database round trip; the future for that
+        is returned.  Not on the executor: when all of its threads wait for
+        a connection, the closes that would return one would queue behind
+        them until ``pool_timeout``.  pysqlite connections can only be used
+        by the thread that opened them, so those sessions are still closed
+        in place.  With ``commit`` other requests read the new rows only
+        once that future is done; the caches were invalidated before (see
+        :data:`models_committing`).
+        """
+        registry = self.session.registry
+        if not registry.has():
+            return None
+        session = registry()
+        registry.clear()
+
+        def close():
+            try:
+                if commit:
+                    session.commit()
+            finally:
+                session.close()
+
+        connections = getattr(session.transaction, '_connections', None)
+        if (not commit and not connections) or any(
+                value[0].dialect.name == 'sqlite'
+                for value in itervalues(connections or {})):
+            close()
+            return None
+        return self._get_closer(app).submit(close)
+
+    def _get_closer(self, app):
+        state = get_state(app)
+        if state.closer is not None:
+            return state.closer
+        with self._executor_lock:
+            if state.closer is None:
+                state.closer = ThreadPoolExecutor(
+                    max(app.config['SQLALCHEMY_CLOSE_WORKERS'] or 1, 1))
+            return state.closer
+
     def apply_pool_defaults(self, app, options):
         def _setdefault(optionkey, configkey):
             value = app.config[configkey]
@@ -513,6 +1323,21 @@ class SQLAlchemy(object):
         _setdefault('pool_recycle', 'SQLALCHEMY_POOL_RECYCLE')
         _setdefault('max_overflow', 'SQLALCHEMY_MAX_OVERFLOW')
 
+        # SQLALCHEMY_CONNECTION_BUDGET caps the connections all worker
+        # processes open to each database; each of the
+        # SQLALCHEMY_POOL_WORKERS processes gets an equal share.  While the
+        # supervisor replaces a worker, old and new hold connections at the
+        # same time, so up to twice the budget: leave room for that in the
+        # database's max_connections
+        budget = app.config['SQLALCHEMY_CONNECTION_BUDGET']
+        if budget:
+            workers = max(app.config['SQLALCHEMY_POOL_WORKERS'] or 1, 1)
+            share = max(budget // workers, 1)
+            pool_size = min(options.get('pool_size') or share, share)
+            options['pool_size'] = pool_size
+            options['max_overflow'] = min(
+                options.get('max_overflow', share), share - pool_size)
+
     def apply_driver_hacks(self, app, info, options):
         """This method is called before engine creation and used to inject
         driver specific hacks into the options.  The `options` parameter is
@@ -583,13 +1408,108 @@ class SQLAlchemy(object):
 
         .. versionadded:: 0.12
         """
+        state = get_state(app)
+        connector = state.connectors.get(bind)
+        if connector is None:
+            with self._engine_lock:
+                connector = state.connectors.get(bind)
+                if connector is None:
+                    connector = self.make_connector(app, bind)
+                    state.connectors[bind] = connector
+        return connector.get_engine()
+
+    def dispose_engines(self, app=None):
+        """Closes the pooled connections of every engine.  The engines are
+        created again, from the current configuration, on next use."""
+        state = get_state(self.get_app(app))
         with self._engine_lock:
-            state = get_state(app)
-            connector = state.connectors.get(bind)
-            if connector is None:
-                connector = self.make_connector(app, bind)
-                state.connectors[bind] = connector
-            return connector.get_engine()
+            for connector in list(state.connectors.values()):
+                connector.dispose()
+            state.binds = None
+
+    def prewarm(self, app=None):
+        """Fills the pool of every engine with ``pool_size`` connections,
+        each checked with a ``SELECT 1``, so the first requests don't pay
+        for connection setup.  Call it in the process that serves requests,
+        i.e. after forking workers.  Failures are logged, not raised.
+        """
+        app = self.get_app(app)
+        for bind in [None] + list(app.config['SQLALCHEMY_BINDS'] or ()):
+            engine = self.get_engine(app, bind)
+            size = getattr(engine.pool, 'size', None)
+            size = size() if callable(size) else 1
+            connections = []
+            try:
+                for i in range(size):
+                    connection = engine.connect()
+                    connections.append(connection)
+                    connection.scalar(sqlalchemy.select([1]))
+            except Exception:
+                logger.warning('prewarming the pool of bind %r failed',
+                               bind, exc_info=True)
+            finally:
+                for connection in connections:
+                    connection.close()
+
+    def get_executor(self, app=None):
+        """Returns the thread pool that :meth:`run` submits to.  Unless
+        ``SQLALCHEMY_EXECUTOR_WORKERS`` is set it gets one thread per pooled
+        connection of the default engine, so a worker never sits waiting
+        for a connection while the pool has none left to hand out.
+        """
+        app = self.get_app(app)
+        state = get_state(app)
+        if state.executor is not None:
+            return state.executor
+        with self._executor_lock:
+            if state.executor is None:
+                workers = app.config['SQLALCHEMY_EXECUTOR_WORKERS']
+                if not workers:
+                    pool = self.get_engine(app).pool
+                    size = getattr(pool, 'size', None)
+                    workers = size() if callable(size) else 0
+                state.executor = ThreadPoolExecutor(max(workers, 1))
+            return state.executor
+
+    def run(self, fn, *args, **kwargs):
+        """Calls ``fn(*args, **kwargs)`` on the database executor and
+        returns a future for its result.  Inside ``fn`` :attr:`session` is a
+        session private to the executor thread; it is removed once ``fn``
+        returns, so ``fn`` has to commit the work it wants to keep::
+
+            @gen.coroutine
+            def get(self):
+                user = yield db.run(lambda: User.query.get(1))
+        """
+        return self.get_executor().submit(self._run_in_executor,
+                                          fn, args, kwargs)
+
+    def _run_in_executor(self, fn, args, kwargs):
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            self.session.remove()
+
+    def group_commit(self, instance, app=None):
+        """Saves ``instance`` as part of a group commit and returns a future
+        that resolves with it once the write is durable.  Concurrent writes
+        are committed together every ``SQLALCHEMY_GROUP_COMMIT_INTERVAL``
+        milliseconds or ``SQLALCHEMY_GROUP_COMMIT_MAX_ROWS`` rows, see
+        :class:`~core.database.group_commit.GroupCommitter`.
+
+        The instance is not added to :attr:`session`: a copy of its column
+        values is written.  The written values and, for a new instance, its
+        identity are set on it once the future resolves, so it is detached
+        and a later ``save()`` updates the row.
+        """
+        app = self.get_app(app)
+        state = get_state(app)
+        if state.group_committer is None:
+            state.group_committer = GroupCommitter(
+                self, app,
+                app.config['SQLALCHEMY_GROUP_COMMIT_INTERVAL'] / 1000.0,
+                app.config['SQLALCHEMY_GROUP_COMMIT_MAX_ROWS'])
+        return state.group_committer.submit(instance)
 
     def get_app(self, reference_app=None):
         """Helper method that implements the logic to look up an application.
@@ -605,6 +1525,55 @@ class SQLAlchemy(object):
                            'instance and no application bound '
                            'to current context')
 
+    def get_query_cache(self, app=None):
+        """Returns the cache behind :meth:`BaseQuery.cache`; its
+        :meth:`~core.database.cache.LRUCache.stats` reports hits and misses.
+        """
+        return get_state(self.get_app(app)).query_cache
+
+    def get_query_stats(self, app=None):
+        """Returns the :class:`~core.database.stats.QueryStats` collected
+        while ``SQLALCHEMY_QUERY_STATS`` is on."""
+        return get_state(self.get_app(app)).query_stats
+
+    def get_pk_cache(self, app=None):
+        """Returns the cache behind :meth:`BaseQuery.get`."""
+        return get_state(self.get_app(app)).pk_cache
+
+    def get_replicas(self, app=None):
+        """Returns the read replicas per bind as configured in
+        ``SQLALCHEMY_REPLICAS``, which maps a bind key (``None`` for the
+        default database) to the ``SQLALCHEMY_BINDS`` keys of its replicas,
+        either as a list or as a dict of weights::
+
+            SQLALCHEMY_BINDS = {'replica1': 'mysql://...',
+                                'replica2': 'mysql://...'}
+            SQLALCHEMY_REPLICAS = {None: {'replica1': 2, 'replica2': 1}}
+        """
+        app = self.get_app(app)
+        state = get_state(app)
+        if state.replicas is not None:
+            return state.replicas
+        with self._replica_lock:
+            if state.replicas is None:
+                eject_seconds = app.config['SQLALCHEMY_REPLICA_EJECT_SECONDS']
+                replicas = {}
+                for bind, weights in (app.config['SQLALCHEMY_REPLICAS'] or
+                                      {}).items():
+                    if not isinstance(weights, dict):
+                        weights = dict((key, 1) for key in weights)
+                    replica_set = _ReplicaSet(weights, eject_seconds)
+                    for key in replica_set.keys:
+                        replica_set.watch(key, self.get_engine(app, key))
+                    replicas[bind] = replica_set
+                state.replicas = replicas
+            return state.replicas
+
+    def stick_to_primary(self):
+        """Sends the rest of the current request's queries to the primary,
+        e.g. to read back data right after writing it."""
+        self.session().stick_to_primary()
+
     def get_tables_for_bind(self, bind=None):
         """Returns a list of all tables relevant for a bind."""
         result = []
@@ -619,12 +1588,18 @@ class SQLAlchemy(object):
         This is suitable for use of sessionmaker(binds=db.get_binds(app)).
         """
         app = self.get_app(app)
+        state = get_state(app)
+        # built once per set of tables, every new session asks for it
+        table_count = len(self.Model.metadata.tables)
+        if state.binds is not None and state.binds[0] == table_count:
+            return state.binds[1]
         binds = [None] + list(app.config['SQLALCHEMY_BINDS'] or ())
         retval = {}
         for bind in binds:
             engine = self.get_engine(app, bind)
             tables = self.get_tables_for_bind(bind)
             retval.update(dict((table, engine) for table in tables))
+        state.binds = (table_count, retval)
         return retval
 
     def _execute_for_all_tables(self, app, bind, operation, skip_tables=False):
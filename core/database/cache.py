@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+from __future__ import with_statement, absolute_import
+import time
+from collections import OrderedDict
+from threading import Lock
+
+
+class LRUCache(object):
+    """A size-bounded, thread-safe LRU mapping whose entries expire after
+    ``ttl`` seconds (``None`` keeps them until they are evicted).
+
+    Entries can be tagged, e.g. with the tables a query read from, so that
+    :meth:`invalidate_tag` drops every entry that depends on a table.
+
+    With ``maxbytes`` the cache also evicts once the sizes passed to
+    :meth:`set` add up to more than that.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None, maxbytes=None,
+                 timer=time.time):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.maxbytes = maxbytes
+        self.bytes = 0
+        self._timer = timer
+        self._lock = Lock()
+        #: key -> (value, expires, tags, size)
+        self._data = OrderedDict()
+        #: tag -> set of keys
+        self._tags = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, expires, tags, size = entry
+            if expires is not None and expires <= self._timer():
+                self._drop(key, entry)
+                self.expirations += 1
+                self.misses += 1
+                return default
+            # re-inserting moves the key to the most recently used end
+            self._data[key] = entry
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None, tags=(), size=0):
+        if ttl is None:
+            ttl = self.ttl
+        expires = self._timer() + ttl if ttl is not None else None
+        tags = tuple(tags)
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._drop(key, old)
+            self._data[key] = (value, expires, tags, size)
+            self.bytes += size
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while self._data and (
+                    len(self._data) > self.maxsize or
+                    self.maxbytes is not None and self.bytes > self.maxbytes):
+                self._evict()
+
+    def _evict(self):
+        key, entry = self._data.popitem(last=False)
+        self._drop(key, entry)
+        self.evictions += 1
+
+    def _drop(self, key, entry):
+        # the entry has already been removed from _data
+        self.bytes -= entry[3]
+        for tag in entry[2]:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def invalidate(self, key):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is not None:
+                self._drop(key, entry)
+                self.invalidations += 1
+
+    def invalidate_tag(self, tag):
+        with self._lock:
+            for key in self._tags.pop(tag, ()):
+                entry = self._data.pop(key, None)
+                if entry is not None:
+                    self._drop(key, entry)
+                    self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._tags.clear()
+            self.bytes = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'bytes': self.bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': float(self.hits) / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'invalidations': self.invalidations,
+        }
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+from __future__ import with_statement, absolute_import
+import sys
+import copy
+from functools import partial
+
+from sqlalchemy import inspect, orm
+from sqlalchemy.orm.attributes import set_committed_value
+from tornado.concurrent import Future
+from tornado.ioloop import IOLoop
+
+from . import lazy_values
+
+
+class GroupCommitter(object):
+    """Coalesces small writes from concurrent requests into one transaction.
+
+    :meth:`submit` queues an instance and returns a future.  The queue is
+    committed on the database executor once ``max_rows`` instances are
+    waiting or ``interval`` seconds after the first one arrived, whichever
+    comes first.  Each future resolves with its instance once the commit
+    returned, i.e. once the write is durable.  When the batch fails, its
+    writes are retried one transaction each, so every caller gets its own
+    result or its own exception.
+
+    The column values of an instance are copied when it is submitted and
+    written through a copy, like :meth:`~sqlalchemy.orm.session.Session.add`
+    would: an instance without identity is inserted, one loaded from the
+    database is updated with its modified columns.  Once committed, the
+    instance gets the written values and, if it was new, its identity, so a
+    later ``save()`` updates the row instead of inserting it again.
+
+    Only use it from the IOLoop thread.
+    """
+
+    def __init__(self, sa, app, interval=0.005, max_rows=100):
+        self.sa = sa
+        self.app = app
+        self.interval = interval
+        self.max_rows = max_rows
+        self._pending = []
+        self._timeout = None
+
+    def submit(self, instance):
+        future = Future()
+        self._pending.append((instance, _snapshot(instance), future))
+        if len(self._pending) >= self.max_rows:
+            self.flush()
+        elif self._timeout is None:
+            self._timeout = IOLoop.current().call_later(self.interval,
+                                                        self.flush)
+        return future
+
+    def flush(self):
+        io_loop = IOLoop.current()
+        if self._timeout is not None:
+            io_loop.remove_timeout(self._timeout)
+            self._timeout = None
+        batch, self._pending = self._pending, []
+        if batch:
+            snapshots = [snapshot for instance, snapshot, future in batch]
+            io_loop.add_future(self.sa.run(self._commit, snapshots),
+                               partial(self._resolve, batch))
+
+    def _commit(self, snapshots):
+        # expire_on_commit=False: the committed values are read back
+        # without reloading them
+        session = self.sa.create_session({'expire_on_commit': False})
+        try:
+            try:
+                written = [_build(session, snapshot) for snapshot in snapshots]
+                session.commit()
+                return [(True, _column_values(instance))
+                        for instance in written]
+            except Exception:
+                session.rollback()
+                if len(snapshots) == 1:
+                    return [(False, sys.exc_info()[1])]
+            results = []
+            for snapshot in snapshots:
+                try:
+                    instance = _build(session, snapshot)
+                    session.commit()
+                    results.append((True, _column_values(instance)))
+                except Exception:
+                    session.rollback()
+                    results.append((False, sys.exc_info()[1]))
+            return results
+        finally:
+            session.close()
+
+    def _resolve(self, batch, done):
+        try:
+            results = done.result()
+        except Exception:
+            exc_info = sys.exc_info()
+            for instance, snapshot, future in batch:
+                future.set_exc_info(exc_info)
+            return
+        for (instance, snapshot, future), (ok, result) in zip(batch,
+                                                                results):
+            if not ok:
+                future.set_exception(result)
+                continue
+            for key, value in result.items():
+                set_committed_value(instance, key, value)
+            if inspect(instance).transient:
+                orm.make_transient_to_detached(instance)
+            future.set_result(instance)
+
+
+def _snapshot(instance):
+    """``(mapper, has identity, unchanged values, changed values)`` of the
+    loaded columns, taken on the IOLoop thread"""
+    lazy_values.load_all(instance)
+    state = inspect(instance)
+    persistent = state.key is not None
+    values = {}
+    changed = {}
+    for prop in state.mapper.column_attrs:
+        if prop.key not in state.dict:
+            continue
+        value = state.dict[prop.key]
+        if type(value) in (dict, list):
+            value = copy.deepcopy(value)
+        if persistent and prop.key in state.committed_state:
+            changed[prop.key] = value
+        else:
+            values[prop.key] = value
+    return state.mapper, persistent, values, changed
+
+
+def _build(session, snapshot):
+    # write through a fresh instance instead of merge(): merge SELECTs
+    # every instance that has a primary key first
+    mapper, persistent, values, changed = snapshot
+    instance = mapper.class_manager.new_instance()
+    if persistent:
+        for key, value in values.items():
+            set_committed_value(instance, key, value)
+        orm.make_transient_to_detached(instance)
+        session.add(instance)
+        for key, value in changed.items():
+            setattr(instance, key, value)
+    else:
+        for key, value in values.items():
+            setattr(instance, key, value)
+        session.add(instance)
+    return instance
+
+
+def _column_values(instance):
+    state = inspect(instance)
+    return dict((prop.key, state.dict[prop.key])
+                for prop in state.mapper.column_attrs
+                if prop.key in state.dict)
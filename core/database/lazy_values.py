@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""Column values converted on first read.
+
+A column type whose result processor returns a :class:`LazyValue` (lazy
+``core.JsonString`` columns) leaves the conversion to the first read of
+the attribute.  :func:`hold_back` sets that up with public events only: the
+``load`` event moves those values out of the instance state and an
+``init_scalar`` listener converts one when its attribute is first read.
+
+Code that copies an instance's state instead of reading its attributes
+(the primary key and query caches, group commit, bulk writes) calls
+:func:`load_all` first.  :class:`~core.database.BaseQuery` converts them in
+the rows of column queries (``session.query(Model.data)``); only a plain
+``session.execute()`` returns the :class:`LazyValue` itself.
+
+An instance refreshed after it was expired converts them right away: the
+attribute being read has to be in the state once the refresh returns.
+"""
+from __future__ import absolute_import
+from functools import partial
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm.attributes import instance_dict
+
+#: key in an instance's ``__dict__`` of ``{attribute: LazyValue}``
+HELD_BACK = '_held_back'
+
+#: set once a mapper holds values back; until then rows are not checked
+active = False
+
+
+class LazyValue(object):
+    __slots__ = ()
+
+    def load(self):
+        """Returns the converted value."""
+        raise NotImplementedError
+
+
+def hold_back(mapper, keys):
+    """Holds back the :class:`LazyValue` of the ``keys`` attributes of
+    ``mapper`` until they are read."""
+    global active
+    active = True
+    keys = tuple(keys)
+    event.listen(mapper, 'load', partial(_on_load, keys))
+    event.listen(mapper, 'refresh', partial(_on_refresh, keys))
+    for key in keys:
+        # active_history: compare a new value with the converted old one,
+        # so setting an equal value does not write the column
+        event.listen(getattr(mapper.class_, key), 'init_scalar',
+                     partial(_on_init_scalar, key), retval=True,
+                     active_history=True)
+
+
+def _on_load(keys, target, context):
+    dict_ = instance_dict(target)
+    held = None
+    for key in keys:
+        if isinstance(dict_.get(key), LazyValue):
+            if held is None:
+                held = dict_.setdefault(HELD_BACK, {})
+            held[key] = dict_.pop(key)
+
+
+def _on_refresh(keys, target, context, attrs):
+    dict_ = instance_dict(target)
+    held = dict_.get(HELD_BACK)
+    for key in keys:
+        value = dict_.get(key)
+        if isinstance(value, LazyValue):
+            dict_[key] = value.load()
+        if held:
+            held.pop(key, None)
+
+
+def _on_init_scalar(key, target, value, dict_):
+    held = dict_.get(HELD_BACK)
+    if held and key in held:
+        value = dict_[key] = held.pop(key).load()
+    return value
+
+
+def load_all(instance):
+    """Converts every value ``instance`` still holds back, so that its state
+    has all the loaded column values."""
+    dict_ = instance_dict(instance)
+    held = dict_.pop(HELD_BACK, None)
+    if held:
+        expired = inspect(instance).expired_attributes
+        for key, value in held.items():
+            if key not in dict_ and key not in expired:
+                dict_[key] = value.load()
+
+
+def load_rows(rows):
+    """Converts the :class:`LazyValue` in the tuples of a query result."""
+    for row in rows:
+        if isinstance(row, tuple):
+            for value in row:
+                if isinstance(value, LazyValue):
+                    row = type(row)(value.load()
+                                    if isinstance(value, LazyValue) else value
+                                    for value in row)
+                    break
+        yield row
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""The ``lazy='batch'`` relationship loading strategy::
+
+    class Question(db.Model):
+        answers = db.relationship('Answer', lazy='batch')
+
+It behaves like ``lazy=True`` except that the first lazy load of the
+attribute also loads it for every other instance of the class already in
+the session that has not loaded it yet, with one ``IN (...)`` query.  A
+loop over a list of questions touching ``question.answers`` then costs one
+query instead of one per question.
+
+Only relationships joined on a single column equality are batched; any
+other relationship loads like ``lazy=True``.
+"""
+from __future__ import absolute_import
+from sqlalchemy.orm import attributes, strategies
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.orm.relationships import RelationshipProperty
+from sqlalchemy.sql import operators
+from sqlalchemy.sql.expression import BinaryExpression
+
+#: keys per ``IN (...)`` query
+BATCH_SIZE = 500
+
+
+@RelationshipProperty.strategy_for(lazy='batch')
+class BatchLazyLoader(strategies.LazyLoader):
+    __slots__ = ()
+
+    def _emit_lazyload(self, session, state, primary_key_identity, passive):
+        prop = self.parent_property
+        join = prop.primaryjoin
+        if (prop.secondary is not None or
+                passive & attributes.LOAD_AGAINST_COMMITTED or
+                not isinstance(join, BinaryExpression) or
+                join.operator is not operators.eq):
+            return strategies.LazyLoader._emit_lazyload(
+                self, session, state, primary_key_identity, passive)
+
+        (local_column, remote_column), = prop.local_remote_pairs
+        parent_mapper = state.manager.mapper
+        try:
+            local_key = parent_mapper.get_property_by_column(local_column).key
+            remote_key = self.mapper.get_property_by_column(remote_column).key
+        except Exception:
+            return strategies.LazyLoader._emit_lazyload(
+                self, session, state, primary_key_identity, passive)
+
+        # instances of the same class in the session, this one included,
+        # that have not loaded the attribute yet
+        pending = {}
+        for sibling in session.identity_map.all_states():
+            if (sibling.manager is state.manager and sibling.key and
+                    self.key not in sibling.dict and
+                    local_key in sibling.dict):
+                value = sibling.dict[local_key]
+                if value is not None:
+                    pending.setdefault(value, []).append(sibling)
+        if state.dict.get(local_key) is None or len(pending) < 2:
+            return strategies.LazyLoader._emit_lazyload(
+                self, session, state, primary_key_identity, passive)
+
+        loaded = {}
+        values = list(pending)
+        for start in range(0, len(values), BATCH_SIZE):
+            query = session.query(self.entity).filter(
+                remote_column.in_(values[start:start + BATCH_SIZE]))
+            if passive & attributes.NO_AUTOFLUSH:
+                query = query.autoflush(False)
+            if prop.order_by:
+                query = query.order_by(*prop.order_by)
+            for instance in query:
+                loaded.setdefault(getattr(instance, remote_key),
+                                  []).append(instance)
+
+        result = None
+        for value, siblings in pending.items():
+            related = loaded.get(value, [])
+            if not self.uselist:
+                related = related[0] if related else None
+            for sibling in siblings:
+                if sibling is state:
+                    result = related
+                    continue
+                instance = sibling.obj()
+                if instance is not None:
+                    set_committed_value(instance, self.key,
+                                        list(related) if self.uselist
+                                        else related)
+        return result
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+from __future__ import with_statement, absolute_import
+import re
+import time
+from bisect import bisect_left
+from threading import Lock
+
+_string_re = re.compile(r"'(?:[^'\\]|\\.|'')*'")
+_number_re = re.compile(r'\b\d+(?:\.\d+)?\b')
+_in_list_re = re.compile(r'\bIN\s*\((?:\s*\?\s*,)*\s*\?\s*\)', re.I)
+_space_re = re.compile(r'\s+')
+
+#: upper bounds of the latency buckets, in milliseconds
+BUCKETS = (0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000,
+           float('inf'))
+
+
+def fingerprint(statement):
+    """Normalizes a SQL statement so that executions which only differ in
+    their literals share one fingerprint."""
+    statement = _string_re.sub('?', statement)
+    statement = _number_re.sub('?', statement.replace('%s', '?'))
+    statement = _in_list_re.sub('IN (...)', statement)
+    return _space_re.sub(' ', statement).strip()
+
+
+class Histogram(object):
+    """Latency histogram over the fixed :data:`BUCKETS`."""
+
+    __slots__ = ('counts', 'count', 'total', 'max', 'rows')
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.rows = 0
+
+    def add(self, ms, rows):
+        self.counts[bisect_left(BUCKETS, ms)] += 1
+        self.count += 1
+        self.total += ms
+        self.rows += rows
+        if ms > self.max:
+            self.max = ms
+
+    def percentile(self, pct):
+        """Upper bound of the bucket holding the ``pct`` percentile."""
+        rank = pct / 100.0 * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if count and seen >= rank:
+                return round(min(bound, self.max), 3)
+        return round(self.max, 3)
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'total_ms': round(self.total, 3),
+            'mean_ms': round(self.total / self.count, 3) if self.count else 0,
+            'p50_ms': self.percentile(50),
+            'p95_ms': self.percentile(95),
+            'p99_ms': self.percentile(99),
+            'max_ms': round(self.max, 3),
+            'rows': self.rows,
+        }
+
+
+class _FingerprintStats(Histogram):
+    __slots__ = ('call_sites',)
+
+    def __init__(self):
+        Histogram.__init__(self)
+        self.call_sites = {}
+
+
+class QueryStats(object):
+    """Fixed-size query statistics that are cheap enough for production.
+
+    Keeps a :class:`Histogram` and a row count per statement fingerprint
+    and per endpoint.  Fingerprints beyond ``max_fingerprints`` and
+    endpoints beyond ``max_endpoints`` are folded into ``'<other>'``.
+    Only every ``sample_every``-th execution of a fingerprint looks up its
+    call site, and at most ``max_call_sites`` distinct sites are kept.
+    """
+
+    OTHER = '<other>'
+
+    def __init__(self, max_fingerprints=500, max_endpoints=200,
+                 sample_every=100, max_call_sites=5):
+        self.max_fingerprints = max_fingerprints
+        self.max_endpoints = max_endpoints
+        self.sample_every = sample_every
+        self.max_call_sites = max_call_sites
+        self._lock = Lock()
+        self._fingerprints = {}
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.by_fingerprint = {}
+            self.by_endpoint = {}
+            self.since = time.time()
+
+    def fingerprint(self, statement):
+        # the same few statement strings come back over and over
+        fp = self._fingerprints.get(statement)
+        if fp is None:
+            if len(self._fingerprints) >= self.max_fingerprints * 4:
+                self._fingerprints.clear()
+            fp = self._fingerprints[statement] = fingerprint(statement)
+        return fp
+
+    def record(self, statement, ms, rows, endpoint, call_site=None):
+        """Adds one execution.  ``call_site`` is a callable returning the
+        caller's location; it is only called for sampled executions."""
+        fp = self.fingerprint(statement)
+        with self._lock:
+            stats = self.by_fingerprint.get(fp)
+            if stats is None:
+                if len(self.by_fingerprint) >= self.max_fingerprints:
+                    fp = self.OTHER
+                stats = self.by_fingerprint.setdefault(fp,
+                                                       _FingerprintStats())
+            stats.add(ms, rows)
+            sampled = (call_site is not None and
+                       (stats.count - 1) % self.sample_every == 0)
+
+            by_endpoint = self.by_endpoint.get(endpoint)
+            if by_endpoint is None:
+                if len(self.by_endpoint) >= self.max_endpoints:
+                    endpoint = self.OTHER
+                by_endpoint = self.by_endpoint.setdefault(endpoint,
+                                                          Histogram())
+            by_endpoint.add(ms, rows)
+
+        if sampled:
+            site = call_site()
+            with self._lock:
+                sites = stats.call_sites
+                if site in sites or len(sites) < self.max_call_sites:
+                    sites[site] = sites.get(site, 0) + 1
+
+    def snapshot(self):
+        """The aggregates as plain, JSON serializable data."""
+        with self._lock:
+            fingerprints = []
+            for fp, stats in self.by_fingerprint.items():
+                item = stats.to_dict()
+                item['fingerprint'] = fp
+                item['call_sites'] = sorted(stats.call_sites.items(),
+                                            key=lambda site: -site[1])
+                fingerprints.append(item)
+            endpoints = []
+            for endpoint, stats in self.by_endpoint.items():
+                item = stats.to_dict()
+                item['endpoint'] = endpoint
+                endpoints.append(item)
+        fingerprints.sort(key=lambda item: -item['total_ms'])
+        endpoints.sort(key=lambda item: -item['total_ms'])
+        return {
+            'since': self.since,
+            'fingerprints': fingerprints,
+            'endpoints': endpoints,
+        }
@@ -1,28 +1,143 @@
 # -*- coding: utf-8 -*-
+import json
+import types
+
 import tornado.web
+import tornado.websocket
+from tornado import gen, stack_context
+
+from .database import RequestContext
 
 
 class RequestHandler(tornado.web.RequestHandler):
+    #: 按顺序包装 HTTP 方法的装饰器, 第一个在最里层.  装饰器收到类里定义的函数,
+    #: 返回的函数调用时第一个参数是 handler.  每个类的每个方法只包装一次,
+    #: 见 :meth:`compile_methods`
     on_initialize_decorators = []
+    #: 正在处理的请求, worker 退出前等它们结束 (见 core.supervisor);
+    #: 客户端断开的不再等
+    active = set()
+    #: 还在运行的请求, 包括客户端已经断开的, 准入控制按它计数
+    in_flight = set()
+    #: 是否经过准入控制 (见 core.admission)
+    admission_control = True
+    #: 被准入控制拒绝的原因
+    shed_reason = None
+
+    @classmethod
+    def compile_methods(cls):
+        """把 ``on_initialize_decorators`` 应用到 HTTP 方法上并缓存在类上.
+        ``Config.update_uri`` 注册路由时调用, 没有注册的类在第一个请求时调用;
+        之后再修改 ``on_initialize_decorators`` 需要重新调用."""
+        methods = {}
+        decorators = cls.on_initialize_decorators
+        for method in cls.SUPPORTED_METHODS if decorators else ():
+            name = method.lower()
+            func = getattr(cls, name)
+            func = getattr(func, '__func__', func)
+            for decorator in decorators:
+                func = decorator(func)
+            methods[name] = func
+        cls._decorated_methods = methods
+        return methods
 
     def initialize(self):
-        request = self.request
-        meth = getattr(self, self.request.method.lower(), None)
-        if meth is None and self.request.method == 'HEAD':
-            meth = getattr(self, 'get', None)
-        assert meth is not None, 'Unimplemented method %r' % request.method
+        cls = type(self)
+        methods = cls.__dict__.get('_decorated_methods')
+        if methods is None:
+            methods = cls.compile_methods()
+        if methods:
+            name = self.request.method.lower()
+            func = methods.get(name)
+            if func is not None:
+                setattr(self, name, types.MethodType(func, self))
 
-        for decorator in self.on_initialize_decorators:
-            meth = decorator(meth)
+    def _execute(self, transforms, *args, **kwargs):
+        admission = getattr(self.application, 'admission', None)
+        if admission is not None and self.admission_control:
+            rejected = admission.admit(self, len(RequestHandler.in_flight))
+            if rejected is not None:
+                return self._shed(transforms, *rejected)
+        # 整个请求(包括协程 yield 之后的回调)都在同一个 RequestContext 中执行,
+        # db.session 因此按请求隔离, 在 on_finish 中移除
+        context = RequestContext(self.application, self)
+        RequestHandler.active.add(self)
+        RequestHandler.in_flight.add(self)
+        with stack_context.StackContext(lambda: context):
+            return super(RequestHandler, self)._execute(
+                transforms, *args, **kwargs)
 
-        setattr(self, self.request.method.lower(), meth)
+    def _shed(self, transforms, status, reason, retry_after):
+        # 不运行 prepare, handler 和 teardown, 直接返回
+        self._transforms = transforms
+        self.shed_reason = reason
+        if self._prepared_future is not None:
+            self._prepared_future.set_result(None)
+        # Python 2 的 httplib 没有 429
+        self.set_status(status, 'Too Many Requests' if status == 429 else None)
+        self.set_header('Retry-After', retry_after)
+        self.set_header('Content-Type', 'text/plain; charset=UTF-8')
+        self.finish('%s: %s' % (status, reason))
 
     def on_finish(self):
-        for func in self.application.teardown_request_funcs:
-            func(self)
+        RequestHandler.active.discard(self)
+        RequestHandler.in_flight.discard(self)
+        if self.shed_reason is None:
+            # 响应已经发送完, 异步和 defer 的 hook 不等它们运行完
+            self.application.teardown_pipeline.run(self)
+
+    def on_connection_close(self):
+        RequestHandler.active.discard(self)
 
     def set_headers(self, items):
         if items is None:
             return
         for k, v in items:
-            self.set_header(k, v)
\ No newline at end of file
+            self.set_header(k, v)
+
+    @gen.coroutine
+    def write_json_stream(self, chunks, serialize=None):
+        """把 ``chunks`` (行的列表的迭代器, 比如 ``query.stream()``) 逐块写成
+        一个 JSON 数组, 每块之后 ``flush()`` 并等待写入 socket,
+        内存占用与结果集大小无关::
+
+            @gen.coroutine
+            def get(self, id):
+                query = Answer.query.filter_by(user_id=id)
+                yield self.write_json_stream(query.stream(500),
+                                             lambda a: a.to_dict())
+
+        ``serialize`` 把一行转换成可以 ``json.dumps`` 的对象.
+        客户端断开时停止读取并关闭 ``chunks``.
+        """
+        self.set_header('Content-Type', 'application/json; charset=UTF-8')
+        self.write('[')
+        separator = ''
+        try:
+            for chunk in chunks:
+                if serialize is not None:
+                    chunk = [serialize(row) for row in chunk]
+                if not chunk:
+                    continue
+                self.write(separator + json.dumps(chunk)[1:-1])
+                separator = ','
+                yield self.flush()
+        finally:
+            close = getattr(chunks, 'close', None)
+            if close is not None:
+                close()
+        self.write(']')
+
+
+class WebSocketHandler(tornado.websocket.WebSocketHandler):
+    #: 打开的连接, worker 退出前关闭它们 (见 core.supervisor)
+    connections = set()
+
+    def get(self, *args, **kwargs):
+        super(WebSocketHandler, self).get(*args, **kwargs)
+        if self.ws_connection is not None:
+            WebSocketHandler.connections.add(self)
+
+    def on_connection_close(self):
+        WebSocketHandler.connections.discard(self)
+        super(WebSocketHandler, self).on_connection_close()
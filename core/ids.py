@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""字符串 ID 生成器, 见 :func:`core.generator_string_id`.
+
+格式: ``start_num`` + 2006-01-02 到现在的厘秒数 + worker 号 + 序号, 总长度 ``length``.
+和旧的 ``填充0 + 厘秒数 + 3位随机数`` 格式长度相同, 同样长度下新 ID 都大于旧 ID.
+
+- 每个进程单调递增: 同一厘秒内递增序号, 序号用完就借用下一厘秒, 时钟回拨时沿用上一厘秒
+- worker 号默认是 ``http_server.start(n)`` 或 supervisor fork 出来的 task id 加上
+  ``worker_base``; 多台机器需要配置不同的 ``ID_WORKER_BASE``,
+  间隔至少是 worker 数的两倍 (supervisor 替换 worker 期间新旧 worker 的 task id 不同)
+- 不是 fork 出来的进程 (脚本, manage.py 命令) 没有 task id, 每个进程随机取一个
+  worker 号.  两个这样的进程 worker 号相同的概率是 ``1 / 10 ** worker_digits``
+  (默认 1%), 和 fork 出来的 worker 相同的概率也一样; 相同时只有两边在同一厘秒内
+  用到同一个序号才会生成重复的 ID.  长时间运行并且大量生成 ID 的进程用
+  ``generator.configure(worker_id=...)`` 指定一个不和其他进程重复的号
+- :meth:`IdGenerator.reserve` 一次取一批, 只加一次锁
+"""
+from __future__ import absolute_import
+
+import os
+import time
+import random
+import threading
+from datetime import datetime
+
+EPOCH = datetime(2006, 1, 2)
+_EPOCH_SECONDS = time.mktime(EPOCH.timetuple())
+
+
+class IdGenerator(object):
+    def __init__(self, worker_id=None, worker_base=0, worker_digits=2):
+        self.worker_id = worker_id
+        self.worker_base = worker_base
+        self.worker_digits = worker_digits
+        self._lock = threading.Lock()
+        self._pid = None
+        self._worker = None
+        self._last = 0
+        self._sequence = -1
+
+    def configure(self, worker_id=None, worker_base=None, worker_digits=None):
+        with self._lock:
+            if worker_id is not None:
+                self.worker_id = worker_id
+            if worker_base is not None:
+                self.worker_base = worker_base
+            if worker_digits is not None:
+                self.worker_digits = worker_digits
+            self._pid = None
+
+    def _current_worker(self):
+        if self.worker_id is not None:
+            worker = self.worker_id
+        else:
+            # tornado.process 会导入 ioloop 和 netutil, 数据库命令不需要
+            from tornado.process import task_id
+
+            task = task_id()
+            if task is None:
+                # pid 在同一台机器上取模后很容易相同, 随机数至少不相关
+                return random.SystemRandom().randrange(10 ** self.worker_digits)
+            worker = self.worker_base + task
+        return worker % 10 ** self.worker_digits
+
+    def _sequence_digits(self, length, prefix, current):
+        digits = length - len(prefix) - len(str(current)) - self.worker_digits
+        if digits < 1:
+            raise ValueError('length %d is too short for ids starting with %s'
+                             % (length, prefix))
+        return digits
+
+    def next_id(self, length=16, start_num=1):
+        return self.reserve(1, length, start_num)[0]
+
+    def reserve(self, count, length=16, start_num=1):
+        """返回 ``count`` 个递增的 ID"""
+        prefix = str(start_num)
+        with self._lock:
+            pid = os.getpid()
+            if pid != self._pid:
+                # fork 之后重新确定 worker 号
+                self._pid = pid
+                self._worker = self._current_worker()
+            now = int((time.time() - _EPOCH_SECONDS) * 100)
+            if now > self._last:
+                self._last, self._sequence = now, -1
+            current = self._last
+            sequence = self._sequence
+            sequence_digits = self._sequence_digits(length, prefix, current)
+            ids = []
+            for _ in range(count):
+                sequence += 1
+                if sequence >= 10 ** sequence_digits:
+                    current += 1
+                    sequence = 0
+                    sequence_digits = self._sequence_digits(
+                        length, prefix, current)
+                ids.append('%s%d%0*d%0*d' % (
+                    prefix, current, self.worker_digits, self._worker,
+                    sequence_digits, sequence))
+            self._last, self._sequence = current, sequence
+        return ids
+
+
+generator = IdGenerator()
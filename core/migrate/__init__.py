@@ -2,14 +2,30 @@
 from __future__ import with_statement, absolute_import
 import os
 import argparse
-from alembic import __version__ as __alembic_version__
-from alembic.config import Config as AlembicConfig
-from alembic import command
+import importlib
 
-alembic_version = tuple([int(v) for v in __alembic_version__.split('.')[0:3]])
 current_app = None
 
 
+class _LazyModule(object):
+    """第一次使用时才导入.  alembic 导入要 0.1 秒以上, 只有执行迁移命令时才需要,
+    启动服务时不导入"""
+
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, key):
+        return getattr(importlib.import_module(self._name), key)
+
+
+command = _LazyModule('alembic.command')
+
+
+def _alembic_version():
+    from alembic import __version__
+    return tuple([int(v) for v in __version__.split('.')[0:3]])
+
+
 class _MigrateConfig(object):
     def __init__(self, migrate, db, **kwargs):
         self.migrate = migrate
@@ -26,13 +42,6 @@ class _MigrateConfig(object):
         return self.db.metadata
 
 
-class Config(AlembicConfig):
-    def get_template_directory(self):
-        package_dir = os.path.abspath(os.path.dirname(__file__))
-        print package_dir
-        return os.path.join(package_dir, 'templates')
-
-
 class Migrate(object):
     def __init__(self, app=None, db=None, directory='migrations', **kwargs):
         self.configure_callbacks = []
@@ -62,6 +71,7 @@ class Migrate(object):
         return config
 
     def get_config(self, directory, x_arg=None, opts=None):
+        from .config import Config
         if directory is None:
             directory = self.directory
         config = Config(os.path.join(directory, 'alembic.ini'))
@@ -83,6 +93,7 @@ class Migrate(object):
 
 def init(directory=None, multidb=False):
     """Creates a new migration repository"""
+    from .config import Config
     if directory is None:
         directory = current_app.extensions['migrate'].directory
     config = Config()
@@ -97,8 +108,9 @@ def revision(directory=None, message=None, autogenerate=False, sql=False,
               head='head', splice=False, branch_label=None, version_path=None,
               rev_id=None):
     """Create a new revision file."""
-    config = current_app.extensions['migrate'].migrate.get_config(directory)
-    if alembic_version >= (0, 7, 0):
+    config = current_app.extensions['migrate'].migrate.get_config(
+        directory, opts=['autogenerate'] if autogenerate else None)
+    if _alembic_version() >= (0, 7, 0):
         command.revision(config, message, autogenerate=autogenerate, sql=sql,
                          head=head, splice=splice, branch_label=branch_label,
                          version_path=version_path, rev_id=rev_id)
@@ -111,7 +123,7 @@ def migrate(directory=None, message=None, sql=False, head='head', splice=False,
     """Alias for 'revision --autogenerate'"""
     config = current_app.extensions['migrate'].migrate.get_config(
         directory, opts=['autogenerate'])
-    if alembic_version >= (0, 7, 0):
+    if _alembic_version() >= (0, 7, 0):
         command.revision(config, message, autogenerate=True, sql=sql,
                          head=head, splice=splice, branch_label=branch_label,
                          version_path=version_path, rev_id=rev_id)
@@ -121,7 +133,7 @@ def migrate(directory=None, message=None, sql=False, head='head', splice=False,
 
 def edit(directory=None, revision='current'):
     """Edit current revision."""
-    if alembic_version >= (0, 8, 0):
+    if _alembic_version() >= (0, 8, 0):
         config = current_app.extensions['migrate'].migrate.get_config(
             directory)
         command.edit(config, revision)
@@ -132,7 +144,7 @@ def edit(directory=None, revision='current'):
 def merge(directory=None, revisions='', message=None, branch_label=None,
            rev_id=None):
     """Merge two revisions together.  Creates a new migration file"""
-    if alembic_version >= (0, 7, 0):
+    if _alembic_version() >= (0, 7, 0):
         config = current_app.extensions['migrate'].migrate.get_config(
             directory)
         command.merge(config, revisions, message=message,
@@ -159,7 +171,7 @@ def downgrade(directory=None, revision='-1', sql=False, tag=None, x_arg=None):
 
 def show(directory=None, revision='head'):
     """Show the revision denoted by the given symbol."""
-    if alembic_version >= (0, 7, 0):
+    if _alembic_version() >= (0, 7, 0):
         config = current_app.extensions['migrate'].migrate.get_config(
             directory)
         command.show(config, revision)
@@ -170,7 +182,7 @@ def show(directory=None, revision='head'):
 def history(directory=None, rev_range=None, verbose=False):
     """List changeset scripts in chronological order."""
     config = current_app.extensions['migrate'].migrate.get_config(directory)
-    if alembic_version >= (0, 7, 0):
+    if _alembic_version() >= (0, 7, 0):
         command.history(config, rev_range, verbose=verbose)
     else:
         command.history(config, rev_range)
@@ -178,7 +190,7 @@ def history(directory=None, rev_range=None, verbose=False):
 
 def heads(directory=None, verbose=False, resolve_dependencies=False):
     """Show current available heads in the script directory"""
-    if alembic_version >= (0, 7, 0):
+    if _alembic_version() >= (0, 7, 0):
         config = current_app.extensions['migrate'].migrate.get_config(
             directory)
         command.heads(config, verbose=verbose,
@@ -190,7 +202,7 @@ def heads(directory=None, verbose=False, resolve_dependencies=False):
 def branches(directory=None, verbose=False):
     """Show current branch points"""
     config = current_app.extensions['migrate'].migrate.get_config(directory)
-    if alembic_version >= (0, 7, 0):
+    if _alembic_version() >= (0, 7, 0):
         command.branches(config, verbose=verbose)
     else:
         command.branches(config)
@@ -199,7 +211,7 @@ def branches(directory=None, verbose=False):
 def current(directory=None, verbose=False, head_only=False):
     """Display the current revision for each database."""
     config = current_app.extensions['migrate'].migrate.get_config(directory)
-    if alembic_version >= (0, 7, 0):
+    if _alembic_version() >= (0, 7, 0):
         command.current(config, verbose=verbose, head_only=head_only)
     else:
         command.current(config)
@@ -0,0 +1,11 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+import os
+from alembic.config import Config as AlembicConfig
+
+
+class Config(AlembicConfig):
+    def get_template_directory(self):
+        package_dir = os.path.abspath(os.path.dirname(__file__))
+        print package_dir
+        return os.path.join(package_dir, 'templates')
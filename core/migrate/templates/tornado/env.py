@@ -1,3 +1,4 @@
+# -*- coding: utf-8 -*-
 from __future__ import with_statement
 from alembic import context
 from sqlalchemy import engine_from_config, pool
@@ -17,7 +18,14 @@ logger = logging.getLogger('alembic.env')
 # for 'autogenerate' support
 # from myapp import mymodel
 # target_metadata = mymodel.Base.metadata
-from manage import app
+from core.migrate import current_app as app
+if app is None:
+    # 没有通过 manage.py db 运行
+    from manage import build_app
+    app = build_app('db')
+# manage.py db 不导入路由模块, autogenerate 对比数据库需要的模型在这里导入,
+# 否则 target_metadata 是空的, 生成的迁移会删掉所有表
+import model  # noqa
 config.set_main_option('sqlalchemy.url',
                        app.config['SQLALCHEMY_DATABASE_URI'])
 target_metadata = app.extensions['migrate'].db.metadata
@@ -57,7 +65,9 @@ def run_migrations_online():
 
     """
     def process_revision_directives(context, revision, directives):
-        if getattr(config.cmd_opts, 'autogenerate', False):
+        revision_context = context.opts.get('revision_context')
+        if (revision_context is not None and
+                revision_context.command_args['autogenerate']):
             script = directives[0]
             if script.upgrade_ops.is_empty():
                 directives[:] = []
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""GET 响应缓存, 放在 handler 的 ``on_initialize_decorators`` 里::
+
+    class MainRequestHandler(ApiHandler):
+        on_initialize_decorators = [cached(ttl=30, tables=['user'])]
+
+缓存的 key 是 endpoint, 路径参数, 查询参数和 ``vary`` 里的请求头.  只缓存
+没有设置 cookie 的 200 响应; 命中时不运行 handler.  响应带强 ETag (压缩后
+是弱 ETag, 见 :class:`~core.compression.CompressionTransform`),
+``If-None-Match`` 匹配时返回 304 (tornado 在 ``finish`` 里比较).
+
+带 ``Cookie`` 或 ``Authorization`` 请求头的请求不查也不存缓存, 响应可能是这个用户
+自己的; 这样的接口要缓存, 把这个头放进 ``vary``, 每个用户一份.
+
+``tables`` 里的表在本进程 commit 前 (``SQLALCHEMY_COMMIT_ON_TEARDOWN`` 的
+:data:`~core.database.models_committing`) 和 commit 后
+(:data:`~core.database.models_committed`,
+:data:`~core.database.models_bulk_committed`) 相关的响应被删除, 其它进程的修改只能等 ``ttl`` 过期.  handler 运行期间
+这些表有 commit 的, 响应可能是 commit 之前查出来的, 也不存.
+"""
+from __future__ import absolute_import
+
+import functools
+
+from tornado.concurrent import is_future
+
+from .database import (models_committed, models_bulk_committed,
+                       models_committing, _changed_tables)
+from .database.cache import LRUCache
+from .routing import endpoint_name
+
+# 重放时不复制的响应头, finish 时重新生成
+_SKIP_HEADERS = frozenset(['Date', 'Server', 'Content-Length', 'Etag'])
+
+# 带这些请求头的请求不缓存, 除非在 vary 里
+_CREDENTIAL_HEADERS = ('Cookie', 'Authorization')
+
+
+class ResponseCache(object):
+    def __init__(self, maxsize=1024, ttl=60, maxbytes=64 * 1024 * 1024):
+        self.cache = LRUCache(maxsize, ttl, maxbytes)
+        self._listening = False
+        # 表 -> commit 次数, 判断 handler 运行期间有没有 commit
+        self._generations = {}
+
+    def cached(self, ttl=None, vary=(), tables=()):
+        """返回缓存 GET 的装饰器, 其它 HTTP 方法不变.  ``ttl`` 默认用
+        ``ResponseCache`` 的 ``ttl``"""
+        vary = tuple(vary)
+        tables = tuple(tables)
+        credentials = tuple(
+            name for name in _CREDENTIAL_HEADERS
+            if name.lower() not in set(header.lower() for header in vary))
+        if tables and not self._listening:
+            models_committed.connect(self._on_committed)
+            models_bulk_committed.connect(self._on_committed)
+            models_committing.connect(self._on_committed)
+            self._listening = True
+
+        def decorator(func):
+            if getattr(func, '__name__', None) != 'get':
+                return func
+
+            @functools.wraps(func)
+            def wrapper(handler, *args, **kwargs):
+                headers = handler.request.headers
+                if any(name in headers for name in credentials):
+                    return func(handler, *args, **kwargs)
+                key = self.key(handler, args, kwargs, vary)
+                entry = self.cache.get(key)
+                if entry is not None:
+                    self._replay(handler, entry, vary)
+                    return None
+                generation = self._generation(tables)
+                result = func(handler, *args, **kwargs)
+                if is_future(result):
+                    result.add_done_callback(
+                        lambda future: future.exception() is None and
+                        self._store(handler, key, ttl, vary, tables,
+                                    generation))
+                else:
+                    self._store(handler, key, ttl, vary, tables, generation)
+                return result
+            return wrapper
+        return decorator
+
+    def key(self, handler, args, kwargs, vary=()):
+        request = handler.request
+        return (endpoint_name(type(handler)), args,
+                tuple(sorted(kwargs.items())),
+                tuple(sorted((name, tuple(values)) for name, values
+                             in request.query_arguments.items())),
+                tuple(request.headers.get(name) for name in vary))
+
+    def _generation(self, tables):
+        generations = self._generations
+        return tuple(generations.get(table, 0) for table in tables)
+
+    def _store(self, handler, key, ttl, vary, tables, generation):
+        if (handler._finished or handler._headers_written or
+                handler.get_status() != 200 or
+                getattr(handler, '_new_cookie', None) or
+                self._generation(tables) != generation):
+            return
+        body = b''.join(handler._write_buffer)
+        etag = handler.compute_etag()
+        headers = [(name, value) for name, value in handler._headers.get_all()
+                   if name not in _SKIP_HEADERS]
+        handler.set_header('Etag', etag)
+        if vary:
+            handler.set_header('Vary', ', '.join(vary))
+        self.cache.set(key, (headers, body, etag), ttl, tables,
+                       len(body))
+
+    def _replay(self, handler, entry, vary):
+        headers, body, etag = entry
+        names = set()
+        for name, value in headers:
+            if name in names:
+                handler.add_header(name, value)
+            else:
+                handler.set_header(name, value)
+                names.add(name)
+        handler.set_header('Etag', etag)
+        if vary:
+            handler.set_header('Vary', ', '.join(vary))
+        if handler.check_etag_header():
+            handler.set_status(304)
+        else:
+            handler.write(body)
+
+    def _on_committed(self, app, changes):
+        generations = self._generations
+        for table in _changed_tables(changes):
+            generations[table] = generations.get(table, 0) + 1
+            if len(self.cache):
+                self.cache.invalidate_tag(table)
+
+    def stats(self):
+        return self.cache.stats()
+
+    def clear(self):
+        self.cache.clear()
+
+
+response_cache = ResponseCache()
+cached = response_cache.cached
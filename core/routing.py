@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+"""编译过的路由表, 代替 tornado 对每个请求按顺序逐个匹配正则:
+
+- 不含正则的路径 (``/``, ``/_internal/query_stats``) 放在 dict 里, 一次查找
+- 其它路由按正则前面固定的目录分组 (比如 url_prefix ``ws`` 下的
+  ``/ws/things/(\d+)`` 在 ``/ws/things/`` 组), 请求只匹配最长的那个前缀组,
+  组里包括前缀更短的路由
+- 匹配结果和 tornado 相同: 多个路由都能匹配时还是先注册的优先
+
+每个 endpoint (``blueprint.endpoint``, 见 ``Config.uri_tuple``) 匹配到的次数记在
+:attr:`CompiledRouter.hits`, 没有匹配的请求数记在 :attr:`CompiledRouter.misses`.
+"""
+from __future__ import absolute_import
+
+import re
+from collections import Counter
+
+from tornado.routing import PathMatches
+from tornado.web import _ApplicationRouter
+
+_SPECIAL = frozenset('.^$*+?{}[]|()')
+_QUANTIFIERS = frozenset('*+?{')
+
+
+def endpoint_name(target):
+    endpoint = getattr(target, 'endpoint', None) or getattr(
+        target, '__name__', type(target).__name__)
+    blueprint = getattr(target, 'blueprint', None)
+    if blueprint:
+        return '%s.%s' % (blueprint, endpoint)
+    return endpoint
+
+
+def parse_pattern(pattern):
+    """返回 ``(literal, prefix)``: 整个 pattern 不含正则时 ``literal`` 是它匹配的
+    路径, 否则是 None; ``prefix`` 是所有匹配的路径都以它开头的固定部分."""
+    if pattern.startswith('^'):
+        pattern = pattern[1:]
+    if pattern.endswith('$') and not pattern.endswith('\\$'):
+        pattern = pattern[:-1]
+    chars = []
+    escaped = False
+    for c in pattern:
+        if escaped:
+            if c.isalnum():
+                # \d \w 等字符类
+                return None, ''.join(chars)
+            chars.append(c)
+            escaped = False
+        elif c == '\\':
+            escaped = True
+        elif c in _SPECIAL:
+            if c in _QUANTIFIERS and chars:
+                # 前一个字符可以不出现或重复
+                chars.pop()
+            if _top_level_alternation(pattern):
+                return None, ''
+            return None, ''.join(chars)
+        else:
+            chars.append(c)
+    if escaped:
+        return None, ''
+    return ''.join(chars), ''.join(chars)
+
+
+def _top_level_alternation(pattern):
+    depth = 0
+    escaped = in_class = False
+    for c in pattern:
+        if escaped:
+            escaped = False
+        elif c == '\\':
+            escaped = True
+        elif in_class:
+            in_class = c != ']'
+        elif c == '[':
+            in_class = True
+        elif c == '(':
+            depth += 1
+        elif c == ')':
+            depth -= 1
+        elif c == '|' and depth == 0:
+            return True
+    return False
+
+
+def _directory(prefix):
+    # 固定部分里最后一个 / 之前的目录; 只有 / 时所有路径都可能匹配
+    directory = prefix[:prefix.rfind('/') + 1]
+    return directory if len(directory) > 1 else None
+
+
+class _Table(object):
+    __slots__ = ('static', 'groups', 'fallback')
+
+    def __init__(self, static, groups, fallback):
+        self.static = static
+        self.groups = groups
+        self.fallback = fallback
+
+
+class CompiledRouter(_ApplicationRouter):
+    """``Application.wildcard_router`` 的替代, 规则改变后第一次查找时重新编译"""
+
+    def __init__(self, application, rules=None):
+        self.hits = Counter()
+        self.misses = 0
+        self._table = None
+        super(CompiledRouter, self).__init__(application, rules)
+
+    def add_rules(self, rules):
+        super(CompiledRouter, self).add_rules(rules)
+        self._table = None
+
+    def compile(self):
+        static = {}
+        grouped = {}
+        ordered = []
+        fallback = []
+        for index, rule in enumerate(self.rules):
+            entry = (index, rule, endpoint_name(rule.target))
+            matcher = rule.matcher
+            if not isinstance(matcher, PathMatches):
+                fallback.append(entry)
+                ordered.append(entry)
+                continue
+            literal, prefix = parse_pattern(matcher.regex.pattern)
+            if matcher.regex.flags & re.I:
+                literal, prefix = None, ''
+            if literal is not None:
+                # 前面的路由已经能匹配这个路径时不能直接查 dict
+                shadowed = literal in static or any(
+                    not isinstance(e[1].matcher, PathMatches) or
+                    e[1].matcher.regex.match(literal) for e in ordered)
+                if not shadowed:
+                    static[literal] = entry
+                    continue
+            ordered.append(entry)
+            directory = _directory(prefix)
+            if directory is None:
+                fallback.append(entry)
+            else:
+                grouped.setdefault(directory, []).append(entry)
+        groups = {}
+        for directory in grouped:
+            entries = list(fallback)
+            for other, members in grouped.items():
+                if directory.startswith(other):
+                    entries.extend(members)
+            groups[directory] = [e[1:] for e in sorted(entries)]
+        self._table = _Table(
+            dict((path, e[1:]) for path, e in static.items()),
+            groups, [e[1:] for e in fallback])
+        return self._table
+
+    def find_handler(self, request, **kwargs):
+        table = self._table or self.compile()
+        path = request.path
+        entry = table.static.get(path)
+        if entry is not None:
+            rule, name = entry
+            delegate = self._delegate(rule, request, {})
+            if delegate is not None:
+                self.hits[name] += 1
+                return delegate
+            # 嵌套的 router 没有处理, 按顺序匹配所有路由
+            candidates = [(r, endpoint_name(r.target)) for r in self.rules]
+        else:
+            candidates = table.fallback
+            groups = table.groups
+            end = path.rfind('/')
+            while end > 0:
+                group = groups.get(path[:end + 1])
+                if group is not None:
+                    candidates = group
+                    break
+                end = path.rfind('/', 0, end)
+        for rule, name in candidates:
+            params = rule.matcher.match(request)
+            if params is not None:
+                delegate = self._delegate(rule, request, params)
+                if delegate is not None:
+                    self.hits[name] += 1
+                    return delegate
+        self.misses += 1
+        return None
+
+    def _delegate(self, rule, request, params):
+        if rule.target_kwargs:
+            params['target_kwargs'] = rule.target_kwargs
+        return self.get_target_delegate(rule.target, request, **params)
+
+    def snapshot(self):
+        return {
+            'endpoints': sorted(
+                ({'endpoint': name, 'hits': count}
+                 for name, count in self.hits.items()),
+                key=lambda item: -item['hits']),
+            'misses': self.misses,
+        }
+
+    def reset(self):
+        self.hits.clear()
+        self.misses = 0
+
+
+def install(application):
+    """用 :class:`CompiledRouter` 代替 ``application`` 默认 host 的路由"""
+    router = CompiledRouter(application, application.wildcard_router.rules)
+    application.wildcard_router = router
+    application.default_router.rules[-1].target = router
+    return router
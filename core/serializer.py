@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""模型序列化成 dict.
+
+每个模型和字段组合只检查一次 mapper, 生成专用的函数并缓存::
+
+    serializer = User.serializer(fields=('id', 'name', 'created'))
+    serializer.one(user)        # {'id': 1, 'name': u'...', 'created': '...'}
+    serializer.many(users)      # 一次遍历转换整个列表
+
+    user.to_dict()
+
+列的类型在 :data:`converters` 里有转换函数的 (``DateTime`` 用 ``core.str_time``)
+取值后先转换, ``converters`` 参数可以按字段覆盖.  转换函数也会收到 ``None``.
+缓存按字段和转换函数本身区分, 只保留最近用过的 :data:`MAX_SERIALIZERS` 个,
+每次调用都传新 lambda 的代码不会让缓存无限增长, 但每次都要重新生成;
+经常调用的地方用模块级的转换函数.
+"""
+from __future__ import absolute_import
+
+import re
+import keyword
+from collections import OrderedDict
+from threading import Lock
+
+from sqlalchemy import inspect
+from sqlalchemy.types import TypeDecorator
+
+#: 列类型 -> 转换函数, 按类型的 MRO 匹配, TypeDecorator 也匹配它的 impl
+converters = {}
+
+#: 缓存的 :class:`Serializer` 个数上限, 超出时丢掉最久没用的
+MAX_SERIALIZERS = 256
+
+_serializers = OrderedDict()
+_serializers_lock = Lock()
+
+
+def register_converter(type_, converter):
+    converters[type_] = converter
+
+
+class Serializer(object):
+    __slots__ = ('model', 'fields', 'one', 'many')
+
+    def __init__(self, model, fields, one, many):
+        self.model = model
+        self.fields = fields
+        self.one = one
+        self.many = many
+
+    def __repr__(self):
+        return '<Serializer %s %r>' % (self.model.__name__, self.fields)
+
+
+def compile_serializer(model, fields=None, exclude=None, converters=None):
+    """返回 ``model`` 的 :class:`Serializer`.  ``fields`` 默认是所有非 deferred
+    的列, 也可以包含其他属性 (原样输出)."""
+    key = (model, tuple(fields) if fields is not None else None,
+           frozenset(exclude or ()),
+           tuple(sorted((converters or {}).items())))
+    with _serializers_lock:
+        serializer = _serializers.pop(key, None)
+        if serializer is not None:
+            _serializers[key] = serializer
+            return serializer
+    serializer = _compile(model, fields, exclude or (), converters or {})
+    with _serializers_lock:
+        while len(_serializers) >= MAX_SERIALIZERS:
+            _serializers.popitem(last=False)
+        _serializers[key] = serializer
+    return serializer
+
+
+def _column_converter(mapper, name):
+    prop = mapper.column_attrs.get(name)
+    if prop is None:
+        return None
+    type_ = prop.columns[0].type
+    candidates = [type_]
+    if isinstance(type_, TypeDecorator):
+        candidates.append(type_.impl)
+    for candidate in candidates:
+        for cls in type(candidate).__mro__:
+            if cls in converters:
+                return converters[cls]
+    return None
+
+
+def _compile(model, fields, exclude, overrides):
+    mapper = inspect(model)
+    if fields is None:
+        fields = [prop.key for prop in mapper.column_attrs
+                  if not prop.deferred]
+    fields = tuple(name for name in fields if name not in exclude)
+
+    namespace = {}
+    items = []
+    for i, name in enumerate(fields):
+        if _is_identifier(name):
+            value = 'obj.%s' % name
+        else:
+            value = 'getattr(obj, %r)' % name
+        converter = overrides.get(name) or _column_converter(mapper, name)
+        if converter is not None:
+            namespace['c%d' % i] = converter
+            value = 'c%d(%s)' % (i, value)
+        items.append('%r: %s' % (name, value))
+    body = '{%s}' % ', '.join(items)
+
+    source = ('def one(obj):\n'
+              '    return %s\n'
+              'def many(rows):\n'
+              '    return [%s for obj in rows]\n') % (body, body)
+    code = compile(source, '<serializer %s>' % model.__name__, 'exec')
+    exec(code, namespace)
+    return Serializer(model, fields, namespace['one'], namespace['many'])
+
+
+def _is_identifier(name):
+    return (re.match(r'^[A-Za-z_][A-Za-z0-9_]*$', name) is not None and
+            not keyword.iskeyword(name))
@@ -25,18 +25,21 @@ class CalypsoEnv(object):
 environ = CalypsoEnv()
 
 
-class EnvConfigType(type):
-    def __getattribute__(cls, key):
-        value = object.__getattribute__(cls, key)
-        env = environ.get(key)
-
-        if env is not None:
-            value = type(value)(env)
-        return value
+def _env_value(default, env):
+    # 环境变量按默认值的类型转换
+    if isinstance(default, bool):
+        return env.lower() in ('1', 'true', 'yes', 'on')
+    if default is None:
+        return env
+    return type(default)(env)
 
 
 def load_tornado_settings(*modules):
     settings.update({'MODULES': modules})
+    return ConfigSnapshot(modules)
+
+
+def _build_config(modules, routes=False):
     kwargs = {}
     mods = []
     config = Config()
@@ -59,11 +62,83 @@ def load_tornado_settings(*modules):
         if hasattr(mod, 'load_settings'):
             getattr(mod, 'load_settings')(config, **kwargs)
 
+    if routes:
+        config.load_routes()
     return config
 
 
+class ConfigSnapshot(dict):
+    """``load_tornado_settings`` 的结果: 各模块 settings 加载完, 环境变量也
+    转换好之后的只读快照.  ``config['KEY']`` 和 ``config.KEY`` 都是一次 dict 查找.
+
+    已有的值不能修改, 扩展可以用 ``setdefault`` 加默认值.
+    :meth:`reload` 重新加载 settings 模块和环境变量, 原地替换内容.
+    settings 里用模块名注册的路由 (``config.update_uri('base.routes')``)
+    在 :meth:`load_routes` 之后才导入, 才出现在 ``URIS`` 和 ``ROUTES`` 里.
+    """
+
+    def __init__(self, modules, **overrides):
+        dict.__init__(self)
+        object.__setattr__(self, '_modules', modules)
+        object.__setattr__(self, '_overrides', {})
+        object.__setattr__(self, '_defaults', {})
+        object.__setattr__(self, '_routes', False)
+        self.reload(**overrides)
+
+    def reload(self, routes=None, **overrides):
+        """重新生成快照.  ``overrides`` (比如命令行参数) 覆盖配置,
+        之后每次 ``reload`` 都保留; ``setdefault`` 加的默认值也保留.
+        ``routes=True`` 导入路由模块, 之后每次 ``reload`` 都导入."""
+        if routes is not None:
+            object.__setattr__(self, '_routes', routes)
+        self._overrides.update(overrides)
+        config = _build_config(self._modules, self._routes)
+        values = dict((key, getattr(config, key))
+                      for key in dir(config) if key.isupper())
+        values.update(self._overrides)
+        for key, value in self._defaults.items():
+            values.setdefault(key, value)
+        for key in self:
+            del self.__dict__[key]
+        dict.clear(self)
+        dict.update(self, values)
+        self.__dict__.update(values)
+        return self
+
+    def load_routes(self):
+        return self.reload(routes=True)
+
+    def setdefault(self, key, default=None):
+        if key in self:
+            return self[key]
+        self._defaults[key] = default
+        dict.__setitem__(self, key, default)
+        self.__dict__[key] = default
+        return default
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError('config is read-only, use config.reload(KEY=value)')
+
+    __setattr__ = __setitem__ = __delattr__ = __delitem__ = _readonly
+    update = pop = popitem = clear = _readonly
+
+
 class Config(object):
-    __metaclass__ = EnvConfigType
+    """加载 settings 时用的可写配置, 类属性是默认值, 可以用同名的环境变量覆盖"""
+
+    def __init__(self):
+        cls = type(self)
+        for key in dir(cls):
+            if not key.isupper():
+                continue
+            value = getattr(cls, key)
+            env = environ.get(key)
+            if env is not None:
+                value = _env_value(value, env)
+            elif isinstance(value, list):
+                # URIS/ROUTES 每次加载重新生成
+                value = list(value)
+            setattr(self, key, value)
 
     def __getitem__(self, item):
         return getattr(self, item)
@@ -96,11 +171,27 @@ class Config(object):
         return route['urls'][0], route['resource']
 
     def update_uri(self, routes, url_prefix=r''):
+        if isinstance(routes, basestring):
+            # 路由模块名, 导入 handler 要加载很多模块, 构造 app 时才导入
+            self.ROUTE_MODULES.append((routes, url_prefix))
+            return
         self.ROUTES.extend(routes)
         self.URIS.extend([self.uri_tuple(r, url_prefix) for r in routes])
+        for route in routes:
+            # 装饰器链每个 handler 类只生成一次, 见 RequestHandler.compile_methods
+            resource = route['resource']
+            if hasattr(resource, 'compile_methods'):
+                resource.compile_methods()
+
+    def load_routes(self):
+        for module, url_prefix in self.ROUTE_MODULES:
+            routes = importlib.import_module(module).routes
+            self.update_uri(routes, url_prefix)
+        self.ROUTE_MODULES = []
 
     URIS = []
     ROUTES = []
+    ROUTE_MODULES = []
 
     DB_HOST = 'localhost'
     DB_USER = 'root'
@@ -109,3 +200,15 @@ class Config(object):
     DB_PORT = '3306'
     SQLALCHEMY_DATABASE_URI = 'mysql://%s:%s@%s:%s/%s?charset=utf8' % (DB_USER, DB_PWD, DB_HOST, DB_PORT, DB_NAME)
     SQLALCHEMY_TRACK_MODIFICATIONS = True
+    SQLALCHEMY_POOL_PREWARM = False
+    # 所有 worker 对每个数据库最多打开的连接数, None 不限制.
+    # supervisor 替换 worker 期间 (回收, SIGHUP) 最多会到两倍
+    SQLALCHEMY_CONNECTION_BUDGET = None
+    # 多台机器部署时每台配置不同的值, 见 core.ids
+    ID_WORKER_BASE = 0
+    # /_internal/* 接口的口令 (请求头 X-Internal-Token), None 时不能访问
+    INTERNAL_TOKEN = None
+    # 在 nginx 后面时设为 True: 客户端 IP 取 nginx 设置的 X-Real-IP /
+    # X-Forwarded-For (见 etc/nginx.conf), 否则所有请求都是 127.0.0.1.
+    # 直接对外监听时不能打开, 客户端可以伪造这些请求头
+    XHEADERS = False
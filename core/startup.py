@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""启动耗时分析, ``python manage.py startup-profile [run|db]`` 调用::
+
+    python core/startup.py run
+
+按脚本运行, 不先导入 ``core`` 包.  在新的进程里记录每个模块的导入时间 (包括它导入的其它模块) 和
+自身时间 (不包括), 再按命令的方式构造 app, 最后按自身时间排序输出.
+"""
+from __future__ import absolute_import, print_function
+
+import os
+import sys
+import time
+import pkgutil
+
+
+class ImportProfiler(object):
+    """放在 ``sys.meta_path`` 最前面, 记录 ``with`` 里第一次导入的模块"""
+
+    def __init__(self):
+        self.modules = {}
+        self._loaders = {}
+        self._finding = set()
+        self._stack = []
+
+    def __enter__(self):
+        sys.meta_path.insert(0, self)
+        return self
+
+    def __exit__(self, *exc_info):
+        sys.meta_path.remove(self)
+
+    def find_module(self, fullname, path=None):
+        # 用标准的查找方式, 找到了就由自己计时加载
+        if fullname in self._finding:
+            return None
+        self._finding.add(fullname)
+        try:
+            loader = pkgutil.find_loader(fullname)
+        except ImportError:
+            return None
+        finally:
+            self._finding.discard(fullname)
+        if loader is None:
+            return None
+        self._loaders[fullname] = loader
+        return self
+
+    def load_module(self, fullname):
+        start = time.time()
+        self._stack.append(0.0)
+        try:
+            return self._loaders.pop(fullname).load_module(fullname)
+        finally:
+            elapsed = time.time() - start
+            children = self._stack.pop()
+            if self._stack:
+                self._stack[-1] += elapsed
+            self.modules[fullname] = (elapsed, elapsed - children)
+
+    def report(self, limit=30, out=None):
+        out = out or sys.stdout
+        total = sum(own for _, own in self.modules.values())
+        print('%10s %10s  %s' % ('self_ms', 'cumul_ms', 'module'), file=out)
+        rows = sorted(self.modules.items(), key=lambda i: -i[1][1])
+        for module, (cumulative, own) in rows[:limit]:
+            print('%10.1f %10.1f  %s' % (own * 1000, cumulative * 1000,
+                                         module), file=out)
+        print('%10.1f %10s  %d modules' % (total * 1000, '', len(rows)),
+              file=out)
+
+
+def profile(command, limit=30):
+    profiler = ImportProfiler()
+    phases = []
+    start = time.time()
+    with profiler:
+        import manage
+        phases.append(('import manage', time.time() - start))
+        manage.build_app(command)
+        phases.append(('build app for %s' % command, time.time() - start))
+    profiler.report(limit)
+    print()
+    last = 0
+    for name, elapsed in phases:
+        print('%10.1f %10.1f  %s' % ((elapsed - last) * 1000, elapsed * 1000,
+                                     name))
+        last = elapsed
+
+
+if __name__ == '__main__':
+    sys.path[0] = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    profile(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 30)
@@ -0,0 +1,376 @@
+# -*- coding: utf-8 -*-
+"""多进程模式的 supervisor, 代替 ``http_server.start(n)``::
+
+    python manage.py run -w 4 --supervise --max-requests 10000 --max-rss 512
+
+- 每个 worker 用 ``SO_REUSEPORT`` 自己监听端口 (系统不支持时由 supervisor 监听, worker 继承)
+- worker 异常退出后重启, 连续失败时等待时间从 ``backoff`` 秒开始加倍, 最多 ``max_backoff`` 秒
+- worker 处理了 ``max_requests`` 个请求或内存 (RSS) 超过 ``max_rss`` MB 后,
+  先启动替换它的 worker, 再让它退出
+- ``SIGHUP``: supervisor 重新执行自己 (加载新代码), 新 worker 都启动后旧 worker 退出
+- ``SIGTERM`` / ``SIGINT``: 所有 worker 退出后 supervisor 退出
+
+每个 worker 的 task id (``tornado.process.task_id``, ``core.ids`` 的 worker 号)
+是还没退出的 worker 都没用的最小编号, 不是 slot: 替换期间同一个 slot 的新旧 worker
+同时在处理请求, 编号不同才不会生成重复的 ID.  所以 task id 最大可能到 ``2 * workers - 1``.
+同样, 替换期间一个 slot 的连接数最多是两倍, 见 ``SQLALCHEMY_CONNECTION_BUDGET``.
+
+worker 收到 ``SIGTERM`` 后停止监听, 关闭 websocket (1001), 等正在处理的请求结束,
+最多等 ``drain_timeout`` 秒.
+"""
+from __future__ import absolute_import
+
+import os
+import sys
+import time
+import errno
+import fcntl
+import select
+import signal
+import socket
+import logging
+import resource
+
+import tornado.process
+from tornado.httpserver import HTTPServer
+from tornado.ioloop import IOLoop, PeriodicCallback
+from tornado.netutil import bind_sockets
+
+from . import database
+from .handler import RequestHandler, WebSocketHandler
+
+logger = logging.getLogger(__name__)
+
+#: 传给重新执行的 supervisor: 需要退出的旧 worker (pid:task id) 和继承的监听 socket
+OLD_WORKERS_ENV = 'SPRING_SUPERVISOR_OLD_WORKERS'
+SOCKETS_ENV = 'SPRING_SUPERVISOR_SOCKETS'
+
+READY = b'ready\n'
+RECYCLE = b'recycle\n'
+
+
+class _Worker(object):
+    def __init__(self, slot, task, pid, fd):
+        self.slot = slot
+        self.task = task
+        self.pid = pid
+        self.fd = fd
+        self.started = time.time()
+        self.ready = False
+        self.retiring = False
+
+
+class Supervisor(object):
+    def __init__(self, app, port, workers, max_requests=None, max_rss=None,
+                 drain_timeout=30, backoff=1, max_backoff=60,
+                 on_worker_start=None, server_options=None):
+        self.app = app
+        self.port = port
+        self.size = workers
+        self.max_requests = max_requests
+        self.max_rss = max_rss
+        self.drain_timeout = drain_timeout
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.on_worker_start = on_worker_start
+        self.server_options = server_options or {}
+        self.workers = []
+        self.sockets = None
+        self.running = True
+        self.reloading = False
+        self._failures = [0] * workers
+        self._next_start = [0] * workers
+
+    # supervisor
+
+    def run(self):
+        self.sockets = self._inherited_sockets()
+        if self.sockets is None and not hasattr(socket, 'SO_REUSEPORT'):
+            self.sockets = bind_sockets(self.port)
+        for item in _split(os.environ.pop(OLD_WORKERS_ENV, '')):
+            pid, task = [int(part) for part in item.split(':')]
+            old = _Worker(None, task, pid, None)
+            old.retiring = True
+            self.workers.append(old)
+
+        signal.signal(signal.SIGHUP, self._on_reload)
+        signal.signal(signal.SIGTERM, self._on_stop)
+        signal.signal(signal.SIGINT, self._on_stop)
+        logger.info('supervisor %d serving port %s with %d workers',
+                    os.getpid(), self.port, self.size)
+
+        while self.running or self.workers:
+            if self.reloading and self.running:
+                self._reexec()
+            self._reap()
+            if self.running:
+                self._spawn_missing()
+            self._read_messages(0.5)
+        logger.info('supervisor %d stopped', os.getpid())
+
+    def _on_reload(self, signum, frame):
+        self.reloading = True
+
+    def _on_stop(self, signum, frame):
+        if self.running:
+            self.running = False
+            for worker in self.workers:
+                _kill(worker.pid, signal.SIGTERM)
+
+    def _spawn_missing(self):
+        now = time.time()
+        for slot in range(self.size):
+            if now < self._next_start[slot]:
+                continue
+            if not any(w.slot == slot and not w.retiring
+                       for w in self.workers):
+                self._spawn(slot)
+
+    def _free_task(self):
+        # 旧 worker 退出之前它的编号不能再用
+        used = set(w.task for w in self.workers)
+        task = 0
+        while task in used:
+            task += 1
+        return task
+
+    def _spawn(self, slot):
+        task = self._free_task()
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            for worker in self.workers:
+                if worker.fd is not None:
+                    os.close(worker.fd)
+            code = 1
+            try:
+                code = Worker(self, slot, task, write_fd).run()
+            except Exception:
+                logger.exception('worker %d failed', slot)
+            finally:
+                os._exit(code)
+        os.close(write_fd)
+        _set_close_exec(read_fd)
+        self.workers.append(_Worker(slot, task, pid, read_fd))
+        logger.info('started worker %d (pid %d, task %d)', slot, pid, task)
+
+    def _read_messages(self, timeout):
+        fds = dict((w.fd, w) for w in self.workers if w.fd is not None)
+        try:
+            readable = select.select(list(fds), [], [], timeout)[0]
+        except (select.error, OSError) as e:
+            if e.args[0] != errno.EINTR:
+                raise
+            return
+        for fd in readable:
+            worker = fds[fd]
+            data = os.read(fd, 4096)
+            if not data:
+                os.close(fd)
+                worker.fd = None
+                continue
+            if READY in data:
+                worker.ready = True
+                self._retire_replaced(worker.slot)
+            if RECYCLE in data and not worker.retiring and self.running:
+                logger.info('recycling worker %d (pid %d)',
+                            worker.slot, worker.pid)
+                worker.retiring = True
+                self._spawn(worker.slot)
+
+    def _retire_replaced(self, slot):
+        # 替换的 worker 准备好之后再让旧的退出
+        if slot is None:
+            return
+        for worker in self.workers:
+            if worker.slot == slot and worker.retiring:
+                _kill(worker.pid, signal.SIGTERM)
+        if all(w.ready for w in self.workers if not w.retiring):
+            for worker in self.workers:
+                if worker.slot is None:
+                    _kill(worker.pid, signal.SIGTERM)
+
+    def _reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except OSError as e:
+                if e.errno == errno.ECHILD:
+                    return
+                raise
+            if pid == 0:
+                return
+            for worker in self.workers:
+                if worker.pid == pid:
+                    break
+            else:
+                continue
+            self.workers.remove(worker)
+            if worker.fd is not None:
+                os.close(worker.fd)
+            self._exited(worker, status)
+
+    def _exited(self, worker, status):
+        if worker.slot is None:
+            return
+        clean = os.WIFEXITED(status) and os.WEXITSTATUS(status) == 0
+        if clean or worker.retiring or not self.running:
+            logger.info('worker %d (pid %d) exited', worker.slot, worker.pid)
+            return
+        if time.time() - worker.started > self.max_backoff:
+            self._failures[worker.slot] = 0
+        delay = min(self.backoff * 2 ** self._failures[worker.slot],
+                    self.max_backoff)
+        self._failures[worker.slot] += 1
+        self._next_start[worker.slot] = time.time() + delay
+        if os.WIFSIGNALED(status):
+            reason = 'signal %d' % os.WTERMSIG(status)
+        else:
+            reason = 'exit code %d' % os.WEXITSTATUS(status)
+        logger.warning('worker %d (pid %d) died with %s, restarting in %ss',
+                       worker.slot, worker.pid, reason, delay)
+
+    def _reexec(self):
+        logger.info('supervisor %d reloading', os.getpid())
+        env = dict(os.environ)
+        env[OLD_WORKERS_ENV] = ','.join(
+            '%d:%d' % (w.pid, w.task) for w in self.workers)
+        if self.sockets is not None:
+            for sock in self.sockets:
+                _set_close_exec(sock.fileno(), False)
+            env[SOCKETS_ENV] = ','.join(
+                '%d:%d' % (s.fileno(), s.family) for s in self.sockets)
+        os.execve(sys.executable, [sys.executable] + sys.argv, env)
+
+    def _inherited_sockets(self):
+        value = os.environ.pop(SOCKETS_ENV, '')
+        if not value:
+            return None
+        sockets = []
+        for item in _split(value):
+            fd, family = [int(part) for part in item.split(':')]
+            sock = socket.fromfd(fd, family, socket.SOCK_STREAM)
+            os.close(fd)
+            sock.setblocking(0)
+            sockets.append(sock)
+        return sockets
+
+
+class Worker(object):
+    """fork 出来的 worker 进程"""
+
+    def __init__(self, supervisor, slot, task, fd):
+        self.supervisor = supervisor
+        self.slot = slot
+        self.task = task
+        self.fd = fd
+        self.requests = 0
+        self.draining = False
+        self.server = None
+
+    def run(self):
+        supervisor = self.supervisor
+        # 和 fork_processes 一样设置 task id, 见 tornado.process.task_id
+        tornado.process._task_id = self.task
+        tornado.process._reseed_random()
+        database.after_fork()
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, self._on_term)
+
+        IOLoop.clear_instance()
+        io_loop = IOLoop()
+        io_loop.make_current()
+        sockets = supervisor.sockets
+        if sockets is None:
+            sockets = bind_sockets(supervisor.port, reuse_port=True)
+        self.server = HTTPServer(supervisor.app, **supervisor.server_options)
+        self.server.add_sockets(sockets)
+        supervisor.app.teardown_request(self._count)
+        if supervisor.on_worker_start is not None:
+            supervisor.on_worker_start()
+        if supervisor.max_rss:
+            PeriodicCallback(self._check_rss, 5000).start()
+        os.write(self.fd, READY)
+        io_loop.start()
+        return 0
+
+    def _on_term(self, signum, frame):
+        IOLoop.current().add_callback_from_signal(self.drain)
+
+    def _count(self, response_or_exc):
+        self.requests += 1
+        limit = self.supervisor.max_requests
+        if limit and self.requests == limit:
+            self._recycle('served %d requests' % self.requests)
+        return response_or_exc
+
+    def _check_rss(self):
+        rss = _rss_bytes()
+        if rss > self.supervisor.max_rss * 1024 * 1024:
+            self._recycle('RSS %.0f MB' % (rss / 1048576.0))
+
+    def _recycle(self, reason):
+        logger.info('worker %d asks to be recycled: %s', self.slot, reason)
+        try:
+            os.write(self.fd, RECYCLE)
+        except OSError:
+            # supervisor 不在了, 自己退出
+            self.drain()
+
+    def drain(self):
+        if self.draining:
+            return
+        self.draining = True
+        if self.server is None:
+            os._exit(0)
+        logger.info('worker %d draining %d requests, %d websockets',
+                    self.slot, len(RequestHandler.active),
+                    len(WebSocketHandler.connections))
+        self.server.stop()
+        for connection in list(WebSocketHandler.connections):
+            connection.close(1001, 'server restarting')
+        deadline = time.time() + self.supervisor.drain_timeout
+        io_loop = IOLoop.current()
+
+        def check():
+            idle = (not RequestHandler.active and
+                    not self.supervisor.app.teardown_pipeline.pending and
+                    not WebSocketHandler.connections)
+            if idle or time.time() > deadline:
+                io_loop.stop()
+            else:
+                io_loop.call_later(0.1, check)
+
+        check()
+
+
+def _rss_bytes():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except (IOError, OSError):
+        # 取不到当前值时用峰值
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _set_close_exec(fd, close=True):
+    flags = fcntl.fcntl(fd, fcntl.F_GETFD)
+    if close:
+        flags |= fcntl.FD_CLOEXEC
+    else:
+        flags &= ~fcntl.FD_CLOEXEC
+    fcntl.fcntl(fd, fcntl.F_SETFD, flags)
+
+
+def _kill(pid, signum):
+    try:
+        os.kill(pid, signum)
+    except OSError as e:
+        if e.errno != errno.ESRCH:
+            raise
+
+
+def _split(value):
+    return [item for item in value.split(',') if item]
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""请求结束后的 teardown hook, ``Application.teardown_request`` 注册, 由
+``RequestHandler.on_finish`` 在响应发送后运行:
+
+- hook 按 ``order`` 从小到大依次运行, ``order`` 相同时按注册顺序
+- hook 可以是普通函数, 也可以返回 Future (``gen.coroutine``, ``db.run`` 等),
+  返回的 Future 等它完成后才运行下一个 hook, 但不阻塞 IOLoop
+- ``timeout`` (秒) 限制 Future 的等待时间; 普通函数没法中断, 超时只记录
+- ``defer=True`` 的 hook (清理 session, 写统计等) 在所有其它 hook 之后, 先让
+  IOLoop 处理已经到达的请求再运行
+
+hook 在请求的 stack context 里运行, ``connection_stack.top`` 仍是这个请求,
+每个 hook 的耗时, 超时和出错次数记在 hook 上, 见
+:meth:`TeardownPipeline.snapshot`.
+"""
+from __future__ import absolute_import
+
+import logging
+import time
+from datetime import timedelta
+
+from tornado import gen
+from tornado.concurrent import is_future
+from tornado.ioloop import IOLoop
+
+from .database.stats import Histogram
+
+logger = logging.getLogger(__name__)
+
+
+def teardown_options(order=0, timeout=None, defer=False):
+    """给 hook 函数设置默认的运行方式, ``teardown_request(func)`` 注册时使用::
+
+        @app.teardown_request
+        @teardown_options(defer=True, timeout=5)
+        def shutdown_session(response_or_exc):
+            ...
+    """
+    def decorator(func):
+        func.teardown_options = dict(order=order, timeout=timeout,
+                                     defer=defer)
+        return func
+    return decorator
+
+
+class Hook(object):
+    __slots__ = ('func', 'name', 'order', 'timeout', 'defer', 'histogram',
+                 'timeouts', 'errors')
+
+    def __init__(self, func, order=0, timeout=None, defer=False):
+        self.func = func
+        self.name = '%s.%s' % (getattr(func, '__module__', None),
+                               getattr(func, '__name__', repr(func)))
+        self.order = order
+        self.timeout = timeout
+        self.defer = defer
+        self.histogram = Histogram()
+        self.timeouts = 0
+        self.errors = 0
+
+    def to_dict(self):
+        data = self.histogram.to_dict()
+        del data['rows']
+        data.update(hook=self.name, order=self.order, defer=self.defer,
+                    timeout=self.timeout, timeouts=self.timeouts,
+                    errors=self.errors)
+        return data
+
+
+class TeardownPipeline(object):
+    def __init__(self):
+        self.hooks = []
+        #: 还没有运行完的请求数, worker 退出前等它变成 0
+        self.pending = 0
+        self._critical = []
+        self._deferred = []
+
+    def add(self, func, order=None, timeout=None, defer=None):
+        """参数是 None 时用 :func:`teardown_options` 设置的值"""
+        options = dict(getattr(func, 'teardown_options', None) or {})
+        for key, value in [('order', order), ('timeout', timeout),
+                           ('defer', defer)]:
+            if value is not None:
+                options[key] = value
+        self.hooks.append(Hook(func, **options))
+        hooks = sorted(self.hooks, key=lambda hook: hook.order)
+        self._critical = [hook for hook in hooks if not hook.defer]
+        self._deferred = [hook for hook in hooks if hook.defer]
+        return func
+
+    def __iter__(self):
+        return iter(self._critical + self._deferred)
+
+    def run(self, response_or_exc):
+        """同步的 hook 在返回前运行完; 有 hook 返回 Future 或者有 defer 的 hook
+        时, 剩下的在 IOLoop 里接着运行"""
+        critical = self._critical
+        for index, hook in enumerate(critical):
+            waiting = self._call(hook, response_or_exc)
+            if waiting is not None:
+                self.pending += 1
+                self._resume(waiting, critical[index + 1:], response_or_exc)
+                return
+        if self._deferred:
+            self.pending += 1
+            # 回到 IOLoop, 已经可读的连接先处理
+            IOLoop.current().add_callback(self._run_deferred, response_or_exc)
+
+    @gen.coroutine
+    def _resume(self, waiting, hooks, response_or_exc):
+        try:
+            yield waiting
+            yield self._run_hooks(hooks, response_or_exc)
+            if self._deferred:
+                yield gen.moment
+                yield self._run_hooks(self._deferred, response_or_exc)
+        finally:
+            self.pending -= 1
+
+    @gen.coroutine
+    def _run_deferred(self, response_or_exc):
+        try:
+            yield self._run_hooks(self._deferred, response_or_exc)
+        finally:
+            self.pending -= 1
+
+    @gen.coroutine
+    def _run_hooks(self, hooks, response_or_exc):
+        for hook in hooks:
+            waiting = self._call(hook, response_or_exc)
+            if waiting is not None:
+                yield waiting
+
+    def _call(self, hook, response_or_exc):
+        start = time.time()
+        try:
+            result = hook.func(response_or_exc)
+        except Exception:
+            hook.errors += 1
+            logger.exception('teardown hook %s failed', hook.name)
+            result = None
+        # Flask 风格的 hook 返回 response_or_exc
+        if result is not response_or_exc and is_future(result):
+            if hook.timeout:
+                result = gen.with_timeout(timedelta(seconds=hook.timeout),
+                                          result)
+            return self._wait(hook, result, start)
+        ms = self._record(hook, start)
+        if hook.timeout and ms > hook.timeout * 1000:
+            logger.warning('teardown hook %s took %.0f ms, over its %ss limit',
+                           hook.name, ms, hook.timeout)
+        return None
+
+    @gen.coroutine
+    def _wait(self, hook, future, start):
+        try:
+            yield future
+        except gen.TimeoutError:
+            hook.timeouts += 1
+            logger.warning('teardown hook %s timed out after %ss',
+                           hook.name, hook.timeout)
+        except Exception:
+            hook.errors += 1
+            logger.exception('teardown hook %s failed', hook.name)
+        self._record(hook, start)
+
+    def _record(self, hook, start):
+        ms = (time.time() - start) * 1000
+        hook.histogram.add(ms, 0)
+        return ms
+
+    def snapshot(self):
+        return {
+            'hooks': [hook.to_dict() for hook in self],
+            'pending': self.pending,
+        }
+
+    def reset(self):
+        for hook in self.hooks:
+            hook.histogram = Histogram()
+            hook.timeouts = hook.errors = 0
@@ -1,52 +1,98 @@
 # -*- coding: utf-8 -*-
 
 import os
-import tornado.httpserver
-import tornado.ioloop
-import tornado.web
-import tornado.options
-import tornado.websocket
 from core.settings import load_tornado_settings
-from core import db, migrate
+from core import db, database, migrate, ids
 
 modules = ['base', 'test', 'ws']
+# 只加载 settings, 路由模块在 make_app 时才导入
 config = load_tornado_settings(*modules)
 
+STATIC_PATH = os.path.join(os.path.dirname(__file__), "static")
 
-class Application(tornado.web.Application):
-    teardown_request_funcs = []
 
-    def __init__(self, url_list, import_name, **app_settings):
-        tornado.web.Application.__init__(self, url_list, **app_settings)
+class CommandApp(object):
+    """``make_app(routes=False)`` 返回的 app: 只有配置和数据库扩展"""
+
+    def __init__(self, import_name):
+        from core.teardown import TeardownPipeline
+
+        self.teardown_pipeline = TeardownPipeline()
         self.config = config
         self.import_name = import_name
 
-    def teardown_request(self, f):
-        self.teardown_request_funcs.append(f)
-        return f
+    def teardown_request(self, f=None, **options):
+        """注册请求结束后运行的函数, ``options`` 见 ``TeardownPipeline.add``::
 
+            @app.teardown_request(defer=True, timeout=2)
+            def flush(response_or_exc):
+                ...
+        """
+        if f is None:
+            return lambda f: self.teardown_pipeline.add(f, **options)
+        return self.teardown_pipeline.add(f, **options)
 
-def make_app(**kwargs):
-    import socket
-    socket.setdefaulttimeout(kwargs.get('timeout', 2))
-    if kwargs:
-        config.DEBUG = kwargs.get('debug')
-        config.DOC = kwargs.get('doc')
-        config.PORT = kwargs.get('port')
-        config.WORKER = kwargs.get('worker')
 
-    url_list = []
-    url_list.extend(config.URIS)
+def _application_class():
+    """tornado.web 和只有服务用到的模块在这里导入, 数据库迁移等命令不加载它们"""
+    import tornado.web
+    from core import routing
 
-    app_settings = {
-        "cookie_secret": "bZJc2sWbQLKos6GkHn/VB9oXwQt8S0R0kRvJ5/xJ89E=",
-        "static_path": os.path.join(os.path.dirname(__file__), "static")
-    }
+    class Application(tornado.web.Application, CommandApp):
+        def __init__(self, url_list, import_name, **app_settings):
+            tornado.web.Application.__init__(self, url_list, **app_settings)
+            CommandApp.__init__(self, import_name)
+            self.router = routing.install(self)
+            self.admission = None
 
-    app = Application(url_list, __name__,
-                      debug=config.DEBUG,
-                      **app_settings)
+    return Application
 
+
+def make_app(routes=True, **kwargs):
+    """``routes=False`` 不导入路由模块和 tornado.web, 只构造配置和数据库扩展
+    (数据库迁移等命令用)"""
+    import socket
+    socket.setdefaulttimeout(kwargs.get('timeout', 2))
+    overrides = {}
+    if kwargs:
+        overrides.update(
+            DEBUG=kwargs.get('debug'),
+            DOC=kwargs.get('doc'),
+            PORT=kwargs.get('port'),
+            WORKER=kwargs.get('worker'))
+        # 命令行没有指定时用 settings 里的值
+        for key, option in (('SQLALCHEMY_POOL_PREWARM', 'prewarm'),
+                            ('SQLALCHEMY_CONNECTION_BUDGET', 'db_budget')):
+            if kwargs.get(option) is not None:
+                overrides[key] = kwargs[option]
+    # 每个 worker 进程的连接池按 SQLALCHEMY_CONNECTION_BUDGET 平分
+    workers = overrides.get('WORKER', config.WORKER)
+    if not workers:
+        from tornado.process import cpu_count
+        workers = cpu_count()
+    overrides['SQLALCHEMY_POOL_WORKERS'] = workers
+    config.reload(routes=routes or None, **overrides)
+    ids.generator.configure(worker_base=config.ID_WORKER_BASE)
+
+    if routes:
+        from core import compression, admission
+
+        url_list = []
+        url_list.extend(config.URIS)
+
+        app_settings = {
+            "cookie_secret": "bZJc2sWbQLKos6GkHn/VB9oXwQt8S0R0kRvJ5/xJ89E=",
+            "static_path": STATIC_PATH,
+            "static_handler_class": compression.StaticFileHandler,
+        }
+
+        app = _application_class()(url_list, __name__,
+                                   debug=config.DEBUG,
+                                   **app_settings)
+        compression.init_app(app)
+        admission.init_app(app)
+    else:
+        app = CommandApp(__name__)
     db.init_app(app)
     db.app = app
     migrate.init_app(app, db)
@@ -54,11 +100,35 @@ def make_app(**kwargs):
 
 
 def main(**kwargs):
+    import tornado.httpserver
+    import tornado.ioloop
+    from tornado.process import task_id
+
     app = make_app(**kwargs)
 
-    http_server = tornado.httpserver.HTTPServer(app)
+    if kwargs.get('supervise'):
+        from core.supervisor import Supervisor
+
+        prewarm = None
+        if config.SQLALCHEMY_POOL_PREWARM:
+            prewarm = lambda: db.prewarm(app)
+        Supervisor(app, config.PORT, config.SQLALCHEMY_POOL_WORKERS,
+                   max_requests=kwargs.get('max_requests'),
+                   max_rss=kwargs.get('max_rss'),
+                   drain_timeout=kwargs.get('drain_timeout', 30),
+                   on_worker_start=prewarm,
+                   server_options={'xheaders': config.XHEADERS}).run()
+        return
+
+    http_server = tornado.httpserver.HTTPServer(app, xheaders=config.XHEADERS)
     http_server.bind(config.PORT)
     http_server.start(config.WORKER)
+    if task_id() is not None:
+        # fork 出来的 worker 丢掉父进程的引擎和 session
+        database.after_fork()
+    if config.SQLALCHEMY_POOL_PREWARM:
+        # fork 之后再建立连接, 子进程不共享连接
+        db.prewarm(app)
     tornado.ioloop.IOLoop.current().start()
 
 
@@ -1,11 +1,52 @@
+# -*- coding: utf-8 -*-
 import click
-from main import main, make_app
-from core.migrate.cli import db
-app = make_app()
 
-@click.group()
-def manage():
-    pass
+# 用到时才导入的命令和它们的说明; 导入 manage 和 --help 不加载 settings, 路由和数据库
+lazy_commands = {
+    'db': ('core.migrate.cli:db', 'Perform database migrations.'),
+}
+
+
+class LazyGroup(click.Group):
+    def list_commands(self, ctx):
+        commands = click.Group.list_commands(self, ctx)
+        return sorted(set(commands) | set(lazy_commands))
+
+    def get_command(self, ctx, name):
+        if name in lazy_commands and name not in self.commands:
+            import importlib
+
+            module, attr = lazy_commands[name][0].split(':')
+            command = getattr(importlib.import_module(module), attr)
+            self.add_command(command, name)
+        return click.Group.get_command(self, ctx, name)
+
+    def format_commands(self, ctx, formatter):
+        rows = []
+        for name in self.list_commands(ctx):
+            if name in lazy_commands and name not in self.commands:
+                rows.append((name, lazy_commands[name][1]))
+                continue
+            command = self.get_command(ctx, name)
+            if command is not None and not command.hidden:
+                limit = formatter.width - 6 - len(name)
+                rows.append((name, command.get_short_help_str(limit)))
+        if rows:
+            with formatter.section('Commands'):
+                formatter.write_dl(rows)
+
+
+def build_app(command):
+    """每个命令构造自己需要的 app: db 命令不导入路由模块"""
+    from main import make_app
+    return make_app(routes=command != 'db')
+
+
+@click.group(cls=LazyGroup)
+@click.pass_context
+def manage(ctx):
+    if ctx.invoked_subcommand == 'db':
+        build_app('db')
 
 @click.command()
 @click.option('-p', '--port', default=8000,
@@ -18,11 +59,99 @@ def manage():
               help=('debug mode default Fals'))
 @click.option('--timeout', default=2,
               help=('server timeout default 2'))
+@click.option('--prewarm', default=None, is_flag=True,
+              help=('open the database pool before serving default '
+                    'SQLALCHEMY_POOL_PREWARM'))
+@click.option('--db-budget', default=None, type=int,
+              help=('max connections to each database, shared by all '
+                    'workers default SQLALCHEMY_CONNECTION_BUDGET'))
+@click.option('--supervise', default=False, is_flag=True,
+              help=('restart, recycle and reload (SIGHUP) workers '
+                    'default False'))
+@click.option('--max-requests', default=None, type=int,
+              help=('recycle a supervised worker after this many requests '
+                    'default never'))
+@click.option('--max-rss', default=None, type=int,
+              help=('recycle a supervised worker above this RSS in MB '
+                    'default never'))
+@click.option('--drain-timeout', default=30,
+              help=('seconds a stopping worker waits for requests and '
+                    'websockets default 30'))
 def run(**kwargs):
+    from main import main
     main(**kwargs)
 
+
+@click.command()
+@click.option('-p', '--port', default=8000,
+              help=('port of the running server default 8000'))
+@click.option('-n', '--limit', default=20,
+              help=('number of statements and endpoints to show default 20'))
+@click.option('--reset', default=False, is_flag=True,
+              help=('clear the statistics after showing them'))
+def query_stats(port, limit, reset):
+    """Show the query statistics of a running worker."""
+    import json
+    import urllib2
+    from main import config
+
+    url = 'http://127.0.0.1:%s/_internal/query_stats' % port
+    headers = {'X-Internal-Token': config.INTERNAL_TOKEN or ''}
+    stats = json.load(urllib2.urlopen(urllib2.Request(url, headers=headers)))
+    row = '%8s %10s %9s %9s %9s %9s  %s'
+    header = row % ('count', 'total_ms', 'mean_ms', 'p95_ms', 'max_ms',
+                    'rows', '%s')
+    click.echo(header % 'statement')
+    for item in stats['fingerprints'][:limit]:
+        click.echo(row % (item['count'], item['total_ms'], item['mean_ms'],
+                          item['p95_ms'], item['max_ms'], item['rows'],
+                          item['fingerprint']))
+        for site, count in item['call_sites']:
+            click.echo('%58s %s (%s)' % ('', site, count))
+    click.echo('')
+    click.echo(header % 'endpoint')
+    for item in stats['endpoints'][:limit]:
+        click.echo(row % (item['count'], item['total_ms'], item['mean_ms'],
+                          item['p95_ms'], item['max_ms'], item['rows'],
+                          item['endpoint']))
+    if reset:
+        request = urllib2.Request(url, headers=headers)
+        request.get_method = lambda: 'DELETE'
+        urllib2.urlopen(request)
+
+
+@click.command()
+@click.argument('command', default='run', type=click.Choice(['run', 'db']))
+@click.option('-n', '--limit', default=30,
+              help=('number of modules to show default 30'))
+def startup_profile(command, limit):
+    """Show the import time of each module when starting a command."""
+    import os
+    import sys
+    import subprocess
+
+    # 在新的进程里统计, 当前进程已经导入的模块不算
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          'core', 'startup.py')
+    sys.exit(subprocess.call([sys.executable, script, command, str(limit)]))
+
+@click.command()
+def compress_static():
+    """Write .br/.gz copies of the compressible files under static/."""
+    from main import config, STATIC_PATH
+    from core import compression
+
+    policy = compression.load_config(config)
+    written = compression.precompress(STATIC_PATH, policy)
+    for path, encoding, size, compressed in written:
+        click.echo('%8d -> %8d  %s%s' % (size, compressed, path,
+                                          compression.EXTENSIONS[encoding]))
+    click.echo('%d files written' % len(written))
+
 manage.add_command(run, 'run')
-manage.add_command(db, 'db')
+manage.add_command(query_stats, 'query-stats')
+manage.add_command(startup_profile, 'startup-profile')
+manage.add_command(compress_static, 'compress-static')
 
 if __name__ == '__main__':
     manage()
\ No newline at end of file
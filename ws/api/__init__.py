@@ -1,8 +1,8 @@
 # -*- coding: utf-8 -*-
-import tornado.websocket
+from core.handler import WebSocketHandler
 
 
-class WSHandler(tornado.websocket.WebSocketHandler):
+class WSHandler(WebSocketHandler):
 
     def check_origin(self, origin):
         return True
\ No newline at end of file
@@ -12,8 +12,4 @@ settings = {}
 
 def load_settings(config):
     config.update(**settings)
-    try:
-        from .routes import routes
-        config.update_uri(routes, url_prefix)
-    except:
-        pass
+    config.update_uri('ws.routes', url_prefix)